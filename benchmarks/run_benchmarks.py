@@ -0,0 +1,227 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+"""
+BENCHMARK SUITE FOR THE HOT PATHS OF THE REPOSITORY
+
+RUNS EVERY BENCHMARK AGAINST THE RECORDED RESPONSES IN benchmarks/fixtures, PRINTS THE MEDIAN TIME PER CALL AND
+COMPARES IT TO THE PINNED BASELINE IN benchmarks/baseline.json (TRACKED IN GIT). A BENCHMARK MISSING FROM THE
+BASELINE IS COMPARED TO THE MEDIAN OF ITS LAST HISTORY_WINDOW RUNS IN benchmarks/history.jsonl (LOCAL). EXITS WITH
+STATUS 1 IF ANY BENCHMARK IS SLOWER THAN ITS REFERENCE BY MORE THAN --tolerance. A RUN WITH A REGRESSION IS NOT
+ADDED TO THE HISTORY, SO RUNNING AGAIN DOES NOT MAKE IT PASS. AN INTENDED CHANGE OF SPEED IS ACCEPTED BY PINNING A
+NEW BASELINE WITH --baseline AND COMMITTING IT. THE TIMINGS DEPEND ON THE MACHINE, PIN THE BASELINE ON THE MACHINE
+THE SUITE IS RUN ON. THE PARSERS ARE ALSO CHECKED FOR THE SHAPE OF THEIR DATAFRAMES BEFORE THEY ARE TIMED, E.G.
+
+python benchmarks/run_benchmarks.py
+python benchmarks/run_benchmarks.py --filter calculator --no-save
+python benchmarks/run_benchmarks.py --baseline
+"""
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARK_DIR)
+FIXTURE_DIR = os.path.join(BENCHMARK_DIR, "fixtures")
+HISTORY_FILE = os.path.join(BENCHMARK_DIR, "history.jsonl")
+BASELINE_FILE = os.path.join(BENCHMARK_DIR, "baseline.json")
+# Runs of the history a benchmark without a baseline is compared to
+HISTORY_WINDOW = 5
+
+# The matchedbetting modules import each other as top-level modules
+sys.path.insert(0, os.path.join(ROOT_DIR, "matchedbetting"))
+sys.path.insert(0, ROOT_DIR)
+
+
+def load_fixture(name: str):
+    with open(os.path.join(FIXTURE_DIR, name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def check_frame(frame, columns: list, n_rows: int):
+    """
+    Raises if a parsed DataFrame does not have the given columns and number of rows
+    """
+    if list(frame.columns) != columns or len(frame) != n_rows:
+        raise Exception(f"Expected columns {columns} and {n_rows} rows, got {list(frame.columns)} and {len(frame)}")
+
+
+def build_benchmarks() -> dict:
+    """
+    Sets up the benchmarks, {name: zero-argument callable}
+    """
+    import calculators
+    import finishing_probabilities
+    import portfolio
+    import streckspel
+    from betfairlightweight.resources import MarketBook
+    from fake_betfair import FakeAPIClient
+    from load_test import generate_bets
+    from mb_functions import hedge_bet, process_runner_books
+    from scraping import atg_parse_race, ss_parse_markets
+
+    atg_vinnare = load_fixture("atg_vinnare.json")
+    atg_v75 = load_fixture("atg_V75.json")
+    ss_odds = load_fixture("ss_ws_odds.json")
+    check_frame(ss_parse_markets(ss_odds), ["Startnr", "Häst", "VOdds", "POdds"], 12)
+    market_book = MarketBook(**load_fixture("betfair_market_book.json")[0])
+    v75_avdelningar = [atg_parse_race(lopp, "V75") for lopp in atg_v75["races"]]
+    win_probabilities = finishing_probabilities.win_probabilities(atg_parse_race(atg_v75["races"][0])["VOdds"])
+    client = FakeAPIClient.from_fixtures(load_fixture("betfair_market_catalogue.json"),
+                                         load_fixture("betfair_market_book.json"), consume_liquidity=False)
+    weekend_games, weekend_bets = generate_bets(1000, 50, seed=1)
+    weekend_lay_odds = {(f"{home} v {away}", market, outcome): price for home, away in weekend_games
+                        for market, outcome, price in [("Match Odds", home, 2.5), ("Match Odds", away, 3.4),
+                                                       ("Match Odds", "The Draw", 3.6),
+                                                       ("Over/Under 2.5 Goals", "Over 2.5 Goals", 2.0),
+                                                       ("Over/Under 2.5 Goals", "Under 2.5 Goals", 2.02),
+                                                       ("Both teams to Score?", "Yes", 1.9),
+                                                       ("Both teams to Score?", "No", 2.15)]}
+
+    def simple_calculators():
+        calculators.qualifying_bet_2way(100, 2.1, 1.95)
+        calculators.qualifying_bet_3way(100, 2.1, 3.4, 3.9)
+        calculators.freebet_2way(100, 4.5, 1.3)
+        calculators.freebet_3way(100, 4.5, 3.4, 1.9)
+        calculators.rfbet_2way(100, 3.2, 1.5)
+        calculators.rfbet_3way(100, 3.2, 3.4, 2.3)
+
+    return {
+        "calculators.simple": simple_calculators,
+        "calculators.master_calculator_2way": lambda: calculators.master_calculator_2way(
+            wagerB_1=100, oddsB_1=2.1, wagerB_2=0, oddsB_2=1, wagerR_1=0, oddsR_1=1, wagerR_2=0, oddsR_2=1,
+            wagerF_1=50, oddsF_1=4.0, wagerF_2=0, oddsF_2=1, odds_1=2.05, odds_2=1.92),
+        "calculators.master_calculator_3way": lambda: calculators.master_calculator_3way(
+            wagerB_1=100, oddsB_1=1.65, wagerB_X=0, oddsB_X=1, wagerB_2=0, oddsB_2=1,
+            wagerR_1=0, oddsR_1=1, wagerR_X=50, oddsR_X=4.2, wagerR_2=0, oddsR_2=1,
+            wagerF_1=0, oddsF_1=1, wagerF_X=0, oddsF_X=1, wagerF_2=25, oddsF_2=6.5,
+            odds_1=1.62, odds_X=4.1, odds_2=6.4, rf_stake_returned_as_freebet=True),
+        "finishing_probabilities.harville_positions": lambda: finishing_probabilities.harville_positions(
+            win_probabilities),
+        "finishing_probabilities.monte_carlo_positions": lambda: finishing_probabilities.monte_carlo_positions(
+            win_probabilities, seed=1),
+        "streckspel.top_rows[V75]": lambda: streckspel.top_rows(v75_avdelningar, "V75", k=100),
+        "portfolio.portfolio_hedges[weekend]": lambda: portfolio.portfolio_hedges(weekend_bets, weekend_lay_odds),
+        "mb_functions.process_runner_books": lambda: process_runner_books(market_book.runners),
+        "mb_functions.hedge_bet": lambda: hedge_bet(
+            betfair_client=client, home_team="Napoli", away_team="Torino", market="Match Odds", outcome="Napoli",
+            bet_type="Qualifying bet", stake=100, odds=1.7, date="2022-05-31", continuous_output=False),
+        "scraping.atg_parse_race[V&P]": lambda: atg_parse_race(atg_vinnare["races"][0]),
+        "scraping.atg_parse_race[V75]": lambda: [atg_parse_race(lopp, "V75") for lopp in atg_v75["races"]],
+        "scraping.ss_parse_markets": lambda: ss_parse_markets(ss_odds),
+    }
+
+
+def time_benchmark(func, rounds: int = 7, min_round_time: float = 0.02) -> dict:
+    """
+    Times func over several rounds, each round calling it as many times as needed to last min_round_time
+
+    :return: {"median": seconds per call, "min": seconds per call, "loops": calls per round}
+    :rtype: dict
+    """
+    func()
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_round_time:
+            break
+        loops *= 2
+
+    per_call = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        per_call.append((time.perf_counter() - start) / loops)
+    return {"median": statistics.median(per_call), "min": min(per_call), "loops": loops}
+
+
+def reference_medians() -> dict:
+    """
+    Median time per call every benchmark is compared to, {name: (seconds, description)}. The pinned baseline, else
+    the median over the last HISTORY_WINDOW runs of the benchmark in the history file
+    """
+    runs = {}
+    if os.path.exists(HISTORY_FILE):
+        with open(HISTORY_FILE, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    for name, result in json.loads(line)["results"].items():
+                        runs.setdefault(name, []).append(result["median"])
+    references = {name: (statistics.median(medians[-HISTORY_WINDOW:]),
+                         f"median of last {len(medians[-HISTORY_WINDOW:])} runs") for name, medians in runs.items()}
+
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, encoding="utf-8") as f:
+            baseline = json.load(f)
+        for name, result in baseline["results"].items():
+            references[name] = (result["median"], f"baseline {baseline['commit']}")
+    return references
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the benchmark suite")
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this string")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed slowdown relative to the baseline, 0.25 = 25 %%")
+    parser.add_argument("--no-save", action="store_true", help="Do not append the run to the history file")
+    parser.add_argument("--baseline", action="store_true",
+                        help="Pin this run as the baseline, replacing the results of the benchmarks that were run")
+    args = parser.parse_args()
+
+    references = reference_medians()
+    results = {}
+    regressions = []
+    for name, func in build_benchmarks().items():
+        if args.filter not in name:
+            continue
+        results[name] = time_benchmark(func)
+        median = results[name]["median"]
+        line = f"{name:<45} {median * 1e6:>12.1f} µs"
+        if name in references:
+            reference, description = references[name]
+            change = median / reference - 1
+            line += f"   {change:+.1%} vs {description}"
+            if change > args.tolerance and not args.baseline:
+                regressions.append(name)
+                line += "   REGRESSION"
+        print(line)
+
+    run = {"timestamp": datetime.now().isoformat(timespec="seconds"), "commit": current_commit(), "results": results}
+    if args.baseline:
+        baseline = {"results": {}}
+        if os.path.exists(BASELINE_FILE):
+            with open(BASELINE_FILE, encoding="utf-8") as f:
+                baseline = json.load(f)
+        baseline = {**run, "results": {**baseline["results"], **results}}
+        with open(BASELINE_FILE, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Pinned as the baseline in {BASELINE_FILE}, commit it to share it")
+
+    # A regressed run is not history, otherwise the next run would be compared to it and pass
+    if not args.no_save and not regressions:
+        with open(HISTORY_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(run) + "\n")
+
+    if regressions:
+        print(f"Slower than the reference by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
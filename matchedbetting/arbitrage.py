@@ -0,0 +1,297 @@
+import heapq
+from collections import namedtuple
+
+from calculators import return_to_player, surebet_stakes
+
+"""
+ARBITRAGE (SUREBET) DETECTOR ACROSS BOOKMAKERS AND THE EXCHANGE
+
+KEEPS THE BEST BACK PRICE OF EVERY RUNNER ACROSS ALL SOURCES IN A MAX-HEAP PER RUNNER. AN ODDS UPDATE PUSHES ONE
+ENTRY, O(log n) IN THE NUMBER OF SOURCES, AND OUTDATED ENTRIES ARE DROPPED WHEN THEY REACH THE TOP OF THE HEAP. THE
+SUM OF 1 / BEST ODDS OF EVERY MARKET IS UPDATED WITH THE CHANGE OF ONE RUNNER, SO NO UPDATE RESCANS THE MARKET. WHEN
+THE SUM FALLS BELOW 1 (RETURN TO PLAYER ABOVE 100 %) THE ALERT CALLBACK GETS THE BEST PRICES AND THE STAKES FROM
+calculators.surebet_stakes, E.G.
+
+index = BestPriceIndex(alert=print, commission={"betfair": 0.02})
+index.register_market("Solvalla Lopp 3", ["Bird Parker", "Power", "Hail Mary"])
+index.update("Solvalla Lopp 3", "Bird Parker", "unibet", 2.6)
+index.update_from_odds_matrix(matris, bana="Solvalla")       # Oddsmatris from scrape_orchestrator
+index.update_from_market_books(market_books, {market_id: ("Solvalla Lopp 3", {selection_id: "bird parker", ...})})
+
+THE EXCHANGE PRICES MUST BE FED UNDER THE SAME MARKET KEYS AND RUNNER NAMES AS THE BOOKMAKER PRICES, OTHERWISE THEY
+NEVER MEET IN THE SAME MARKET. A SCRATCHED RUNNER (SCRATCHED_ODDS FROM A SOURCE, OR REMOVED AT THE EXCHANGE) IS
+DROPPED FROM ITS MARKET, THE OTHER RUNNERS STILL FORM A COMPLETE MARKET. A RUNNER WITHOUT ANY PRICE IS NOT DROPPED,
+ITS MARKET IS NOT CHECKED UNTIL IT IS PRICED OR SCRATCHED
+"""
+
+# Odds at or above this value mark a scratched horse or a removed price
+SCRATCHED_ODDS = 999
+# Total stake the alert stakes are computed for
+ALERT_STAKE = 100
+
+Arbitrage = namedtuple("Arbitrage", ["market", "rtp", "best_prices", "stakes", "profit"])
+
+
+class BestPriceIndex:
+    """
+    Best back price per runner across sources, with an alert when a market's best prices form an arbitrage
+
+    :param alert: Called with an Arbitrage every time a best price in an arbitraged market changes
+    :param dict commission: Source -> commission on net winnings, e.g. {"betfair": 0.02}. The odds of these sources
+                            are indexed as the effective odds 1 + (odds - 1) * (1 - commission)
+    :param float stake: Total stake of the alert stakes
+    """
+
+    def __init__(self, alert=None, commission: dict = None, stake: float = ALERT_STAKE):
+        self.alert = alert
+        self.commission = commission or {}
+        self.stake = stake
+        self._runners = {}        # market -> list of runners
+        self._heaps = {}          # (market, runner) -> heap of (-odds, version, source)
+        self._prices = {}         # (market, runner) -> {source: (odds, version)}
+        self._best = {}           # (market, runner) -> (odds, source) or None
+        self._inverse_sum = {}    # market -> sum of 1 / best odds over the runners with a price
+        self._missing = {}        # market -> number of runners without any price
+        self._scratched = set()   # (market, runner) dropped from their market
+        self._version = 0
+
+    def register_market(self, market, runners):
+        """
+        Adds a market of mutually exclusive runners. A market is only checked for arbitrage once every runner has a
+        price
+
+        :param market: Market key, e.g. "Solvalla Lopp 3" or a Betfair market id
+        :param runners: Runner names
+        """
+        self._runners[market] = []
+        self._inverse_sum[market] = 0.0
+        self._missing[market] = 0
+        for runner in runners:
+            self.add_runner(market, runner)
+
+    def remove_market(self, market):
+        """
+        Removes a market, e.g. after the start of the race
+        """
+        for runner in self._runners.pop(market):
+            del self._heaps[(market, runner)], self._prices[(market, runner)], self._best[(market, runner)]
+        del self._inverse_sum[market], self._missing[market]
+        self._scratched = {key for key in self._scratched if key[0] != market}
+
+    def add_runner(self, market, runner):
+        """
+        Adds a runner missing from a registered market, e.g. a horse only one of the sources lists. A scratched
+        runner is not added again
+        """
+        key = (market, runner)
+        if key in self._heaps or key in self._scratched:
+            return
+        self._runners[market].append(runner)
+        self._heaps[key] = []
+        self._prices[key] = {}
+        self._best[key] = None
+        self._missing[market] += 1
+
+    def scratch_runner(self, market, runner):
+        """
+        Drops a scratched runner from its market, later prices of the runner are ignored
+
+        :return: Arbitrage if the remaining runners form one, else None
+        """
+        key = (market, runner)
+        self._scratched.add(key)
+        if key not in self._heaps:
+            return None
+        best = self._best.pop(key)
+        if best is None:
+            self._missing[market] -= 1
+        else:
+            self._inverse_sum[market] -= 1 / best[0]
+        del self._heaps[key], self._prices[key]
+        self._runners[market].remove(runner)
+        return self._check(market)
+
+    def effective_odds(self, source: str, odds: float) -> float:
+        """
+        Odds after commission on net winnings
+        """
+        return 1 + (odds - 1) * (1 - self.commission.get(source, 0))
+
+    def update(self, market, runner, source: str, odds: float = None):
+        """
+        Sets the back odds of a runner at a source, O(log n) in the number of sources
+
+        :param market: Registered market key
+        :param runner: Runner in the market
+        :param str source: Bookmaker or exchange
+        :param float odds: Decimal odds, None removes the source's price, SCRATCHED_ODDS or more scratches the runner
+
+        :return: Arbitrage if the update changed a best price of an arbitraged market, else None
+        """
+        key = (market, runner)
+        if key in self._scratched:
+            return None
+        if key not in self._heaps:
+            raise KeyError(f"{runner} in {market} is not registered, call register_market first")
+        if odds is not None and odds >= SCRATCHED_ODDS:
+            return self.scratch_runner(market, runner)
+
+        prices = self._prices[key]
+        if odds is None or odds != odds or odds <= 1:
+            if prices.pop(source, None) is None:
+                return None
+        else:
+            odds = self.effective_odds(source, float(odds))
+            if prices.get(source, (None, None))[0] == odds:
+                return None
+            self._version += 1
+            prices[source] = (odds, self._version)
+            heap = self._heaps[key]
+            heapq.heappush(heap, (-odds, self._version, source))
+            if len(heap) > 4 * len(prices) + 8:
+                # Outdated entries below the top are only dropped here, keeps the heap O(number of sources)
+                heap[:] = [(-price, version, name) for name, (price, version) in prices.items()]
+                heapq.heapify(heap)
+
+        return self._refresh_best(market, key)
+
+    def _refresh_best(self, market, key):
+        heap, prices = self._heaps[key], self._prices[key]
+        # Lazy deletion, entries no longer matching the source's current price are dropped from the top
+        while heap and prices.get(heap[0][2], (None, None))[1] != heap[0][1]:
+            heapq.heappop(heap)
+        best = (-heap[0][0], heap[0][2]) if heap else None
+        old_best = self._best[key]
+        if best == old_best:
+            return None
+        self._best[key] = best
+
+        if old_best is None:
+            self._missing[market] -= 1
+        else:
+            self._inverse_sum[market] -= 1 / old_best[0]
+        if best is None:
+            self._missing[market] += 1
+        else:
+            self._inverse_sum[market] += 1 / best[0]
+        return self._check(market)
+
+    def _check(self, market):
+        # A market needs two runners with prices, a single remaining runner is not a bet
+        if self._missing[market] == 0 and len(self._runners[market]) > 1 and self._inverse_sum[market] < 1:
+            arbitrage = self.arbitrage(market)
+            if self.alert is not None:
+                self.alert(arbitrage)
+            return arbitrage
+        return None
+
+    def best_price(self, market, runner) -> tuple:
+        """
+        :return: (effective odds, source) of the best price, None if no source prices the runner
+        :rtype: tuple
+        """
+        return self._best[(market, runner)]
+
+    def implied_probability(self, market) -> float:
+        """
+        Sum of 1 / best odds over the market, below 1 is an arbitrage. None until every runner has a price
+        """
+        return None if self._missing[market] else self._inverse_sum[market]
+
+    def arbitrage(self, market) -> Arbitrage:
+        """
+        Best prices of a market with the stakes that pay the same on every runner. Computed for any complete market,
+        the profit is negative when the market is not an arbitrage
+
+        :rtype: Arbitrage
+        """
+        runners = self._runners[market]
+        best_prices = {runner: self._best[(market, runner)] for runner in runners}
+        odds_list = [odds for odds, _ in best_prices.values()]
+        # Recomputed from the best prices, the incremental sum accumulates rounding errors
+        rtp = return_to_player(odds_list)
+        stakes = dict(zip(runners, surebet_stakes(odds_list, self.stake)))
+        return Arbitrage(market, rtp, best_prices, stakes, self.stake * (rtp - 1))
+
+    def update_from_odds_matrix(self, matris, bana: str = "", field: str = "VOdds") -> list:
+        """
+        Feeds an oddsmatris from scrape_orchestrator.skrapa_tävlingsdag, one market per race. Every horse in the
+        matrix is a runner of its race, a horse without a price at any source (a scraper missed it or the price is
+        not up yet) keeps the race incomplete. Only SCRATCHED_ODDS drops a horse from its race
+
+        :param pd.DataFrame matris: Index [Lopp, Häst], columns "{källa} VOdds" and "{källa} POdds"
+        :param str bana: Prefix of the market keys, "{bana} Lopp {lopp}"
+        :param str field: "VOdds" for the win market. Only win markets are mutually exclusive, POdds can not be used
+
+        :return: List of Arbitrage raised by the updates
+        :rtype: list
+        """
+        suffix = f" {field}"
+        columns = [column for column in matris.columns if column.endswith(suffix)]
+        alerts = []
+        for lopp, lopp_df in matris.groupby(level="Lopp"):
+            market = f"{bana} Lopp {lopp}".strip()
+            horses = lopp_df.index.get_level_values("Häst")
+            if market not in self._runners:
+                self.register_market(market, [])
+            for horse in horses:
+                self.add_runner(market, horse)
+            for column in columns:
+                source = column[:-len(suffix)]
+                for horse, odds in zip(horses, lopp_df[column]):
+                    arbitrage = self.update(market, horse, source, odds)
+                    if arbitrage is not None:
+                        alerts.append(arbitrage)
+        return alerts
+
+    def update_from_market_book(self, market_book, runner_names: dict, source: str = "betfair",
+                                market=None) -> list:
+        """
+        Feeds the best available back price of every runner in a Betfair market book (list_market_book with
+        EX_BEST_OFFERS). The market is registered on first use, runners removed at the exchange are scratched
+
+        :param market_book: betfairlightweight MarketBook
+        :param dict runner_names: Selection id -> runner name, as in the bookmaker markets
+        :param str source: Source name of the exchange, also the key in commission
+        :param market: Market key of the bookmaker prices, e.g. "Solvalla Lopp 3", the market id by default
+
+        :return: List of Arbitrage raised by the updates
+        :rtype: list
+        """
+        if market is None:
+            market = market_book.market_id
+        if market not in self._runners:
+            self.register_market(market, [])
+        alerts = []
+        for runner in market_book.runners:
+            name = runner_names[runner.selection_id]
+            if runner.status == "REMOVED":
+                arbitrage = self.scratch_runner(market, name)
+            else:
+                self.add_runner(market, name)
+                backs = runner.ex.available_to_back
+                odds = backs[0].price if backs and runner.status == "ACTIVE" else None
+                arbitrage = self.update(market, name, source, odds)
+            if arbitrage is not None:
+                alerts.append(arbitrage)
+        return alerts
+
+    def update_from_market_books(self, market_books: list, markets: dict, source: str = "betfair") -> list:
+        """
+        Feeds several Betfair market books under the market keys of the bookmaker prices, see
+        update_from_market_book. Books of other markets are skipped
+
+        :param list market_books: betfairlightweight MarketBooks
+        :param dict markets: Market id -> (market key, {selection id: runner name}), keys and names as in the
+                             bookmaker markets, as for freebet_planner.exchange_lay_ladders
+        :param str source: Source name of the exchange, also the key in commission
+
+        :return: List of Arbitrage raised by the updates
+        :rtype: list
+        """
+        alerts = []
+        for market_book in market_books:
+            if market_book.market_id in markets:
+                market, runner_names = markets[market_book.market_id]
+                alerts.extend(self.update_from_market_book(market_book, runner_names, source, market))
+        return alerts
@@ -0,0 +1,215 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date as dt_date
+from functools import partial
+
+import commission
+from mb_functions import (find_market_id, game_search_filter, lay_bet_calculator, lay_limit_price,
+                          lay_order_instruction, order_report, outcome_selection_id, print_runner_book,
+                          validate_hedge_arguments)
+from tracing import span
+
+"""
+ASYNC HEDGING OF MANY BETS FROM ONE EVENT LOOP
+
+betfairlightweight IS BLOCKING, SO AsyncBetfairClient RUNS ITS CALLS IN A THREAD POOL AND AWAITS THEM. THE CLIENT'S
+DEFAULT TRANSPORT OPENS A NEW HTTPS CONNECTION FOR EVERY REQUEST, HERE IT IS REPLACED BY ONE requests.Session WITH A
+CONNECTION POOL AS LARGE AS THE THREAD POOL, SHARED BY EVERY HEDGE IN FLIGHT.
+
+async_hedge_bet HEDGES A BET WITH THE SAME STEPS AND HELPERS AS mb_functions.hedge_bet, BUT THE MARKET BOOK AND THE
+RUNNER CATALOGUE ARE REQUESTED CONCURRENTLY AND THE PRICES OF THE SELECTION ARE TAKEN FROM THE MARKET BOOK
+(EX_BEST_OFFERS), WHICH SAVES THE list_runner_book ROUND TRIP. hedge_many HEDGES A WHOLE SHEET AT ONCE, E.G.
+
+async def main():
+    async with AsyncBetfairClient(trading) as client:
+        return await hedge_many(client, list_bet_dicts)
+
+reports = asyncio.run(main())
+"""
+
+"""
+INPUT DATA + PARAMETERS
+"""
+# Betfair calls in flight at the same time, also the size of the connection pool
+MAX_CONCURRENCY = 32
+
+
+def pooled_session(pool_size: int = MAX_CONCURRENCY) -> "requests.Session":
+    """
+    requests.Session keeping up to pool_size connections per host alive between requests
+
+    :param int pool_size: Connections per host, at least the number of threads using the session
+    :rtype: requests.Session
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class AsyncBetfairClient:
+    """
+    Awaitable wrapper of a logged in betfairlightweight.APIClient, each call runs in a shared thread pool
+
+    :param betfair_client: A logged in betfairlightweight.APIClient() session, or fake_betfair.FakeAPIClient
+    :param int max_concurrency: Threads in the pool, the number of Betfair calls in flight at the same time
+    :param session: requests.Session used by the client, a pooled_session(max_concurrency) replaces the default
+                    transport of betfairlightweight if None. A session set on the client is kept
+    """
+
+    def __init__(self, betfair_client, max_concurrency: int = MAX_CONCURRENCY, session=None):
+        import requests
+
+        self.client = betfair_client
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="betfair-io")
+        if session is not None:
+            betfair_client.session = session
+        elif getattr(betfair_client, "session", None) is requests:
+            # The default transport of betfairlightweight is the requests module, a new connection per request
+            betfair_client.session = pooled_session(max_concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    @staticmethod
+    def _traced(name: str, method, kwargs: dict):
+        with span(name):
+            return method(**kwargs)
+
+    async def call(self, method_name: str, **kwargs):
+        """
+        Awaits betfair_client.betting.<method_name>(**kwargs), traced as betfair.<method_name>
+        """
+        method = getattr(self.client.betting, method_name)
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, partial(self._traced, f"betfair.{method_name}", method, kwargs))
+
+    async def list_market_catalogue(self, **kwargs) -> list:
+        return await self.call("list_market_catalogue", **kwargs)
+
+    async def list_market_book(self, **kwargs) -> list:
+        return await self.call("list_market_book", **kwargs)
+
+    async def list_runner_book(self, **kwargs) -> list:
+        return await self.call("list_runner_book", **kwargs)
+
+    async def place_orders(self, **kwargs):
+        return await self.call("place_orders", **kwargs)
+
+    async def list_current_orders(self, **kwargs):
+        return await self.call("list_current_orders", **kwargs)
+
+
+async def async_hedge_bet(
+        client: AsyncBetfairClient,
+        home_team: str,
+        away_team: str,
+        market: str,
+        outcome: str,
+        bet_type: str,
+        stake: int,
+        odds: float,
+        date: str = None,
+        continuous_output: bool = False,
+        exchange_fee: float = None,
+        customer_ref: str = None) -> dict:
+    """
+    Hedges a back bet like mb_functions.hedge_bet, without blocking the event loop. There is no verification prompt,
+    many hedges run at once
+
+    :param AsyncBetfairClient client: Async client sharing its thread and connection pool between hedges
+    :param str home_team: The home team in the game
+    :param str away_team: The away team in the game
+    :param str market: Market in Betfair format, e.g. Over/Under 2.5 Goals
+    :param str outcome: Outcome in Betfair format, e.g. Under 2.5 Goals
+    :param str bet_type: QB/FB/RFB, must be in the list ["Qualifying bet", "Freebet", "Risk-free bet"]
+    :param int stake: Stake bet on the outcome
+    :param float odds: Odds on the given outcome
+    :param str date: The date for the game, today by default "YYYY-MM-DD"
+    :param bool continuous_output: If True -> prints the market and the order, lines of concurrent hedges interleave
+    :param float exchange_fee: Commission on net winnings, the Betfair rate for the market in commission.FEE_TABLE by
+                               default
+    :param str customer_ref: Idempotency key of the order, see hedge_bet
+
+    :return: Dictionary with information about the order, as returned by hedge_bet
+    :rtype: dict with keys "Status", "Order status", "BetID", "Average price matched", "Size matched", "Error codes"
+    """
+    import betfairlightweight
+    from betfairlightweight.filters import market_filter
+
+    validate_hedge_arguments(home_team, away_team, market, outcome, bet_type)
+    date = date or dt_date.today().isoformat()
+
+    """
+    LOCATES THE CORRECT MARKET ID, THEN REQUESTS THE BOOK AND THE RUNNERS OF THE MARKET CONCURRENTLY
+    """
+    market_catalogues = await client.list_market_catalogue(
+        filter=game_search_filter(home_team, away_team, date), max_results=1000)
+    market_id = find_market_id(market_catalogues, market)
+    if market_id is None:
+        raise Exception('Requested market is not available at Betfair')
+
+    price_filter = betfairlightweight.filters.price_projection(price_data=['EX_BEST_OFFERS'])
+    try:
+        market_books, market_catalogues = await asyncio.gather(
+            client.list_market_book(market_ids=[market_id], price_projection=price_filter),
+            client.list_market_catalogue(filter=market_filter(market_ids=[market_id]),
+                                         market_projection=["RUNNER_DESCRIPTION", "RUNNER_METADATA"]))
+        market_book, market_catalogue = market_books[0], market_catalogues[0]
+    except Exception:
+        raise Exception('Requested market is not available at Betfair')
+
+    sel_id = outcome_selection_id(market_catalogue, market_book, market, outcome, continuous_output)
+    runner_book_ex = next(runner.ex for runner in market_book.runners if runner.selection_id == sel_id)
+    back_prices = runner_book_ex.available_to_back
+    lay_prices = runner_book_ex.available_to_lay
+    if continuous_output:
+        print_runner_book(outcome, back_prices, lay_prices)
+    if not lay_prices:
+        raise Exception(f"No lay offers for {outcome} in {market}")
+
+    lay_price = lay_prices[0].price
+    if exchange_fee is None:
+        exchange_fee = commission.commission_rate(commission.DEFAULT_EXCHANGE, market)
+    lay_stake = lay_bet_calculator(
+        stake=stake, odds=odds, lay_odds_betting_exchange=lay_price, bet_type=bet_type, fee=exchange_fee)
+    if continuous_output:
+        print(f"To neutralize your position you will have to lay {lay_stake} SEK at odds {lay_price}.")
+        print("---------------------------------------------------")
+
+    order = await client.place_orders(
+        market_id=market_id, customer_ref=customer_ref,
+        instructions=[lay_order_instruction(sel_id, lay_stake, lay_limit_price(lay_price), customer_ref)])
+    return order_report(order)
+
+
+async def hedge_many(client: AsyncBetfairClient, bet_dicts: list, continuous_output: bool = False,
+                     exchange_fee: float = None) -> list:
+    """
+    Hedges every bet at once with async_hedge_bet
+
+    :param AsyncBetfairClient client: Async client shared by all hedges
+    :param list bet_dicts: Rows of the Excel sheet used by hedge_bets.py with the keys "Home", "Away", "Market",
+                           "Outcome", "Bet type", "Stake", "Odds" and "Date"
+    :param bool continuous_output: Passed to async_hedge_bet
+    :param float exchange_fee: Passed to async_hedge_bet
+
+    :return: Report dict or the raised exception per bet, in the order of bet_dicts
+    :rtype: list
+    """
+    return await asyncio.gather(*(
+        async_hedge_bet(client, home_team=bet_dict['Home'], away_team=bet_dict['Away'], market=bet_dict['Market'],
+                        outcome=bet_dict['Outcome'], bet_type=bet_dict['Bet type'], stake=bet_dict['Stake'],
+                        odds=bet_dict['Odds'], date=str(bet_dict['Date'])[:10] if bet_dict.get('Date') else None,
+                        continuous_output=continuous_output, exchange_fee=exchange_fee)
+        for bet_dict in bet_dicts), return_exceptions=True)
@@ -0,0 +1,387 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+
+from mb_functions import hedge_bet
+from request_scheduler import retry_throttled
+
+"""
+JOURNALED BATCH HEDGING WITH CRASH-SAFE RESUME
+
+A BATCH RUN THAT DIES HALFWAY (CRASH, LOST CONNECTION, CTRL-C) CAN NOT SIMPLY BE STARTED AGAIN: THE BETS THAT WERE
+ALREADY LAID WOULD BE LAID A SECOND TIME. BatchHedger THEREFORE WRITES EVERY STEP TO AN APPEND-ONLY JSON LINES
+JOURNAL, FLUSHED TO DISK BEFORE THE NEXT STEP IS TAKEN:
+
+Queued      THE ROW WAS TAKEN INTO A BATCH (ITS BACK BET CAN BE RECORDED IN THE LEDGER)
+Intent      A LAY ORDER IS ABOUT TO BE SENT WITH THE GIVEN customer_ref
+Result      THE REPORT OF THE ORDER, hedge_bet RETURNED
+Reconciled  THE ORDER OF AN EARLIER INTENT WAS FOUND AT BETFAIR WITH list_current_orders
+Declined    THE USER DID NOT CONFIRM THE ORDER (verification), NOTHING WAS SENT
+Failed      THE ROW COULD NOT BE HEDGED IN THIS RUN, IT IS RETRIED BY THE NEXT RUN
+
+EVERY ORDER CARRIES A customer_ref DERIVED FROM THE ROW (AS IDEMPOTENCY KEY OF place_orders AND AS customerOrderRef
+OF THE ORDER). BETFAIR REJECTS A REPEATED customer_ref WITHIN 60 SECONDS WITH DUPLICATE_TRANSACTION, AND AN ORDER
+WHOSE RESPONSE WAS LOST CAN BE LOOKED UP BY ITS REF. AN INTENT WITHOUT A RESULT IS THEREFORE RECONCILED BEFORE
+ANYTHING ELSE IS DONE WITH THE ROW, AND A REQUEST WHOSE OUTCOME IS UNKNOWN (AN EXCEPTION, STATUS TIMEOUT OR
+DUPLICATE_TRANSACTION) IS LOOKED UP AND RETRIED WITH THE SAME REF. ONLY A DEFINITE REJECTION OF AN ORDER MOVES THE
+ROW TO A NEW REF. ROWS ARE HEDGED CONCURRENTLY, SO RERUNNING A BATCH IS SAFE
+AT FULL SPEED, E.G.
+
+hedger = BatchHedger(trading, "hedge_journal.jsonl")
+ledger.record_back_bets(hedger.queue(list_bet_dicts))
+for bet_dict, report, status in hedger.run(list_bet_dicts):
+    ...
+
+list_current_orders ONLY RETURNS ORDERS OF MARKETS THAT ARE NOT SETTLED, RESUME A BATCH BEFORE ITS GAMES ARE OVER
+"""
+
+"""
+INPUT DATA + PARAMETERS
+"""
+JOURNAL_PATH = "hedge_journal.jsonl"
+# Attempts per row in one run, and seconds before the first retry (doubled per retry)
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+# Rows hedged at the same time
+MAX_WORKERS = 8
+# Columns of the Excel sheet identifying a bet, identical rows are told apart by their position among each other
+BET_KEYS = ["Date", "Home", "Away", "Market", "Outcome", "Bet type", "Stake", "Odds"]
+# customer_order_refs per list_current_orders request
+REFS_PER_REQUEST = 250
+
+
+def row_keys(bet_dicts: list) -> list:
+    """
+    Stable key per row of a bet sheet, the same bet gets the same key in every run
+
+    :param list bet_dicts: Rows of the Excel sheet used by hedge_bets.py
+    :return: 20 hex characters per row, in the order of bet_dicts
+    :rtype: list
+    """
+    keys, seen = [], {}
+    for bet_dict in bet_dicts:
+        values = [str(bet_dict.get("Date") or "")[:10]]
+        for column in BET_KEYS[1:]:
+            value = bet_dict.get(column)
+            values.append(float(value) if column in ("Stake", "Odds") else str(value))
+        identity = json.dumps(values)
+        occurrence = seen.get(identity, 0)
+        seen[identity] = occurrence + 1
+        keys.append(hashlib.sha1(f"{identity}#{occurrence}".encode()).hexdigest()[:20])
+    return keys
+
+
+def customer_ref(key: str, sequence: int) -> str:
+    """
+    customer_ref of the sequence-th order of a row, at most 32 characters as Betfair requires
+    """
+    return f"{key}-{sequence}"
+
+
+def journal_report(report_dict: dict) -> dict:
+    """
+    Report dict of hedge_bet in a JSON serializable form, the error codes as a sorted list without None
+    """
+    if report_dict is None:
+        return None
+    return {**report_dict, "Error codes": sorted(code for code in report_dict.get("Error codes") or [] if code)}
+
+
+def reconciled_report(orders: list) -> dict:
+    """
+    Report dict in the format of hedge_bet for the current orders found for one row
+    """
+    size_matched = sum(order.size_matched or 0.0 for order in orders)
+    average_price = (sum((order.size_matched or 0.0) * (order.average_price_matched or 0.0) for order in orders)
+                     / size_matched if size_matched else 0.0)
+    return {"Status": "SUCCESS", "Order status": orders[-1].status, "BetID": orders[-1].bet_id,
+            "Average price matched": average_price, "Size matched": size_matched, "Error codes": []}
+
+
+class HedgeJournal:
+    """
+    Append-only JSON lines log of a batch, every record is on disk (fsync) when append returns
+
+    :param str path: Journal file, created if it does not exist
+    """
+
+    def __init__(self, path: str = JOURNAL_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def read(self) -> list:
+        """
+        All records in the order they were written. A line torn by a crash during the write is skipped
+        """
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return records
+
+    def append(self, records: list):
+        """
+        Writes the records and waits until they are on disk
+
+        :param list records: JSON serializable dicts
+        """
+        if not records:
+            return
+        timestamp = datetime.now(timezone.utc).isoformat()
+        lines = "".join(json.dumps({"Time": timestamp, **record}) + "\n" for record in records)
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as file:
+                # A torn last line of an earlier crash must not swallow the first new record
+                if file.tell() and not self._ends_with_newline():
+                    lines = "\n" + lines
+                file.write(lines)
+                file.flush()
+                os.fsync(file.fileno())
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, "rb") as file:
+            file.seek(-1, os.SEEK_END)
+            return file.read(1) == b"\n"
+
+
+class RowState:
+    """
+    What the journal knows about one row: its refs so far, whether the last one is unresolved and the final report
+    """
+
+    def __init__(self):
+        self.refs = []
+        self.sequence = 0
+        self.pending = False
+        self.finished = False
+        self.report = None
+
+    def apply(self, record: dict):
+        event = record["Event"]
+        if event == "Intent":
+            if record["Ref"] not in self.refs:
+                self.refs.append(record["Ref"])
+            self.sequence = max(self.sequence, record["Sequence"])
+            self.pending = True
+        elif event == "Result":
+            # A TIMEOUT is unresolved also in journals written before it was flagged as such
+            self.pending = record["Report"].get("Status") != "SUCCESS" and (
+                record.get("Unresolved", False) or record["Report"].get("Status") == "TIMEOUT")
+            if record["Report"].get("Status") == "SUCCESS":
+                self.finished, self.report = True, record["Report"]
+            elif not self.pending:
+                self.sequence += 1
+        elif event == "Reconciled":
+            self.finished, self.pending, self.report = True, False, record["Report"]
+
+
+class BatchHedger:
+    """
+    Hedges the rows of a bet sheet concurrently with hedge_bet, journaled so that an interrupted batch can be run
+    again and only its unfinished rows are hedged
+
+    :param betfair_client: A logged in betfairlightweight.APIClient() session, a request_scheduler.RequestScheduler
+                           or fake_betfair.FakeAPIClient
+    :param str journal_path: Journal of the batch, keep it until the games are settled
+    :param int max_workers: Rows hedged at the same time
+    :param int retries: Attempts per row in one run
+    :param float exchange_fee: Passed to hedge_bet
+    :param bool continuous_output: Passed to hedge_bet, the output of concurrent rows interleaves
+    :param bool verification: Passed to hedge_bet, needs max_workers=1
+    """
+
+    def __init__(self, betfair_client, journal_path: str = JOURNAL_PATH, max_workers: int = MAX_WORKERS,
+                 retries: int = MAX_RETRIES, exchange_fee: float = None, continuous_output: bool = False,
+                 verification: bool = False):
+        if verification and max_workers != 1:
+            raise Exception("verification prompts for every order, it requires max_workers=1")
+        self.client = betfair_client
+        self.continuous_output = continuous_output
+        self.verification = verification
+        self.journal = HedgeJournal(journal_path)
+        self.max_workers = max_workers
+        self.retries = retries
+        self.exchange_fee = exchange_fee
+        self.rows = {}
+        for record in self.journal.read():
+            self.state(record["Key"]).apply(record)
+
+    def state(self, key: str) -> RowState:
+        if key not in self.rows:
+            self.rows[key] = RowState()
+        return self.rows[key]
+
+    def queue(self, bet_dicts: list) -> list:
+        """
+        Journals the rows not seen by an earlier run as Queued
+
+        :param list bet_dicts: Rows of the Excel sheet used by hedge_bets.py
+        :return: The newly queued rows, e.g. for Ledger.record_back_bets, which must not see a row twice
+        :rtype: list
+        """
+        new_rows, records = [], []
+        for key, bet_dict in zip(row_keys(bet_dicts), bet_dicts):
+            if key not in self.rows:
+                self.state(key)
+                new_rows.append(bet_dict)
+                records.append({"Event": "Queued", "Key": key})
+        self.journal.append(records)
+        return new_rows
+
+    def run(self, bet_dicts: list) -> list:
+        """
+        Hedges every row that is not finished in the journal. Unresolved orders of earlier runs are reconciled with
+        list_current_orders first, the remaining rows are hedged concurrently
+
+        :param list bet_dicts: Rows of the Excel sheet used by hedge_bets.py
+        :return: (bet_dict, report dict or the last exception, status) per row in the order of bet_dicts, status is
+                 "Hedged", "Already hedged", "Reconciled", "Declined" or "Failed"
+        :rtype: list
+        """
+        self.queue(bet_dicts)
+        keys = row_keys(bet_dicts)
+        results = [None] * len(bet_dicts)
+
+        """
+        RECONCILES THE INTENTS OF EARLIER RUNS THAT HAVE NO RESULT
+        """
+        pending = [key for key in keys if self.rows[key].pending and not self.rows[key].finished]
+        try:
+            reconciled, looked_up = self.reconcile(pending), True
+        except Exception:
+            # The rows look their orders up again before anything is sent
+            reconciled, looked_up = {}, False
+        to_hedge = []
+        for i, key in enumerate(keys):
+            row = self.rows[key]
+            if key in reconciled:
+                results[i] = (bet_dicts[i], row.report, "Reconciled")
+            elif row.finished:
+                results[i] = (bet_dicts[i], row.report, "Already hedged")
+            else:
+                to_hedge.append(i)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="batch-hedge") as executor:
+            for i, result in zip(to_hedge, executor.map(
+                    lambda i: self.hedge_row(keys[i], bet_dicts[i], looked_up), to_hedge)):
+                results[i] = (bet_dicts[i], *result)
+        return results
+
+    def reconcile(self, keys: list) -> dict:
+        """
+        Looks up the orders of the given rows by their refs and journals the rows with an order as Reconciled
+
+        :param list keys: Row keys with an unresolved intent
+        :return: Key -> report dict of the rows with an order at Betfair
+        :rtype: dict
+        """
+        ref_keys = {ref: key for key in keys for ref in self.rows[key].refs}
+        if not ref_keys:
+            return {}
+        refs = list(ref_keys)
+        orders = {}
+        for start in range(0, len(refs), REFS_PER_REQUEST):
+            for order in self.current_orders(refs[start:start + REFS_PER_REQUEST]):
+                orders.setdefault(ref_keys[order.customer_order_ref], []).append(order)
+
+        reports = {key: reconciled_report(key_orders) for key, key_orders in orders.items()}
+        self.journal.append([{"Event": "Reconciled", "Key": key, "Report": report} for key, report in reports.items()])
+        for key, report in reports.items():
+            self.rows[key].apply({"Event": "Reconciled", "Report": report})
+        return reports
+
+    def current_orders(self, refs: list) -> list:
+        """
+        Current orders with one of the refs, all pages
+        """
+        orders, from_record = [], 0
+        while True:
+            response = retry_throttled(self.client.betting.list_current_orders, customer_order_refs=refs,
+                                       from_record=from_record)
+            orders.extend(order for order in response.orders if order.customer_order_ref in refs)
+            if not response.more_available or not response.orders:
+                return orders
+            from_record += len(response.orders)
+
+    def hedge_row(self, key: str, bet_dict: dict, looked_up: bool = False) -> tuple:
+        """
+        Hedges one row with up to self.retries attempts, journaling each attempt. While the last order of the row may
+        have reached Betfair it is looked up before anything is resent, and nothing is sent if the lookup fails
+
+        :param str key: Key of the row from row_keys
+        :param dict bet_dict: The row
+        :param bool looked_up: The pending order of an earlier run was already looked up and not found
+
+        :return: (report dict or the last exception, status)
+        :rtype: tuple
+        """
+        row = self.rows[key]
+        outcome = None
+        for attempt in range(self.retries):
+            if attempt:
+                time.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+            if row.pending and (attempt or not looked_up):
+                try:
+                    reports = self.reconcile([key])
+                except Exception as e:
+                    outcome = e
+                    continue
+                if key in reports:
+                    return reports[key], "Reconciled"
+
+            ref = customer_ref(key, row.sequence)
+            self.journal.append([{"Event": "Intent", "Key": key, "Ref": ref, "Sequence": row.sequence}])
+            row.apply({"Event": "Intent", "Ref": ref, "Sequence": row.sequence})
+            try:
+                report = hedge_bet(
+                    betfair_client=self.client,
+                    home_team=bet_dict['Home'],
+                    away_team=bet_dict['Away'],
+                    market=bet_dict['Market'],
+                    outcome=bet_dict['Outcome'],
+                    bet_type=bet_dict['Bet type'],
+                    stake=bet_dict['Stake'],
+                    odds=bet_dict['Odds'],
+                    date=str(bet_dict['Date'])[:10] if bet_dict.get('Date') else date.today().isoformat(),
+                    continuous_output=self.continuous_output,
+                    verification=self.verification,
+                    exchange_fee=self.exchange_fee,
+                    customer_ref=ref)
+            except Exception as e:
+                # The order may or may not have been placed, the row stays pending on the same ref
+                outcome = e
+                continue
+
+            if report is None:
+                # The row stays pending, an earlier attempt of it may have reached Betfair
+                self.journal.append([{"Event": "Declined", "Key": key}])
+                return None, "Declined"
+            report = journal_report(report)
+            # A duplicate means the ref reached Betfair before and a TIMEOUT that the order may stand, in both cases
+            # the row stays on the same ref and the order is looked up before anything is resent
+            unresolved = "DUPLICATE_TRANSACTION" in report["Error codes"] or report["Status"] == "TIMEOUT"
+            record = {"Event": "Result", "Key": key, "Ref": ref, "Report": report, "Unresolved": unresolved}
+            self.journal.append([record])
+            row.apply(record)
+            if report["Status"] == "SUCCESS":
+                return report, "Hedged"
+            outcome = report
+
+        if row.pending:
+            try:
+                reports = self.reconcile([key])
+            except Exception as e:
+                reports, outcome = {}, e
+            if key in reports:
+                return reports[key], "Reconciled"
+        self.journal.append([{"Event": "Failed", "Key": key, "Error": str(outcome)}])
+        return outcome, "Failed"
@@ -1,6 +1,3 @@
-import betfairlightweight
-import pandas as pd
-
 """
 IF YOU WANT TO UPDATE THE LISTS, FILL IN PARAMETERS BELOW
 
@@ -34,6 +31,9 @@ def update_teams(teams_list, betfair_client, excel_file=None):
     :return: Updated list, just copy pasta into betfair_teams
     :rtype: list
     """
+    import betfairlightweight
+    import pandas as pd
+
     if excel_file:
         # Sets up DataFrame with the first row empty to simplify data validation in Excel
         df = pd.DataFrame(columns=["TEAMS"])
@@ -82,6 +82,9 @@ def update_market_types(market_type_list, betfair_client, excel_file=None):
     :return: Updated list, just copy pasta into betfair_market_types
     :rtype: list
     """
+    import betfairlightweight
+    import pandas as pd
+
     if excel_file:
         # Sets up DataFrame with the first row empty to simplify data validation in Excel
         df = pd.DataFrame(columns=["MARKET TYPES"])
@@ -123,6 +126,9 @@ def update_outcome_types(outcome_type_list, betfair_client, excel_file=None):
     :return: Updated list, just copy pasta into betfair_outcome_types
     :rtype: list
     """
+    import betfairlightweight
+    import pandas as pd
+
     if excel_file:
         # Sets up DataFrame with the first row empty to simplify data validation in Excel
         df = pd.DataFrame(columns=["OUTCOME TYPES"])
@@ -155,6 +161,8 @@ def update_outcome_types(outcome_type_list, betfair_client, excel_file=None):
 
 
 if __name__ == "__main__":
+    import betfairlightweight
+
     trading = betfairlightweight.APIClient(
         USERNAME,
         PASSWORD,
@@ -1,4 +1,4 @@
-import scipy.optimize
+import commission
 
 
 def qualifying_bet_2way(stake: int, odds: float, odds_second_outcome: float) -> float:
@@ -97,7 +97,8 @@ def rfbet_3way(stake: int, odds: float, odds_second_outcome: float, odds_third_o
     return [stake_outcome2, stake_outcome3]
 
 
-def exchange_calculator(stake, odds, lay_odds, bet_type, exchange_fee=0.02) -> int:
+def exchange_calculator(stake, odds, lay_odds, bet_type, exchange_fee=None, exchange=commission.DEFAULT_EXCHANGE,
+                        market=None) -> int:
     """
     Computes how much to lay to make sure the back bet is fully hedged
 
@@ -105,23 +106,17 @@ def exchange_calculator(stake, odds, lay_odds, bet_type, exchange_fee=0.02) -> i
     :param float odds: Odds on the given bet
     :param float lay_odds: Lay odds offered with the betting exchange on the given outcome
     :param str bet_type: QB/FB/RFB, must be in the list ["Qualifying bet", "Freebet", "Risk-free bet"]
-    :param float exchange_fee: Fee applied by the betting exchange, 0.02 by default
+    :param float exchange_fee: Commission on net winnings applied by the betting exchange, looked up in
+                               commission.FEE_TABLE by default
+    :param str exchange: Exchange in commission.FEE_TABLE, used if exchange_fee is None
+    :param str market: Market type for the commission lookup, e.g. Match Odds
 
     :return: Stake to be layed to neutralize position
     :rtype: int
     """
-    if bet_type == "Qualifying bet":
-        lay_stake = int(stake * odds / (lay_odds_betting_exchange - exchange_fee))
-        return lay_stake
-    elif bet_type == "Freebet":
-        lay_stake = int(stake * (odds - 1) / (lay_odds_betting_exchange - exchange_fee))
-        return lay_stake
-    elif bet_type == "Risk-free bet":
-        lay_stake = int(stake * (odds - 1) / (lay_odds_betting_exchange - exchange_fee))
-        return lay_stake
-    else:
-        raise Exception(
-            f'{bet_type} must be either "Qualifying bet", "Freebet" or "Risk-free bet"')
+    if exchange_fee is None:
+        exchange_fee = commission.commission_rate(exchange, market)
+    return int(commission.lay_stake(stake, odds, lay_odds, bet_type, exchange_fee))
 
         
 """
@@ -171,16 +166,50 @@ def return_to_player_3way(odds_1: float, odds_X: float, odds_2: float) -> float:
     return return_to_player
 
 
+def return_to_player(odds_list) -> float:
+    '''
+    Computes how much margin is applied to a market with any number of mutually exclusive outcomes, e.g. a win market
+    in horse racing
+
+    :param: list odds_list: The odds offered on every outcome
+
+    :return: Percentage of wagered money returned to the players in decimal form with 1 being 100 %
+    :rtype: float
+
+    '''
+    return_to_player = 1 / sum(1 / odds for odds in odds_list)
+    return return_to_player
+
+
+def surebet_stakes(odds_list, total_stake: float = 100) -> list:
+    '''
+    Splits total_stake over the outcomes of a market so that every outcome pays the same, stake_i = total_stake * rtp / odds_i.
+    The guaranteed profit is total_stake * (rtp - 1), positive when the odds are an arbitrage (rtp > 1)
+
+    :param: list odds_list: The odds on every outcome, e.g. the best odds across bookies
+    :param: float total_stake: Total amount to wager
+
+    :return: List of recommended wagers, one per outcome
+    :rtype: list
+    '''
+    rtp = return_to_player(odds_list)
+    return [total_stake * rtp / odds for odds in odds_list]
+
+
 """
 MASTER CALCULATORS
 """
+# Share of a freebet's stake kept as cash when it is converted, used for the stake of a lost risk-free bet returned as
+# a freebet. freebet_planner.FreebetPlanner.best_freebet_retention finds the value offered by the current odds
+FREEBET_RETENTION = 0.7
 
 
 def master_calculator_2way(wagerB_1, oddsB_1, wagerB_2, oddsB_2,
                            wagerR_1, oddsR_1, wagerR_2, oddsR_2,
                            wagerF_1, oddsF_1, wagerF_2, oddsF_2,
                            odds_1, odds_2,
-                           rf_stake_returned_as_freebet=False) -> list:
+                           rf_stake_returned_as_freebet=False,
+                           freebet_retention=FREEBET_RETENTION) -> list:
     """
     Computes and returns a list of recommended wagers on the two outcomes to achieve a fully hedged position after having placed
     any combination of qualifying, risk-free and freebets with any combination of bookies
@@ -206,6 +235,8 @@ def master_calculator_2way(wagerB_1, oddsB_1, wagerB_2, oddsB_2,
     :param bool rf_stake_returned_as_freebet: False by default, fill in whether returned stake on risk-free bets are in freebet credits or cash,
                                         - if in freebet credits, set param to True
                                         - if in cash, set param to False
+    :param float freebet_retention: Share of a returned freebet kept when it is converted, only used if
+                                    rf_stake_returned_as_freebet is True
 
     :return: List of recommended wagers [RW_outcome1, RW_outcome2], RW = Recommended Wager
     :rtype: list
@@ -218,8 +249,8 @@ def master_calculator_2way(wagerB_1, oddsB_1, wagerB_2, oddsB_2,
         share_returnedR_1 = 1
         share_returnedR_2 = 1
     else:
-        share_returnedR_1 = 0.7
-        share_returnedR_2 = 0.7
+        share_returnedR_1 = freebet_retention
+        share_returnedR_2 = freebet_retention
 
     """
     SETS UP INTERNAL PAYOFF FUNCTIONS ACTING ON THE FUNCTION PARAMETERS
@@ -290,6 +321,8 @@ def master_calculator_2way(wagerB_1, oddsB_1, wagerB_2, oddsB_2,
     SPLITS INTO CASES DEPENDING ON RTP OFFERED BY SPECIFIED ODDS.
     UNDER NORMAL CIRCUMSTANCES THE FIRST CASE WILL COME INTO PLAY.
     """
+    import scipy.optimize  # Deferred, scipy dominates the import time of this module
+
     rtp = return_to_player_2way(odds_1, odds_2)
 
     if rtp < 1:
@@ -342,7 +375,8 @@ def master_calculator_3way(wagerB_1, oddsB_1, wagerB_X, oddsB_X, wagerB_2, oddsB
                            wagerR_1, oddsR_1, wagerR_X, oddsR_X, wagerR_2, oddsR_2,
                            wagerF_1, oddsF_1, wagerF_X, oddsF_X, wagerF_2, oddsF_2,
                            odds_1, odds_X, odds_2,
-                           rf_stake_returned_as_freebet=False) -> list:
+                           rf_stake_returned_as_freebet=False,
+                           freebet_retention=FREEBET_RETENTION) -> list:
     """
     Computes and returns a list of recommended wagers on the three outcomes to achieve a fully hedged position after having placed
     any combination of qualifying, risk-free and freebets with any combination of bookies
@@ -375,6 +409,8 @@ def master_calculator_3way(wagerB_1, oddsB_1, wagerB_X, oddsB_X, wagerB_2, oddsB
     :param bool rf_stake_returned_as_freebet: False by default, fill in whether returned stake on risk-free bets are in freebet credits or cash,
                                         - if in freebet credits, set param to True
                                         - if in cash, set param to False
+    :param float freebet_retention: Share of a returned freebet kept when it is converted, only used if
+                                    rf_stake_returned_as_freebet is True
 
     :return: List of recommended wagers [RW_outcome1, RW_outcomeX, RW_outcome2], RW = Recommended Wager
     :rtype: list
@@ -388,9 +424,9 @@ def master_calculator_3way(wagerB_1, oddsB_1, wagerB_X, oddsB_X, wagerB_2, oddsB
         share_returnedR_X = 1
         share_returnedR_2 = 1
     else:
-        share_returnedR_1 = 0.7
-        share_returnedR_X = 0.7
-        share_returnedR_2 = 0.7
+        share_returnedR_1 = freebet_retention
+        share_returnedR_X = freebet_retention
+        share_returnedR_2 = freebet_retention
 
     """
     SETS UP INTERNAL PAYOFF FUNCTIONS ACTING ON THE FUNCTION PARAMETERS
@@ -484,6 +520,8 @@ def master_calculator_3way(wagerB_1, oddsB_1, wagerB_X, oddsB_X, wagerB_2, oddsB
     SPLITS INTO CASES DEPENDING ON RTP OFFERED BY SPECIFIED ODDS.
     UNDER NORMAL CIRCUMSTANCES THE FIRST CASE WILL COME INTO PLAY.
     """
+    import scipy.optimize
+
     rtp = return_to_player_3way(odds_1, odds_X, odds_2)
 
     if rtp < 1:
@@ -535,3 +573,160 @@ def master_calculator_3way(wagerB_1, oddsB_1, wagerB_X, oddsB_X, wagerB_2, oddsB
             recommended_wagers = [int(result.x[0]), int(
                 result.x[1]), int(result.x[2])]
             return recommended_wagers
+
+
+"""
+MATCHUP CALCULATORS (H2H/H3H)
+"""
+
+
+def matchup_hedges(odds, stake: float = 100, bet_type: str = "Qualifying bet") -> dict:
+    """
+    Evaluates every H2H/H3H matchup at once. For each matchup and each horse, the bet of size stake is assumed to be placed
+    on that horse and the remaining horses are hedged at their odds, as in qualifying_bet_3way/freebet_3way but for all
+    rows and horses in one go
+
+    :param odds: Matchup odds, either an (n x 2) or (n x 3) array with NaN for missing horses (H2H rows in a H3H table),
+                 or a dataframe with the columns ["Odds A", "Odds B", "Odds C"] as produced by scraping.matchup_tabell
+    :param float stake: Bet size
+    :param str bet_type: QB/FB/RFB, must be in the list ["Qualifying bet", "Freebet", "Risk-free bet"]
+
+    :return: {"RTP": (n,) return to player per matchup,
+              "Hedge stakes": (n x k x k) array, row i holds the stakes on every horse when the bet is placed on horse i,
+              "Profit": (n x k) guaranteed profit when the bet is placed on horse i, NaN for missing horses}
+    :rtype: dict
+    """
+    import numpy as np  # Deferred, see calculators import budget in import_benchmark.py
+
+    if hasattr(odds, "columns"):
+        odds = odds[[column for column in ["Odds A", "Odds B", "Odds C"] if column in odds.columns]]
+    odds = np.asarray(odds, dtype=float)
+    present = ~np.isnan(odds)
+    inverse_odds = np.where(present, 1 / np.where(present, odds, 1), 0)
+
+    if bet_type == "Qualifying bet":
+        payoff = stake * odds
+    elif bet_type in ("Freebet", "Risk-free bet"):
+        payoff = stake * (odds - 1)
+    else:
+        raise Exception(
+            f'{bet_type} must be either "Qualifying bet", "Freebet" or "Risk-free bet"')
+
+    # Hedge stake on horse j when the bet is on horse i: payoff_i / odds_j, the bet itself on the diagonal
+    hedge_stakes = np.nan_to_num(payoff)[:, :, None] * inverse_odds[:, None, :]
+    k = odds.shape[1]
+    hedge_stakes[:, np.arange(k), np.arange(k)] = np.where(present, stake, 0)
+
+    # Every outcome pays payoff_i minus all hedge stakes (and minus the stake for a qualifying bet)
+    hedged = payoff * (inverse_odds.sum(axis=1, keepdims=True) - inverse_odds)
+    profit = payoff - hedged - (stake if bet_type == "Qualifying bet" else 0)
+    return {"RTP": 1 / inverse_odds.sum(axis=1),
+            "Hedge stakes": hedge_stakes,
+            "Profit": np.where(present, profit, np.nan)}
+
+
+"""
+PLACE MARKET (TOPP 3) CALCULATORS
+"""
+
+
+def finishing_combinations(n_runners: int, places: int = 3):
+    """
+    Builds the indicator matrix of every unordered set of horses finishing in the paid places
+
+    :param int n_runners: Number of horses in the race
+    :param int places: Number of paid places, 3 for Topp 3
+
+    :return: (number of combinations x n_runners) array with a 1 for every horse that places in the combination
+    :rtype: np.ndarray
+    """
+    import itertools
+
+    import numpy as np  # Deferred, see calculators import budget in import_benchmark.py
+
+    places = min(places, n_runners)
+    combinations = np.array(list(itertools.combinations(range(n_runners), places)), dtype=int).reshape(-1, places)
+    indicator = np.zeros((len(combinations), n_runners))
+    indicator[np.arange(len(combinations))[:, None], combinations] = 1
+    return indicator
+
+
+def place_market_hedges(stake: float, offered_odds, hedge_odds, bet_type: str = "Qualifying bet", places: int = 3,
+                        max_total_hedge: float = None) -> dict:
+    """
+    Computes the recommended place bets on the other horses to hedge a place bet, for every horse in the race at once.
+
+    Several horses pay out in a place market, so the equal-payoff model of the master calculators does not apply.
+    Instead the payoff of the bet and of every hedge is evaluated for all top-{places} finishing combinations and
+    the hedge stakes maximizing the worst-case payoff are found with one linear program for the whole race, a
+    block per horse the bet can be placed on
+
+    :param float stake: Bet size
+    :param offered_odds: Place odds on which the bet is placed, one per horse (e.g. a boosted POdds column)
+    :param hedge_odds: Best available place odds to hedge with, one per horse
+    :param str bet_type: QB/FB/RFB, must be in the list ["Qualifying bet", "Freebet", "Risk-free bet"]
+    :param int places: Number of paid places, 3 for Topp 3
+    :param float max_total_hedge: Upper bound on the sum of the hedge stakes, keeps the linear program bounded if the
+                                  hedge odds contain an arbitrage. 10 * stake by default
+
+    Horses with missing odds or odds of 999 or more (scratched) are left out of the race. Raises if the linear program
+    is not solved to optimality, a failed race is never returned as NaN like a scratched horse.
+
+    :return: {"Profit": (n,) guaranteed profit when the bet is placed on horse i,
+              "Hedge stakes": (n x n) array, row i holds the recommended place bets when the bet is on horse i}
+    :rtype: dict
+    """
+    import numpy as np  # Deferred, see calculators import budget in import_benchmark.py
+    import scipy.optimize
+    import scipy.sparse
+
+    offered_odds = np.asarray(offered_odds, dtype=float)
+    hedge_odds = np.asarray(hedge_odds, dtype=float)
+    if max_total_hedge is None:
+        max_total_hedge = 10 * stake
+
+    running = ~np.isnan(hedge_odds) & (hedge_odds < 999) & ~np.isnan(offered_odds) & (offered_odds < 999)
+    runner_index = np.flatnonzero(running)
+    n = len(offered_odds)
+    profit = np.full(n, np.nan)
+    hedge_stakes = np.zeros((n, n))
+    if len(runner_index) <= places:
+        # Every horse places, there is nothing to hedge
+        return {"Profit": profit, "Hedge stakes": hedge_stakes}
+
+    placed = finishing_combinations(len(runner_index), places)
+    # Net result per combination of a unit place bet on every horse
+    hedge_returns = placed * hedge_odds[runner_index] - 1
+
+    if bet_type == "Qualifying bet":
+        bet_payoffs = placed * stake * offered_odds[runner_index] - stake
+    elif bet_type in ("Freebet", "Risk-free bet"):
+        bet_payoffs = placed * stake * (offered_odds[runner_index] - 1)
+    else:
+        raise Exception(
+            f'{bet_type} must be either "Qualifying bet", "Freebet" or "Risk-free bet"')
+
+    """
+    FOR THE BET ON HORSE h, MAXIMIZE t_h SUBJECT TO
+    t_h <= bet_payoff(c) + hedge_returns(c) @ x_h    FOR EVERY FINISHING COMBINATION c
+    sum(x_h) <= max_total_hedge, x_h >= 0, x_h[h] = 0
+    WITH THE VARIABLES [x_h, t_h]. THE BLOCKS OF ALL HORSES ARE INDEPENDENT, SO THEY ARE SOLVED AS ONE BLOCK-DIAGONAL
+    PROGRAM MAXIMIZING THE SUM OF t_h, WHICH MAXIMIZES EACH OF THEM
+    """
+    n_combinations, n_runners = placed.shape
+    block = np.vstack([np.hstack([-hedge_returns, np.ones((n_combinations, 1))]),
+                       np.append(np.ones(n_runners), 0)])
+    A_ub = scipy.sparse.kron(scipy.sparse.identity(n_runners), block, format="csr")
+    b_ub = np.vstack([bet_payoffs, np.full((1, n_runners), max_total_hedge)]).T.ravel()
+    is_profit = np.tile(np.append(np.zeros(n_runners, dtype=bool), True), n_runners)
+    upper = np.where(np.eye(n_runners, dtype=bool), 0.0, np.inf)
+    bounds = np.column_stack([np.where(is_profit, -np.inf, 0.0),
+                              np.hstack([upper, np.full((n_runners, 1), np.inf)]).ravel()])
+    result = scipy.optimize.linprog(c=-is_profit.astype(float), A_ub=A_ub, b_ub=b_ub, bounds=bounds, method="highs")
+    if result.status != 0:
+        # NaN is reserved for horses that are not running, a failed program (e.g. unbounded) must not look like one
+        raise Exception(f"The place market hedges could not be optimized: {result.message}")
+    solution = result.x.reshape(n_runners, n_runners + 1)
+    profit[runner_index] = solution[:, -1]
+    hedge_stakes[np.ix_(runner_index, runner_index)] = solution[:, :-1]
+    return {"Profit": profit, "Hedge stakes": hedge_stakes}
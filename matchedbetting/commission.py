@@ -0,0 +1,163 @@
+"""
+EXCHANGE COMMISSION
+
+THE EXCHANGES CHARGE COMMISSION ON THE NET WINNINGS OF A CUSTOMER IN A MARKET, NOT PER BET: TWO LAY BETS ON DIFFERENT
+OUTCOMES OF THE SAME MARKET ARE NETTED BEFORE THE COMMISSION IS TAKEN, AND NO COMMISSION IS PAID ON A MARKET THAT IS
+LOST OVERALL. THE RATE DEPENDS ON THE EXCHANGE, CAN DIFFER PER MARKET TYPE AND IS REDUCED BY ACCOUNT DISCOUNTS.
+
+FEE_TABLE HOLDS THE RATES PER EXCHANGE, commission_rate LOOKS THEM UP. lay_stake IS THE HEDGE OF A SINGLE BACK BET
+USED BY calculators.exchange_calculator AND mb_functions.lay_bet_calculator, market_hedge HEDGES SEVERAL POSITIONS IN
+ONE MARKET ACROSS SEVERAL EXCHANGES WITH THE COMMISSION ON NET MARKET WINNINGS, E.G.
+
+commission_rate("Betfair", "Match Odds")
+market_hedge({"Napoli": 110, "Torino": -100, "The Draw": -100},
+             {"Betfair": {"Napoli": 2.14, "Torino": 4.1}, "Smarkets": {"Napoli": 2.16, "The Draw": 3.55}})
+
+SCIPY IS IMPORTED INSIDE market_hedge SO THAT THE CALCULATORS CAN IMPORT THIS MODULE WITHIN THEIR IMPORT BUDGET
+"""
+
+"""
+INPUT DATA + PARAMETERS
+"""
+# Commission on net market winnings per exchange: "rate" is the base rate, "discount" the share of the base rate
+# refunded to the account (e.g. 0.1 for a 10 % discount) and "markets" overrides the base rate per market type.
+# Check the rates of your own accounts, they differ per jurisdiction and change over time
+FEE_TABLE = {
+    "Betfair": {"rate": 0.02, "discount": 0.0, "markets": {}},
+    "Smarkets": {"rate": 0.02, "discount": 0.0, "markets": {}},
+    "Betdaq": {"rate": 0.02, "discount": 0.0, "markets": {}},
+    "Matchbook": {"rate": 0.02, "discount": 0.0, "markets": {}},
+}
+DEFAULT_EXCHANGE = "Betfair"
+# Upper bound on the total lay stake of market_hedge relative to the largest back payoff, keeps the linear program
+# bounded if the lay prices contain an arbitrage
+MAX_LAY_FACTOR = 10
+
+
+def commission_rate(exchange: str = DEFAULT_EXCHANGE, market: str = None, fee_table: dict = None) -> float:
+    """
+    Effective commission rate on net market winnings after discounts
+
+    :param str exchange: Exchange in fee_table
+    :param str market: Market type, e.g. Match Odds, uses the base rate if the market has no override
+    :param dict fee_table: Rates per exchange in the format of FEE_TABLE, FEE_TABLE by default
+
+    :return: Commission rate in decimal form, 0.02 = 2 %
+    :rtype: float
+    """
+    fees = (FEE_TABLE if fee_table is None else fee_table)[exchange]
+    rate = fees.get("markets", {}).get(market, fees["rate"])
+    return rate * (1 - fees.get("discount", 0.0))
+
+
+def net_winnings(gross: float, commission: float) -> float:
+    """
+    Result of a market after commission, commission is only paid on positive net winnings
+
+    :param float gross: Net result of all bets of the market at the exchange before commission
+    :param float commission: Commission rate from commission_rate
+
+    :rtype: float
+    """
+    return gross - commission * max(gross, 0.0)
+
+
+def lay_stake(stake: float, odds: float, lay_odds: float, bet_type: str, commission: float) -> float:
+    """
+    Lay stake making the result equal whether the back bet wins or loses, when the lay is the only bet of the
+    market at the exchange. If the back bet wins the lay loses stake * (lay_odds - 1), if it loses the lay wins
+    stake * (1 - commission), which gives lay stake = back payout / (lay_odds - commission)
+
+    :param float stake: Stake wagered on the given outcome
+    :param float odds: Odds on the given bet
+    :param float lay_odds: Lay odds offered with the betting exchange on the given outcome
+    :param str bet_type: QB/FB/RFB, must be in the list ["Qualifying bet", "Freebet", "Risk-free bet"]
+    :param float commission: Commission rate from commission_rate
+
+    :return: Lay stake, not rounded
+    :rtype: float
+    """
+    if bet_type == "Qualifying bet":
+        return stake * odds / (lay_odds - commission)
+    elif bet_type in ("Freebet", "Risk-free bet"):
+        return stake * (odds - 1) / (lay_odds - commission)
+    else:
+        raise Exception(
+            f'{bet_type} must be either "Qualifying bet", "Freebet" or "Risk-free bet"')
+
+
+def market_hedge(back_payoffs: dict, lay_odds: dict, market: str = None, fee_table: dict = None,
+                 max_total_lay: float = None) -> dict:
+    """
+    Lay stakes across several exchanges hedging every position held in one market, with the commission of each
+    exchange charged on the net winnings of the market at that exchange.
+
+    Laying several outcomes at the same exchange nets the bets, so less commission is paid than lay_stake assumes
+    per bet and the stakes come out smaller. The stakes maximizing the worst-case result are found with a linear
+    program, the commission enters through one variable u >= max(net winnings, 0) per exchange and outcome
+
+    :param dict back_payoffs: Outcome -> result of the bookmaker positions if the outcome wins, every outcome of
+                              the market must be present
+    :param dict lay_odds: Exchange -> {outcome: best lay odds}, outcomes without a lay price can not be laid there
+    :param str market: Market type for the rate lookup
+    :param dict fee_table: Rates per exchange in the format of FEE_TABLE, FEE_TABLE by default
+    :param float max_total_lay: Upper bound on the total lay stake, MAX_LAY_FACTOR * the largest absolute back
+                                payoff by default
+
+    :return: {"Lay stakes": {exchange: {outcome: stake}} with the stakes above zero,
+              "Payoffs": {outcome: result after commission if the outcome wins},
+              "Profit": worst-case result}
+    :rtype: dict
+    """
+    import numpy as np  # Deferred, see calculators import budget in import_benchmark.py
+    import scipy.optimize
+
+    outcomes = list(back_payoffs)
+    exchanges = list(lay_odds)
+    n_outcomes, n_exchanges = len(outcomes), len(exchanges)
+    if max_total_lay is None:
+        max_total_lay = MAX_LAY_FACTOR * max(abs(payoff) for payoff in back_payoffs.values())
+
+    # Gross result at exchange e if outcome w wins, per unit lay stake on outcome o: -(L - 1) if o == w else 1
+    columns = [(e, o) for e, exchange in enumerate(exchanges) for o, outcome in enumerate(outcomes)
+               if outcome in lay_odds[exchange]]
+    gross = np.zeros((n_exchanges, n_outcomes, len(columns)))
+    for j, (e, o) in enumerate(columns):
+        gross[e, :, j] = 1
+        gross[e, o, j] = -(lay_odds[exchanges[e]][outcomes[o]] - 1)
+    rates = np.array([commission_rate(exchange, market, fee_table) for exchange in exchanges])
+
+    """
+    VARIABLES [lay stakes, u (n_exchanges x n_outcomes), t], MAXIMIZE t SUBJECT TO
+    gross[e, w] @ lay stakes - u[e, w] <= 0
+    t - sum over e of (gross[e, w] @ lay stakes - rates[e] * u[e, w]) <= back_payoffs[w]
+    sum(lay stakes) <= max_total_lay
+    """
+    n_lays, n_u = len(columns), n_exchanges * n_outcomes
+    commission_rows = np.hstack([gross.reshape(n_u, n_lays), -np.eye(n_u), np.zeros((n_u, 1))])
+    rate_u = np.zeros((n_outcomes, n_u))
+    for e in range(n_exchanges):
+        rate_u[np.arange(n_outcomes), e * n_outcomes + np.arange(n_outcomes)] = rates[e]
+    payoff_rows = np.hstack([-gross.sum(axis=0), rate_u, np.ones((n_outcomes, 1))])
+    budget_row = np.concatenate([np.ones(n_lays), np.zeros(n_u + 1)])
+    A_ub = np.vstack([commission_rows, payoff_rows, budget_row])
+    b_ub = np.concatenate([np.zeros(n_u), [back_payoffs[outcome] for outcome in outcomes], [max_total_lay]])
+    # A small cost on the liability picks the cheapest of equally good hedges
+    liabilities = np.array([lay_odds[exchanges[e]][outcomes[o]] - 1 for e, o in columns])
+    objective = np.concatenate([1e-6 * liabilities, np.zeros(n_u), [-1]])
+    bounds = [(0, None)] * (n_lays + n_u) + [(None, None)]
+    result = scipy.optimize.linprog(c=objective, A_ub=A_ub, b_ub=b_ub, bounds=bounds, method="highs")
+    if result.status != 0:
+        raise Exception(f"The market could not be hedged: {result.message}")
+
+    stakes = result.x[:n_lays]
+    lay_stakes = {exchange: {} for exchange in exchanges}
+    for (e, o), stake in zip(columns, stakes):
+        if stake > 1e-9:
+            lay_stakes[exchanges[e]][outcomes[o]] = float(stake)
+    payoffs = {}
+    for w, outcome in enumerate(outcomes):
+        payoffs[outcome] = back_payoffs[outcome] + sum(net_winnings(float(gross[e, w] @ stakes), float(rates[e]))
+                                                       for e in range(n_exchanges))
+    return {"Lay stakes": {exchange: stakes for exchange, stakes in lay_stakes.items() if stakes},
+            "Payoffs": payoffs, "Profit": min(payoffs.values())}
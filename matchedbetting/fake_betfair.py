@@ -0,0 +1,386 @@
+import itertools
+import random
+import threading
+import time
+from bisect import bisect_left
+from datetime import date, datetime, timezone
+
+from betfairlightweight.resources import CurrentOrders, MarketBook, MarketCatalogue, PlaceOrders
+from mb_functions import betfair_price_ladder
+from request_scheduler import MAX_REQUEST_WEIGHT, market_weight
+
+"""
+LOCAL STAND-IN FOR A LOGGED IN betfairlightweight.APIClient
+
+IMPLEMENTS THE PART OF THE BETTING API USED IN THIS REPOSITORY (list_market_catalogue, list_market_book,
+list_runner_book, place_orders, list_current_orders) ON TOP OF IN-MEMORY ORDER BOOKS WITH A SIMPLE MATCHING
+ENGINE. LATENCY AND API ERRORS CAN BE INJECTED TO LOAD TEST hedge_bet AND hedge_bets.py WITHOUT TOUCHING THE
+REAL EXCHANGE, AS CAN place_orders RESPONSES WITH STATUS TIMEOUT FOR ORDERS THAT WERE PLACED (timeout_rate), E.G.
+
+client = FakeAPIClient.generate([("Napoli", "Torino")], latency=0.05, error_rate=0.01)
+hedge_bet(betfair_client=client, home_team="Napoli", away_team="Torino", ...)
+
+RESPONSES ARE RETURNED AS THE SAME betfairlightweight RESOURCES AS THE REAL CLIENT RETURNS.
+"""
+
+PRICE_LADDER = betfair_price_ladder()
+PRICE_SET = set(PRICE_LADDER)
+INJECTED_ERROR_CODES = ["TOO_MANY_REQUESTS", "SERVICE_BUSY", "TIMEOUT_ERROR"]
+# Betfair rejects a place_orders request repeating a customer_ref within this many seconds
+CUSTOMER_REF_WINDOW = 60
+
+
+class FakeAPIError(Exception):
+    """
+    Raised where betfairlightweight would raise betfairlightweight.exceptions.APIError
+    """
+
+    def __init__(self, error_code: str, method: str):
+        super().__init__(f"{method} failed with {error_code}")
+        self.error_code = error_code
+        self.method = method
+
+
+def nearest_tick(price: float) -> int:
+    return min(max(bisect_left(PRICE_LADDER, price), 0), len(PRICE_LADDER) - 1)
+
+
+class FakeMarket:
+    """
+    Catalogue data and order book of one market. Each side of the book is a list of [price, size],
+    available_to_back sorted by descending price and available_to_lay by ascending price, as in the API.
+    """
+
+    def __init__(self, catalogue: dict, book: dict):
+        self.catalogue = catalogue
+        self.market_id = catalogue["marketId"]
+        self.book = {key: val for key, val in book.items() if key != "runners"}
+        self.runners = {}
+        for runner in book["runners"]:
+            ex = runner.get("ex") or {}
+            self.runners[runner["selectionId"]] = {
+                "selectionId": runner["selectionId"], "handicap": runner.get("handicap", 0.0),
+                "status": runner.get("status", "ACTIVE"), "adjustmentFactor": runner.get("adjustmentFactor"),
+                "lastPriceTraded": runner.get("lastPriceTraded"), "totalMatched": runner.get("totalMatched", 0.0),
+                "removalDate": runner.get("removalDate"),
+                "back": [[level["price"], level["size"]] for level in ex.get("availableToBack", [])],
+                "lay": [[level["price"], level["size"]] for level in ex.get("availableToLay", [])]}
+        self.lock = threading.Lock()
+
+    def runner_json(self, runner: dict, price_data: list, depth: int) -> dict:
+        ex = {"availableToBack": [], "availableToLay": [], "tradedVolume": []}
+        if "EX_ALL_OFFERS" in price_data or "EX_BEST_OFFERS" in price_data:
+            levels = None if "EX_ALL_OFFERS" in price_data else depth
+            ex["availableToBack"] = [{"price": p, "size": round(s, 2)} for p, s in runner["back"][:levels]]
+            ex["availableToLay"] = [{"price": p, "size": round(s, 2)} for p, s in runner["lay"][:levels]]
+        return {key: val for key, val in runner.items() if key not in ("back", "lay")} | {"ex": ex}
+
+    def book_json(self, price_data: list, depth: int, selection_id: int = None) -> dict:
+        with self.lock:
+            runners = [self.runner_json(runner, price_data, depth) for sid, runner in self.runners.items()
+                       if selection_id is None or sid == selection_id]
+        return self.book | {"runners": runners}
+
+    def match(self, selection_id: int, side: str, price: float, size: float, consume: bool = True) -> tuple:
+        """
+        Matches a limit order against the opposite side of the book, the unmatched remainder is
+        added to the book as an offer at the limit price. With consume=False the book is left untouched.
+
+        :return: (size matched, average price matched)
+        :rtype: tuple
+        """
+        runner = self.runners[selection_id]
+        if side == "LAY":
+            # A layer takes the offers in available_to_lay, lowest price first
+            offers, crosses, resting, descending = runner["lay"], (lambda p: p <= price), runner["back"], True
+        else:
+            offers, crosses, resting, descending = runner["back"], (lambda p: p >= price), runner["lay"], False
+        if not consume:
+            offers, resting = [list(level) for level in offers], []
+            runner = dict(runner)
+
+        remaining = size
+        matched_value = 0.0
+        while remaining > 1e-9 and offers and crosses(offers[0][0]):
+            offer_price, offer_size = offers[0]
+            fill = min(remaining, offer_size)
+            matched_value += fill * offer_price
+            remaining -= fill
+            runner["totalMatched"] += fill
+            runner["lastPriceTraded"] = offer_price
+            if fill >= offer_size - 1e-9:
+                offers.pop(0)
+            else:
+                offers[0][1] = offer_size - fill
+
+        if remaining > 1e-9:
+            for level in resting:
+                if level[0] == price:
+                    level[1] += remaining
+                    break
+            else:
+                resting.append([price, remaining])
+                resting.sort(key=lambda level: -level[0] if descending else level[0])
+
+        size_matched = size - remaining
+        return size_matched, (matched_value / size_matched if size_matched else 0.0)
+
+    def drift(self, rng: random.Random, max_ticks: int = 1):
+        """
+        Moves every runner's book a random number of ticks, for load tests with moving prices
+        """
+        with self.lock:
+            for runner in self.runners.values():
+                shift = rng.randint(-max_ticks, max_ticks)
+                for side in ("back", "lay"):
+                    for level in runner[side]:
+                        level[0] = PRICE_LADDER[min(max(nearest_tick(level[0]) + shift, 0), len(PRICE_LADDER) - 1)]
+
+
+class FakeBetting:
+    """
+    The betting endpoints of FakeAPIClient
+    """
+
+    def __init__(self, client: "FakeAPIClient"):
+        self.client = client
+
+    def list_market_catalogue(self, filter: dict = None, market_projection: list = None, max_results: int = 1000,
+                              **kwargs) -> list:
+        self.client.simulate("list_market_catalogue")
+        filter = filter or {}
+        catalogues = []
+        for market in self.client.markets.values():
+            catalogue = market.catalogue
+            if filter.get("marketIds") and market.market_id not in filter["marketIds"]:
+                continue
+            if filter.get("textQuery") and filter["textQuery"] not in catalogue["event"]["name"]:
+                continue
+            start_time = filter.get("marketStartTime")
+            if start_time and not start_time["from"] <= catalogue["marketStartTime"][:10] < start_time["to"]:
+                continue
+            catalogues.append(catalogue)
+        return [MarketCatalogue(**catalogue) for catalogue in catalogues[:max_results]]
+
+    def list_market_book(self, market_ids: list, price_projection: dict = None, **kwargs) -> list:
+        price_data, depth = self.client.projection(price_projection)
+        self.client.check_weight(len(market_ids), price_projection, "list_market_book")
+        self.client.simulate("list_market_book")
+        return [MarketBook(**self.client.markets[market_id].book_json(price_data, depth))
+                for market_id in market_ids if market_id in self.client.markets]
+
+    def list_runner_book(self, market_id: str, selection_id: int, price_projection: dict = None, **kwargs) -> list:
+        price_data, depth = self.client.projection(price_projection)
+        self.client.simulate("list_runner_book")
+        return [MarketBook(**self.client.markets[market_id].book_json(price_data, depth, int(selection_id)))]
+
+    def place_orders(self, market_id: str, instructions: list, customer_ref: str = None, **kwargs):
+        self.client.simulate("place_orders")
+        return PlaceOrders(**self.client.place(market_id, instructions, customer_ref))
+
+    def list_current_orders(self, bet_ids: list = None, market_ids: list = None, customer_order_refs: list = None,
+                            **kwargs):
+        self.client.simulate("list_current_orders")
+        with self.client.lock:
+            orders = [order for order in self.client.orders
+                      if (not bet_ids or order["betId"] in bet_ids)
+                      and (not market_ids or order["marketId"] in market_ids)
+                      and (not customer_order_refs or order.get("customerOrderRef") in customer_order_refs)]
+        return CurrentOrders(currentOrders=orders, moreAvailable=False)
+
+
+class FakeAPIClient:
+    """
+    Drop-in replacement for a logged in betfairlightweight.APIClient
+
+    :param list markets: FakeMarket objects, see FakeAPIClient.generate and FakeAPIClient.from_fixtures
+    :param float latency: Seconds added to every call
+    :param float latency_jitter: Upper bound of an additional uniformly distributed delay per call
+    :param float error_rate: Probability that a call raises FakeAPIError
+    :param float timeout_rate: Probability that place_orders places the orders but reports status TIMEOUT, as Betfair
+                               does when the outcome is not known in time and listCurrentOrders must be checked
+    :param int seed: Seed for the latency, error and price generators
+    :param bool consume_liquidity: If False, matched orders leave the books unchanged, e.g. for benchmarks
+    """
+
+    def __init__(self, markets: list, latency: float = 0.0, latency_jitter: float = 0.0, error_rate: float = 0.0,
+                 seed: int = None, consume_liquidity: bool = True, timeout_rate: float = 0.0):
+        self.markets = {market.market_id: market for market in markets}
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.consume_liquidity = consume_liquidity
+        self.rng = random.Random(seed)
+        self.betting = FakeBetting(self)
+        self.session_expired = True
+        self.orders = []
+        self.lock = threading.Lock()
+        self._bet_ids = itertools.count(300000000000)
+        self._customer_refs = {}
+
+    """
+    SESSION HANDLING
+    """
+
+    def login(self, *args, **kwargs):
+        self.session_expired = False
+
+    def login_interactive(self, *args, **kwargs):
+        self.session_expired = False
+
+    def keep_alive(self):
+        self.simulate("keep_alive")
+
+    def logout(self):
+        self.session_expired = True
+
+    """
+    SIMULATION
+    """
+
+    def simulate(self, method: str):
+        with self.lock:
+            delay = self.latency + self.rng.uniform(0, self.latency_jitter)
+            fail = self.rng.random() < self.error_rate
+            error_code = self.rng.choice(INJECTED_ERROR_CODES)
+        if delay:
+            time.sleep(delay)
+        if fail:
+            raise FakeAPIError(error_code, method)
+
+    @staticmethod
+    def projection(price_projection: dict) -> tuple:
+        if not price_projection:
+            return [], 3
+        depth = (price_projection.get("exBestOffersOverrides") or {}).get("bestPricesDepth", 3)
+        return price_projection.get("priceData", []), depth
+
+    @staticmethod
+    def check_weight(n_markets: int, price_projection: dict, method: str):
+        weight = n_markets * market_weight(price_projection)
+        if weight > MAX_REQUEST_WEIGHT:
+            raise FakeAPIError("TOO_MUCH_DATA", method)
+
+    def place(self, market_id: str, instructions: list, customer_ref: str = None) -> dict:
+        now = time.monotonic()
+        with self.lock:
+            if customer_ref is not None:
+                if now - self._customer_refs.get(customer_ref, -CUSTOMER_REF_WINDOW) < CUSTOMER_REF_WINDOW:
+                    return {"status": "FAILURE", "errorCode": "DUPLICATE_TRANSACTION", "marketId": market_id,
+                            "customerRef": customer_ref, "instructionReports": []}
+                self._customer_refs[customer_ref] = now
+
+        market = self.markets.get(market_id)
+        if market is None:
+            return {"status": "FAILURE", "errorCode": "MARKET_NOT_OPEN_FOR_BETTING", "marketId": market_id,
+                    "customerRef": customer_ref, "instructionReports": []}
+
+        reports = []
+        for instruction in instructions:
+            limit_order = instruction["limitOrder"]
+            selection_id = int(instruction["selectionId"])
+            if selection_id not in market.runners or round(limit_order["price"], 2) not in PRICE_SET:
+                reports.append({"status": "FAILURE", "errorCode": "INVALID_ODDS" if selection_id in market.runners
+                                else "INVALID_RUNNER", "instruction": instruction})
+                continue
+            with market.lock:
+                size_matched, average_price = market.match(
+                    selection_id, instruction["side"], round(limit_order["price"], 2), limit_order["size"],
+                    self.consume_liquidity)
+            bet_id = str(next(self._bet_ids))
+            placed_date = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+            order_status = "EXECUTION_COMPLETE" if size_matched >= limit_order["size"] - 1e-9 else "EXECUTABLE"
+            with self.lock:
+                self.orders.append({
+                    "betId": bet_id, "marketId": market_id, "selectionId": selection_id, "handicap": 0.0,
+                    "side": instruction["side"], "orderType": instruction["orderType"],
+                    "persistenceType": limit_order.get("persistenceType"), "status": order_status,
+                    "priceSize": {"price": limit_order["price"], "size": limit_order["size"]},
+                    "placedDate": placed_date, "bspLiability": 0.0, "averagePriceMatched": average_price,
+                    "sizeMatched": size_matched, "sizeRemaining": limit_order["size"] - size_matched,
+                    "sizeCancelled": 0.0, "sizeLapsed": 0.0, "sizeVoided": 0.0,
+                    "customerOrderRef": instruction.get("customerOrderRef")})
+            reports.append({"status": "SUCCESS", "orderStatus": order_status, "betId": bet_id,
+                            "averagePriceMatched": average_price, "sizeMatched": size_matched,
+                            "placedDate": placed_date, "instruction": instruction})
+
+        with self.lock:
+            timeout = self.rng.random() < self.timeout_rate
+        if timeout:
+            # The orders stand, only the response does not say so
+            return {"status": "TIMEOUT", "errorCode": None, "marketId": market_id, "customerRef": customer_ref,
+                    "instructionReports": [{"status": "TIMEOUT", "instruction": report["instruction"]}
+                                           for report in reports]}
+
+        status = "SUCCESS" if all(report["status"] == "SUCCESS" for report in reports) else "FAILURE"
+        return {"status": status, "errorCode": None if status == "SUCCESS" else "BET_ACTION_ERROR",
+                "marketId": market_id, "customerRef": customer_ref, "instructionReports": reports}
+
+    """
+    CONSTRUCTORS
+    """
+
+    @classmethod
+    def from_fixtures(cls, catalogues: list, books: list, **kwargs) -> "FakeAPIClient":
+        """
+        Builds the client from recorded listMarketCatalogue and listMarketBook responses
+        """
+        books = {book["marketId"]: book for book in books}
+        return cls([FakeMarket(catalogue, books[catalogue["marketId"]]) for catalogue in catalogues
+                    if catalogue["marketId"] in books], **kwargs)
+
+    @classmethod
+    def generate(cls, games: list, market_date: str = None, depth: int = 10, overround: float = 1.03,
+                 seed: int = None, **kwargs) -> "FakeAPIClient":
+        """
+        Builds a client with Match Odds, Over/Under 2.5 Goals and Both teams to Score? markets for every game
+
+        :param list games: List of (home team, away team) in Betfair format
+        :param str market_date: Start date of every market "YYYY-MM-DD", today by default
+        :param int depth: Number of price levels on each side of every book
+        :param float overround: Sum of the implied probabilities of the best back prices
+        :param int seed: Seed for the generated prices and sizes
+        """
+        rng = random.Random(seed)
+        start = f"{market_date or date.today().isoformat()}T18:45:00.000Z"
+        market_ids = itertools.count(1)
+        # As on Betfair a team keeps its selection id across markets
+        selection_ids = {}
+        markets = []
+        for event_nr, (home, away) in enumerate(games):
+            event = {"id": str(32000000 + event_nr), "name": f"{home} v {away}", "countryCode": "GB",
+                     "timezone": "Europe/London", "openDate": start}
+            home_strength = rng.uniform(0.25, 0.6)
+            draw = rng.uniform(0.22, 0.3)
+            over = rng.uniform(0.4, 0.6)
+            btts = rng.uniform(0.4, 0.6)
+            for market_name, runners in [
+                    ("Match Odds", [(home, home_strength * (1 - draw)), (away, (1 - home_strength) * (1 - draw)),
+                                    ("The Draw", draw)]),
+                    ("Over/Under 2.5 Goals", [("Under 2.5 Goals", 1 - over), ("Over 2.5 Goals", over)]),
+                    ("Both teams to Score?", [("Yes", btts), ("No", 1 - btts)])]:
+                market_id = f"1.{210000000 + next(market_ids)}"
+                runner_catalogues, runner_books = [], []
+                for sort_priority, (runner_name, probability) in enumerate(runners, start=1):
+                    selection_id = selection_ids.setdefault(runner_name, 40000 + len(selection_ids))
+                    best_back = nearest_tick(1 / (probability * overround ** (1 / len(runners))))
+                    runner_catalogues.append({"selectionId": selection_id, "runnerName": runner_name, "handicap": 0.0,
+                                              "sortPriority": sort_priority, "metadata": {}})
+                    runner_books.append({
+                        "selectionId": selection_id, "handicap": 0.0, "status": "ACTIVE",
+                        "lastPriceTraded": PRICE_LADDER[best_back], "totalMatched": round(rng.uniform(1e3, 1e5), 2),
+                        "ex": {"availableToBack": [{"price": PRICE_LADDER[max(best_back - i, 0)],
+                                                    "size": round(rng.uniform(5, 800) * (1 + i), 2)}
+                                                   for i in range(depth) if best_back - i >= 0],
+                               "availableToLay": [{"price": PRICE_LADDER[best_back + 1 + i],
+                                                   "size": round(rng.uniform(5, 800) * (1 + i), 2)}
+                                                  for i in range(depth) if best_back + 1 + i < len(PRICE_LADDER)]}})
+                catalogue = {"marketId": market_id, "marketName": market_name, "marketStartTime": start,
+                             "totalMatched": sum(runner["totalMatched"] for runner in runner_books),
+                             "runners": runner_catalogues, "event": event}
+                book = {"marketId": market_id, "isMarketDataDelayed": False, "status": "OPEN", "betDelay": 0,
+                        "inplay": False, "numberOfWinners": 1, "numberOfRunners": len(runners),
+                        "numberOfActiveRunners": len(runners), "version": 1, "runners": runner_books}
+                markets.append(FakeMarket(catalogue, book))
+        return cls(markets, seed=seed, **kwargs)
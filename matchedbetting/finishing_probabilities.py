@@ -0,0 +1,166 @@
+import itertools
+
+import numpy as np
+
+from calculators import return_to_player
+
+"""
+FINISHING-ORDER PROBABILITIES FROM WIN ODDS
+
+THE BOOKMAKER MARGIN IS REMOVED FROM THE WIN ODDS (VOdds FROM THE SCRAPERS) WITH return_to_player, WHICH GIVES THE
+WIN PROBABILITIES. FINISHING ORDERS FOLLOW THE HARVILLE MODEL: GIVEN THE HORSES ALREADY PLACED, EACH REMAINING HORSE
+TAKES THE NEXT PLACE WITH PROBABILITY PROPORTIONAL TO ITS WIN PROBABILITY. TOP-3 AND PAIRWISE PROBABILITIES ARE
+COMPUTED EXACTLY, DEEPER ORDERS BY MONTE-CARLO, E.G.
+
+p = win_probabilities(lopp_df["VOdds"])
+harville_positions(p)[:, :3].sum(axis=1)        # Probability of every horse finishing top 3
+pairwise_probabilities(p)[i, j]                 # Probability that horse i finishes ahead of horse j
+"""
+
+# Odds at or above this value mark a scratched horse, the scrapers set scratched horses to 999
+SCRATCHED_ODDS = 999
+
+
+def win_probabilities(odds) -> np.ndarray:
+    """
+    Removes the bookmaker margin from win odds, p_i = return_to_player / odds_i
+
+    :param odds: Win odds, one per horse. Missing odds and odds of SCRATCHED_ODDS or more are scratched horses
+
+    :return: Win probability per horse summing to 1, 0 for scratched horses
+    :rtype: np.ndarray
+    """
+    odds = np.asarray(odds, dtype=float)
+    running = ~np.isnan(odds) & (odds < SCRATCHED_ODDS)
+    probabilities = np.zeros(len(odds))
+    if running.any():
+        probabilities[running] = return_to_player(odds[running]) / odds[running]
+    return probabilities
+
+
+def harville_positions(p) -> np.ndarray:
+    """
+    Exact Harville probabilities of every horse finishing first, second and third
+
+    :param p: Win probabilities from win_probabilities
+
+    :return: (n x 3) array, element [i, m] is the probability of horse i finishing in position m + 1
+    :rtype: np.ndarray
+    """
+    p = np.asarray(p, dtype=float)
+    n = len(p)
+    eye = np.eye(n, dtype=bool)
+
+    # Probability that the remaining field after removing j (and l) is won by i
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # second[j, i] = P(j first, i second)
+        second = np.where(eye, 0, p[:, None] * p[None, :] / (1 - p[:, None]))
+        # third[j, l, i] = P(j first, l second, i third)
+        remaining = 1 - p[:, None] - p[None, :]
+        third = second[:, :, None] * p[None, None, :] / remaining[:, :, None]
+    second = np.nan_to_num(second, nan=0.0, posinf=0.0)
+    third = np.nan_to_num(third, nan=0.0, posinf=0.0)
+    distinct = ~(eye[:, :, None] | eye[:, None, :] | eye[None, :, :])
+    third = np.where(distinct, third, 0)
+
+    return np.column_stack([p, second.sum(axis=0), third.sum(axis=(0, 1))])
+
+
+def harville_combinations(p, places: int = 3) -> np.ndarray:
+    """
+    Exact Harville probability of every unordered set of horses filling the paid places, in the order of
+    calculators.finishing_combinations
+
+    :param p: Win probabilities from win_probabilities
+    :param int places: Number of paid places, at most 3
+
+    :return: Probability per combination
+    :rtype: np.ndarray
+    """
+    assert places <= 3, "Use monte_carlo_positions for more than three places"
+    p = np.asarray(p, dtype=float)
+    combinations = np.array(list(itertools.combinations(range(len(p)), places)), dtype=int).reshape(-1, places)
+    probabilities = np.zeros(len(combinations))
+    # Sums the probability of every ordering of the combination
+    for order in itertools.permutations(range(places)):
+        ordered = p[combinations[:, order]]
+        probability = np.ones(len(combinations))
+        taken = np.zeros(len(combinations))
+        for position in range(places):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                probability *= ordered[:, position] / (1 - taken)
+            taken += ordered[:, position]
+        probabilities += np.nan_to_num(probability, nan=0.0, posinf=0.0)
+    return probabilities
+
+
+def pairwise_probabilities(p) -> np.ndarray:
+    """
+    Probability of horse i finishing ahead of horse j, p_i / (p_i + p_j) under Harville. Also the fair H2H probability.
+
+    :param p: Win probabilities from win_probabilities
+
+    :return: (n x n) array, NaN where both horses are scratched
+    :rtype: np.ndarray
+    """
+    p = np.asarray(p, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pairwise = p[:, None] / (p[:, None] + p[None, :])
+    np.fill_diagonal(pairwise, np.nan)
+    return pairwise
+
+
+def group_probabilities(p, groups) -> np.ndarray:
+    """
+    Probability of each horse in a group finishing ahead of the others in the group, p_i / sum(p_group) under
+    Harville. Evaluates the fair odds of H2H/H3H matchups
+
+    :param p: Win probabilities from win_probabilities
+    :param groups: (m x k) array of horse indices, e.g. one row per matchup
+
+    :return: (m x k) array of probabilities
+    :rtype: np.ndarray
+    """
+    p = np.asarray(p, dtype=float)
+    group_p = p[np.asarray(groups, dtype=int)]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return group_p / group_p.sum(axis=1, keepdims=True)
+
+
+def monte_carlo_positions(p, n_simulations: int = 20000, seed: int = None) -> np.ndarray:
+    """
+    Monte-Carlo estimate of the full finishing-order distribution. Harville is equivalent to an exponential race,
+    every horse gets a finishing time drawn from an exponential distribution with rate p_i and the order of the
+    times is the finishing order
+
+    :param p: Win probabilities from win_probabilities
+    :param int n_simulations: Number of simulated races
+    :param int seed: Seed for the random generator
+
+    :return: (n x n) array, element [i, m] is the estimated probability of horse i finishing in position m + 1.
+             Scratched horses are placed last
+    :rtype: np.ndarray
+    """
+    p = np.asarray(p, dtype=float)
+    n = len(p)
+    rng = np.random.default_rng(seed)
+    with np.errstate(divide="ignore"):
+        times = rng.standard_exponential((n_simulations, n), dtype=np.float32) / p.astype(np.float32)
+    # order[s, m] is the horse finishing in position m + 1 of simulation s
+    order = np.argsort(times, axis=1)
+    counts = np.bincount((order * n + np.arange(n)).ravel(), minlength=n * n).reshape(n, n)
+    return counts / n_simulations
+
+
+def top_k_probabilities(p, k: int = 3, n_simulations: int = 20000, seed: int = None) -> np.ndarray:
+    """
+    Probability of every horse finishing in the top k, exact for k <= 3 and by Monte-Carlo otherwise
+
+    :param p: Win probabilities from win_probabilities
+    :param int k: Number of places
+
+    :rtype: np.ndarray
+    """
+    if k <= 3:
+        return harville_positions(p)[:, :k].sum(axis=1)
+    return monte_carlo_positions(p, n_simulations, seed)[:, :k].sum(axis=1)
@@ -0,0 +1,492 @@
+import numpy as np
+import pandas as pd
+
+import commission
+from calculators import FREEBET_RETENTION
+from tracing import span
+
+"""
+PLANNER FOR CONVERTING FREEBETS AND RISK-FREE BETS
+
+FINDS THE MARKET, OUTCOME AND ODDS GIVING THE HIGHEST RETENTION (CASH KEPT PER KRONA OF BONUS STAKE) FOR EVERY BONUS
+TOKEN. A BONUS BET AT ODDS B IS EITHER LAID AT THE EXCHANGE AT L, OR HEDGED BY BACKING EVERY OTHER OUTCOME OF THE
+MARKET AT THE BEST BOOKMAKER ODDS. BOTH ARE DESCRIBED BY THE HEDGE COST k PER KRONA OF PAYOUT,
+
+    LAY:           k = (L - 1) / (L - fee)
+    BACK OTHERS:   k = SUM OVER THE OTHER OUTCOMES OF 1 / best odds
+
+AND THE RETENTION OF A FULLY HEDGED BET IS
+
+    (B - 1) - (B - r) * k
+
+WITH r = 1 FOR FREEBETS AND RISK-FREE BETS REFUNDED IN CASH AND r = freebet_retention FOR RISK-FREE BETS REFUNDED AS A
+FREEBET, THE SAME FORMULAS AS calculators.freebet_2way, rfbet_2way AND mb_functions.lay_bet_calculator. EVERY QUOTE
+OF AN ODDS SNAPSHOT IS EVALUATED AT ONCE WITH NUMPY, THE RESULT IS MEMOISED UNTIL THE NEXT SNAPSHOT, E.G.
+
+planner = FreebetPlanner()
+planner.update_snapshot(back_quotes_from_odds_matrix(matris, "Solvalla"),
+                        lay_quotes_from_runner_books("Solvalla Lopp 3", process_runner_books(runners), names))
+planner.plan([{"Bookmaker": "unibet", "Bet type": "Freebet", "Stake": 100}, ...])
+
+THE BEST LAY PRICE ONLY HOLDS FOR THE SIZE OFFERED AT IT. retention_curves WALKS THE FULL LAY LADDER (list_market_book
+WITH EX_ALL_OFFERS, SEE exchange_lay_ladders) AND GIVES THE RETENTION OF EVERY OFFER AS A FUNCTION OF THE BONUS STAKE.
+A LAY OF x AT PRICE L COVERS x * (L - fee) OF THE PAYOUT S * (B - r), SO THE LEVELS ARE FILLED FROM THE LOWEST PRICE
+UNTIL THEIR CUMULATIVE COVER REACHES THE PAYOUT, FOUND FOR ALL OFFERS AND STAKES AT ONCE WITH np.searchsorted, E.G.
+
+planner.update_snapshot(back_quotes, lay_ladders=exchange_lay_ladders(trading, {market_id: ("Solvalla Lopp 3", names)}))
+planner.curves("Freebet", [50, 100, 200, 500])
+
+WHEN THE SNAPSHOT HAS LAY SIZES (LAY LADDERS, OR LAY QUOTES WITH A Size COLUMN AS FROM lay_quotes_from_runner_books)
+plan SIZES EVERY LAY AT THE STAKE OF THE TOKEN WITH retention_curves, AND SKIPS LAYS THE OFFERED SIZE CAN NOT FILL
+"""
+
+"""
+INPUT DATA + PARAMETERS
+"""
+# Odds at or above this value mark a scratched horse
+SCRATCHED_ODDS = 999
+# Placeholder lay price of process_runner_books for runners without lay offers
+NO_LAY_PRICE = 1000.0
+# list_market_book is limited to a weight of 200 per request, EX_ALL_OFFERS weighs 17 per market
+MARKETS_PER_LADDER_REQUEST = 11
+BONUS_BET_TYPES = ["Freebet", "Risk-free bet"]
+
+CURVE_COLUMNS = ["Market", "Outcome", "Bookmaker", "Odds", "Stake", "Lay stake", "Average lay odds", "Retention",
+                 "Max stake"]
+PLAN_COLUMNS = ["Bookmaker", "Bet type", "Stake", "Market", "Outcome", "Odds", "Hedge", "Hedge odds", "Hedge stake",
+                "Retention", "Profit"]
+
+
+def back_quotes_from_odds_matrix(matris: pd.DataFrame, bana: str = "", field: str = "VOdds") -> pd.DataFrame:
+    """
+    Bookmaker quotes from an oddsmatris of scrape_orchestrator.skrapa_tävlingsdag, one win market per race
+
+    :param pd.DataFrame matris: Index [Lopp, Häst], columns "{källa} VOdds" and "{källa} POdds"
+    :param str bana: Prefix of the market keys, "{bana} Lopp {lopp}"
+    :param str field: Only "VOdds" gives mutually exclusive outcomes
+
+    :return: Dataframe with the columns [Market, Outcome, Bookmaker, Odds]
+    :rtype: pd.DataFrame
+    """
+    suffix = f" {field}"
+    columns = [column for column in matris.columns if column.endswith(suffix)]
+    long = matris[columns].rename(columns=lambda column: column[:-len(suffix)]).reset_index().melt(
+        id_vars=["Lopp", "Häst"], var_name="Bookmaker", value_name="Odds")
+    return pd.DataFrame({"Market": (bana + " Lopp " + long["Lopp"].astype(str)).str.strip(), "Outcome": long["Häst"],
+                         "Bookmaker": long["Bookmaker"], "Odds": long["Odds"]})
+
+
+def lay_quotes_from_runner_books(market: str, runner_books_df: pd.DataFrame, runner_names: dict) -> pd.DataFrame:
+    """
+    Exchange quotes from the dataframe of mb_functions.process_runner_books
+
+    :param str market: Market key, the same as in the bookmaker quotes
+    :param pd.DataFrame runner_books_df: Output of process_runner_books
+    :param dict runner_names: Selection id -> outcome name, as in the bookmaker quotes
+
+    :return: Dataframe with the columns [Market, Outcome, Odds, Size]
+    :rtype: pd.DataFrame
+    """
+    active = runner_books_df[(runner_books_df["Status"] == "ACTIVE") &
+                             (runner_books_df["Best Lay Price"] < NO_LAY_PRICE)]
+    return pd.DataFrame({"Market": market, "Outcome": active["Selection ID"].map(runner_names).to_numpy(),
+                         "Odds": active["Best Lay Price"].to_numpy(), "Size": active["Best Lay Size"].to_numpy()})
+
+
+def lay_ladders_from_runner_ladders(market: str, runner_ladders_df: pd.DataFrame, runner_names: dict) -> pd.DataFrame:
+    """
+    Exchange lay ladders from the dataframe of mb_functions.process_runner_ladders
+
+    :param str market: Market key, the same as in the bookmaker quotes
+    :param pd.DataFrame runner_ladders_df: Output of process_runner_ladders
+    :param dict runner_names: Selection id -> outcome name, as in the bookmaker quotes
+
+    :return: Dataframe with the columns [Market, Outcome, Price, Size], one row per lay level of the active runners
+    :rtype: pd.DataFrame
+    """
+    lay = runner_ladders_df[(runner_ladders_df["Status"] == "ACTIVE") & (runner_ladders_df["Side"] == "Lay")]
+    return pd.DataFrame({"Market": market, "Outcome": lay["Selection ID"].map(runner_names).to_numpy(),
+                         "Price": lay["Price"].to_numpy(), "Size": lay["Size"].to_numpy()})
+
+
+def exchange_lay_ladders(betfair_client: "betfairlightweight.apiclient.APIClient", markets: dict) -> pd.DataFrame:
+    """
+    Fetches the full lay ladder of every runner in the given markets with EX_ALL_OFFERS
+
+    :param betfairlightweight.apiclient.APIClient betfair_client: A logged in betfairlightweight.APIClient() session
+    :param dict markets: Market id -> (market key, {selection id: outcome name}), keys and names as in the bookmaker
+                         quotes
+
+    :return: Dataframe with the columns [Market, Outcome, Price, Size]
+    :rtype: pd.DataFrame
+    """
+    import betfairlightweight
+    from mb_functions import process_runner_ladders
+
+    market_ids = list(markets)
+    price_filter = betfairlightweight.filters.price_projection(price_data=["EX_ALL_OFFERS"])
+    ladders = []
+    for i in range(0, len(market_ids), MARKETS_PER_LADDER_REQUEST):
+        with span("betfair.list_market_book"):
+            market_books = betfair_client.betting.list_market_book(
+                market_ids=market_ids[i:i + MARKETS_PER_LADDER_REQUEST], price_projection=price_filter)
+        for market_book in market_books:
+            market, runner_names = markets[market_book.market_id]
+            ladders.append(lay_ladders_from_runner_ladders(market, process_runner_ladders(market_book.runners),
+                                                           runner_names))
+    return pd.concat(ladders, ignore_index=True) if ladders else pd.DataFrame(columns=["Market", "Outcome", "Price",
+                                                                                       "Size"])
+
+
+def hedge_costs(back_quotes: pd.DataFrame, lay_quotes: pd.DataFrame = None, exchange_fee: float = None) -> pd.DataFrame:
+    """
+    Hedge cost k of every bookmaker quote, both at the exchange and by backing the other outcomes
+
+    :param pd.DataFrame back_quotes: Columns [Market, Outcome, Bookmaker, Odds], every outcome of a market must be
+                                     present for the back hedge, missing odds make the back hedge unavailable
+    :param pd.DataFrame lay_quotes: Columns [Market, Outcome, Odds], optional
+    :param float exchange_fee: Commission on net winnings at the exchange, looked up per market with
+                               commission.commission_rate if None
+
+    :return: Dataframe with the columns [Market, Outcome, Bookmaker, Odds, Hedge, Hedge odds, Hedge cost], one row per
+             quote and available hedge
+    :rtype: pd.DataFrame
+    """
+    back_quotes = back_quotes[~(back_quotes["Odds"] >= SCRATCHED_ODDS)]
+    odds = back_quotes["Odds"].to_numpy(dtype=float)
+    market_codes, markets = pd.factorize(back_quotes["Market"])
+    outcome_codes = back_quotes.groupby(["Market", "Outcome"], sort=False).ngroup().to_numpy()
+
+    # Best odds per outcome, NaN if no bookmaker prices it
+    best = np.full(outcome_codes.max() + 1 if len(outcome_codes) else 0, np.nan)
+    np.fmax.at(best, outcome_codes, odds)
+    outcome_market = np.empty(len(best), dtype=int)
+    outcome_market[outcome_codes] = market_codes
+    # Sum of 1 / best odds per market, NaN if an outcome is missing
+    market_inverse = np.zeros(len(markets))
+    np.add.at(market_inverse, outcome_market, 1 / best)
+    back_cost = market_inverse[market_codes] - 1 / best[outcome_codes]
+
+    tables = [back_quotes.assign(**{"Hedge": "Back others", "Hedge odds": np.nan, "Hedge cost": back_cost})]
+    if lay_quotes is not None and len(lay_quotes):
+        lay = back_quotes.merge(lay_quotes[["Market", "Outcome", "Odds"]].rename(columns={"Odds": "Hedge odds"}),
+                                on=["Market", "Outcome"])
+        lay_odds = lay["Hedge odds"].to_numpy(dtype=float)
+        if exchange_fee is None:
+            lay_markets, unique_markets = pd.factorize(lay["Market"])
+            fees = np.array([commission.commission_rate(commission.DEFAULT_EXCHANGE, market)
+                             for market in unique_markets])[lay_markets]
+        else:
+            fees = exchange_fee
+        tables.append(lay.assign(**{"Hedge": "Lay", "Hedge cost": (lay_odds - 1) / (lay_odds - fees)}))
+
+    table = pd.concat(tables, ignore_index=True)
+    return table[np.isfinite(table["Odds"].to_numpy(dtype=float) * table["Hedge cost"].to_numpy())
+                 ].reset_index(drop=True)
+
+
+def retention_table(costs: pd.DataFrame, share_returned: float = 1.0) -> pd.DataFrame:
+    """
+    Retention of a bonus bet on every quote, (B - 1) - (B - r) * k evaluated for all rows at once
+
+    :param pd.DataFrame costs: Output of hedge_costs
+    :param float share_returned: r in the module docstring, 1 for freebets and risk-free bets refunded in cash
+
+    :return: costs with the column Retention added, sorted by Retention
+    :rtype: pd.DataFrame
+    """
+    odds = costs["Odds"].to_numpy(dtype=float)
+    retention = (odds - 1) - (odds - share_returned) * costs["Hedge cost"].to_numpy()
+    order = np.argsort(-retention, kind="stable")
+    table = costs.take(order).reset_index(drop=True)
+    table["Retention"] = retention[order]
+    return table
+
+
+def retention_curves(back_quotes: pd.DataFrame, lay_ladders: pd.DataFrame, stakes, share_returned: float = 1.0,
+                     exchange_fee: float = None) -> pd.DataFrame:
+    """
+    Retention of every bookmaker quote laid at the exchange, as a function of the bonus stake, after walking the lay
+    ladder of the outcome. A stake S at odds B needs lay stakes x covering sum(x * (L - fee)) = S * (B - r), and keeps
+
+        retention = (sum(x) * (1 - fee) - S * (1 - r)) / S
+
+    which equals the retention_table value while the stake fits in the best level and falls as deeper levels are used
+
+    :param pd.DataFrame back_quotes: Columns [Market, Outcome, Bookmaker, Odds]
+    :param pd.DataFrame lay_ladders: Columns [Market, Outcome, Price, Size], e.g. from exchange_lay_ladders
+    :param stakes: Bonus stakes to evaluate
+    :param float share_returned: r, 1 for freebets and risk-free bets refunded in cash
+    :param float exchange_fee: Commission on net winnings at the exchange, looked up per market with
+                               commission.commission_rate if None
+
+    :return: Dataframe with the columns [Market, Outcome, Bookmaker, Odds, Stake, Lay stake, Average lay odds,
+             Retention, Max stake], one row per quote with a lay ladder and stake. Lay stake, Average lay odds and
+             Retention are NaN for stakes above Max stake, the largest stake the ladder can hedge
+    :rtype: pd.DataFrame
+    """
+    stakes = np.asarray(stakes, dtype=float)
+    ladders = lay_ladders[(lay_ladders["Size"] > 0) & (lay_ladders["Price"] < NO_LAY_PRICE)].sort_values(
+        ["Market", "Outcome", "Price"], kind="stable")
+    price, size = ladders["Price"].to_numpy(dtype=float), ladders["Size"].to_numpy(dtype=float)
+    if exchange_fee is None:
+        ladder_markets, unique_markets = pd.factorize(ladders["Market"])
+        fee = np.array([commission.commission_rate(commission.DEFAULT_EXCHANGE, market)
+                        for market in unique_markets])[ladder_markets]
+    else:
+        fee = np.full(len(ladders), exchange_fee)
+
+    # Cumulative payout cover, lay stake and commission per level, prepended with 0 so that level j of the flat
+    # ladder spans cover[j] to cover[j + 1]
+    cover = np.concatenate([[0], np.cumsum(size * (price - fee))])
+    filled = np.concatenate([[0], np.cumsum(size)])
+    charged = np.concatenate([[0], np.cumsum(size * fee)])
+    liability = np.concatenate([[0], np.cumsum(size * (price - 1))])
+    outcome_levels = ladders.reset_index(drop=True).reset_index().groupby(["Market", "Outcome"], sort=False)["index"]
+    bounds = pd.DataFrame({"Start": outcome_levels.min(), "End": outcome_levels.max() + 1}).reset_index()
+
+    offers = back_quotes[~(back_quotes["Odds"] >= SCRATCHED_ODDS)].merge(bounds, on=["Market", "Outcome"])
+    odds = offers["Odds"].to_numpy(dtype=float)[:, None]
+    start, end = offers["Start"].to_numpy()[:, None], offers["End"].to_numpy()[:, None]
+
+    # Cover needed per offer and stake, searched in the flat ladder from the start of the outcome's levels
+    target = cover[start] + stakes[None, :] * (odds - share_returned)
+    level = np.searchsorted(cover, target, side="left") - 1
+    fits = (level < end) & (stakes[None, :] > 0)
+    level = np.where(fits, level, start)
+    partial = (target - cover[level]) / (price[level] - fee[level])
+    lay_stake = filled[level] - filled[start] + partial
+    commission_paid = charged[level] - charged[start] + partial * fee[level]
+    lay_liability = liability[level] - liability[start] + partial * (price[level] - 1)
+    retention = (lay_stake - commission_paid - stakes[None, :] * (1 - share_returned)) / stakes[None, :]
+
+    n_offers, n_stakes = len(offers), len(stakes)
+    return pd.DataFrame({
+        "Market": np.repeat(offers["Market"].to_numpy(), n_stakes),
+        "Outcome": np.repeat(offers["Outcome"].to_numpy(), n_stakes),
+        "Bookmaker": np.repeat(offers["Bookmaker"].to_numpy(), n_stakes),
+        "Odds": np.repeat(odds.ravel(), n_stakes),
+        "Stake": np.tile(stakes, n_offers),
+        "Lay stake": np.where(fits, lay_stake, np.nan).ravel(),
+        "Average lay odds": np.where(fits, 1 + lay_liability / lay_stake, np.nan).ravel(),
+        "Retention": np.where(fits, retention, np.nan).ravel(),
+        "Max stake": np.repeat(((cover[end] - cover[start]) / (odds - share_returned)).ravel(), n_stakes),
+    }, columns=CURVE_COLUMNS)
+
+
+class FreebetPlanner:
+    """
+    Plans the conversion of freebets and risk-free bets on an odds snapshot, memoising the retention tables until
+    the snapshot changes
+
+    :param float exchange_fee: Commission on net winnings at the exchange, per market from commission.commission_rate
+                               if None
+    :param bool rf_stake_returned_as_freebet: True if the stake of a lost risk-free bet is returned as a freebet
+    :param float freebet_retention: Value of a returned freebet per krona, None to use the best freebet retention
+                                    of the current snapshot
+    """
+
+    def __init__(self, exchange_fee: float = None, rf_stake_returned_as_freebet: bool = False,
+                 freebet_retention: float = FREEBET_RETENTION):
+        self.exchange_fee = exchange_fee
+        self.rf_stake_returned_as_freebet = rf_stake_returned_as_freebet
+        self.freebet_retention = freebet_retention
+        self.back_quotes = None
+        self.lay_quotes = None
+        self.lay_ladders = None
+        self.snapshot = 0
+        self._cache = {}
+
+    def update_snapshot(self, back_quotes: pd.DataFrame, lay_quotes: pd.DataFrame = None,
+                        lay_ladders: pd.DataFrame = None):
+        """
+        Replaces the odds snapshot, see hedge_costs and retention_curves for the columns. Clears the memoised results.
+        The lay quotes default to the best level of lay_ladders
+        """
+        if lay_quotes is None and lay_ladders is not None:
+            best = lay_ladders.sort_values("Price", kind="stable").drop_duplicates(["Market", "Outcome"])
+            lay_quotes = best.rename(columns={"Price": "Odds"})[["Market", "Outcome", "Odds", "Size"]]
+        self.back_quotes = back_quotes
+        self.lay_quotes = lay_quotes
+        self.lay_ladders = lay_ladders
+        self.snapshot += 1
+        self._cache = {}
+
+    def costs(self) -> pd.DataFrame:
+        """
+        Hedge costs of the current snapshot, shared by all bonus bet types and memoised per snapshot
+
+        :rtype: pd.DataFrame
+        """
+        assert self.back_quotes is not None, "No odds snapshot, call update_snapshot first"
+        key = (self.snapshot, "costs")
+        if key not in self._cache:
+            self._cache[key] = hedge_costs(self.back_quotes, self.lay_quotes, self.exchange_fee)
+        return self._cache[key]
+
+    def share_returned(self, bet_type: str) -> float:
+        """
+        r in the module docstring for a bonus bet type
+        """
+        if bet_type == "Freebet" or not self.rf_stake_returned_as_freebet:
+            return 1.0
+        if bet_type == "Risk-free bet":
+            return self.best_freebet_retention() if self.freebet_retention is None else self.freebet_retention
+        raise Exception(f'{bet_type} must be either "Freebet" or "Risk-free bet"')
+
+    def table(self, bet_type: str) -> pd.DataFrame:
+        """
+        Retention table of the current snapshot for a bonus bet type, memoised per snapshot
+
+        :rtype: pd.DataFrame
+        """
+        if bet_type not in BONUS_BET_TYPES:
+            raise Exception(f'{bet_type} must be either "Freebet" or "Risk-free bet"')
+        key = (self.snapshot, bet_type)
+        if key not in self._cache:
+            table = retention_table(self.costs(), self.share_returned(bet_type))
+            bookmaker_codes, bookmakers = pd.factorize(table["Bookmaker"])
+            # Columns as numpy arrays and bookmakers as integer codes for best_quote
+            self._cache[key] = (table, {column: table[column].to_numpy() for column in table.columns},
+                                bookmaker_codes, {bookmaker: code for code, bookmaker in enumerate(bookmakers)})
+        return self._cache[key][0]
+
+    def sized_ladders(self) -> pd.DataFrame:
+        """
+        Lay ladders of the current snapshot, else the lay quotes as one-level ladders if they have a Size column
+
+        :return: Dataframe with the columns [Market, Outcome, Price, Size], None if the snapshot has no lay sizes
+        :rtype: pd.DataFrame
+        """
+        if self.lay_ladders is not None:
+            return self.lay_ladders
+        if self.lay_quotes is not None and "Size" in self.lay_quotes.columns:
+            return self.lay_quotes.rename(columns={"Odds": "Price"})[["Market", "Outcome", "Price", "Size"]]
+        return None
+
+    def curves(self, bet_type: str, stakes) -> pd.DataFrame:
+        """
+        Retention curves of the current snapshot for a bonus bet type, see retention_curves and sized_ladders.
+        Memoised per snapshot and stakes
+
+        :param str bet_type: "Freebet" or "Risk-free bet"
+        :param stakes: Bonus stakes to evaluate
+
+        :rtype: pd.DataFrame
+        """
+        ladders = self.sized_ladders()
+        assert ladders is not None, "No lay sizes in the snapshot, pass lay_ladders to update_snapshot"
+        if bet_type not in BONUS_BET_TYPES:
+            raise Exception(f'{bet_type} must be either "Freebet" or "Risk-free bet"')
+        key = (self.snapshot, "curves", bet_type, tuple(stakes))
+        if key not in self._cache:
+            self._cache[key] = retention_curves(self.back_quotes, ladders, stakes, self.share_returned(bet_type),
+                                                self.exchange_fee)
+        return self._cache[key]
+
+    def best_freebet_retention(self) -> float:
+        """
+        Highest freebet retention in the current snapshot over all bookmakers
+
+        :rtype: float
+        """
+        table = self.table("Freebet")
+        return float(table["Retention"].iloc[0]) if len(table) else 0.0
+
+    def best_quote(self, bookmaker: str, bet_type: str, min_odds: float = 1.0):
+        """
+        Best conversion of a bonus bet at bookmaker
+
+        :param str bookmaker: Bookmaker of the bonus bet, as in the quotes
+        :param str bet_type: "Freebet" or "Risk-free bet"
+        :param float min_odds: Lowest odds allowed by the terms of the bonus
+
+        :return: Row of the retention table as a dict, None if the bookmaker has no quote at min_odds or more
+        :rtype: dict
+        """
+        key = (self.snapshot, bet_type, bookmaker, min_odds)
+        if key not in self._cache:
+            self.table(bet_type)
+            _, columns, bookmaker_codes, codes = self._cache[(self.snapshot, bet_type)]
+            # The table is sorted by Retention, the first match is the best
+            matches = np.flatnonzero((bookmaker_codes == codes.get(bookmaker, -1)) & (columns["Odds"] >= min_odds))
+            self._cache[key] = {column: values[matches[0]] for column, values in columns.items()} \
+                if len(matches) else None
+        return self._cache[key]
+
+    def best_quote_at_stake(self, bookmaker: str, bet_type: str, stake: float, min_odds: float = 1.0):
+        """
+        Best conversion of a bonus bet of the given stake at bookmaker, the lays walked down the lay ladder with
+        retention_curves. A lay the ladder can not fill (stake above Max stake) is skipped
+
+        :param str bookmaker: Bookmaker of the bonus bet, as in the quotes
+        :param str bet_type: "Freebet" or "Risk-free bet"
+        :param float stake: Bonus stake
+        :param float min_odds: Lowest odds allowed by the terms of the bonus
+
+        :return: Dict with the keys Market, Outcome, Odds, Hedge, Hedge odds, Hedge stake and Retention, Hedge odds
+                 being the average lay odds. None if the bookmaker has no quote at min_odds or more that can be hedged
+        :rtype: dict
+        """
+        key = (self.snapshot, "at stake", bet_type, bookmaker, stake, min_odds)
+        if key not in self._cache:
+            candidates = []
+            table = self.table(bet_type)
+            back = table[(table["Hedge"] == "Back others") & (table["Bookmaker"] == bookmaker) &
+                         (table["Odds"] >= min_odds)]
+            if len(back):
+                # The table is sorted by Retention, the first row is the best
+                quote = back.iloc[0]
+                candidates.append({"Market": quote["Market"], "Outcome": quote["Outcome"], "Odds": quote["Odds"],
+                                   "Hedge": "Back others", "Hedge odds": np.nan,
+                                   "Hedge stake": stake * (quote["Odds"] - self.share_returned(bet_type))
+                                   * quote["Hedge cost"], "Retention": quote["Retention"]})
+            curves = self.curves(bet_type, (stake,))
+            lay = curves[(curves["Bookmaker"] == bookmaker) & (curves["Odds"] >= min_odds) &
+                         curves["Retention"].notna()]
+            if len(lay):
+                quote = lay.loc[lay["Retention"].idxmax()]
+                candidates.append({"Market": quote["Market"], "Outcome": quote["Outcome"], "Odds": quote["Odds"],
+                                   "Hedge": "Lay", "Hedge odds": quote["Average lay odds"],
+                                   "Hedge stake": quote["Lay stake"], "Retention": quote["Retention"]})
+            self._cache[key] = max(candidates, key=lambda candidate: candidate["Retention"]) if candidates else None
+        return self._cache[key]
+
+    def plan(self, tokens: list) -> pd.DataFrame:
+        """
+        Best conversion of every bonus token
+
+        :param list tokens: Dicts with the keys "Bookmaker", "Bet type" ("Freebet" or "Risk-free bet"), "Stake" and
+                            optionally "Min odds"
+
+        :return: Dataframe with the columns [Bookmaker, Bet type, Stake, Market, Outcome, Odds, Hedge, Hedge odds,
+                 Hedge stake, Retention, Profit], one row per token. Hedge stake is the lay stake, or the total stake
+                 over the other outcomes when hedging by backing them. With lay sizes in the snapshot the lays are
+                 planned at the token's stake (best_quote_at_stake) and Hedge odds is the average lay odds, without
+                 them at the best lay price for any stake (best_quote)
+        :rtype: pd.DataFrame
+        """
+        sized = self.sized_ladders() is not None
+        rows = []
+        for token in tokens:
+            stake = token["Stake"]
+            row = {"Bookmaker": token["Bookmaker"], "Bet type": token["Bet type"], "Stake": stake}
+            if sized:
+                quote = self.best_quote_at_stake(token["Bookmaker"], token["Bet type"], stake,
+                                                 token.get("Min odds", 1.0))
+                if quote is not None:
+                    row.update({**quote, "Profit": stake * quote["Retention"]})
+                rows.append(row)
+                continue
+            quote = self.best_quote(token["Bookmaker"], token["Bet type"], token.get("Min odds", 1.0))
+            if quote is not None:
+                r = self.share_returned(token["Bet type"])
+                hedge_stake = stake * (quote["Odds"] - r) * quote["Hedge cost"]
+                if quote["Hedge"] == "Lay":
+                    # k = (L - 1) / (L - commission), the lay stake is payout / (L - commission)
+                    hedge_stake /= quote["Hedge odds"] - 1
+                row.update({"Market": quote["Market"], "Outcome": quote["Outcome"], "Odds": quote["Odds"],
+                            "Hedge": quote["Hedge"], "Hedge odds": quote["Hedge odds"], "Hedge stake": hedge_stake,
+                            "Retention": quote["Retention"], "Profit": stake * quote["Retention"]})
+            rows.append(row)
+        return pd.DataFrame(rows, columns=PLAN_COLUMNS)
@@ -1,6 +1,8 @@
 import betfairlightweight
-from mb_functions import hedge_bet
-from datetime import datetime
+from batch_hedger import BatchHedger
+from ledger import Ledger
+from request_scheduler import ORDER_RATE, RequestScheduler
+from tracing import json_summary
 from pandas import ExcelFile
 
 """
@@ -16,17 +18,24 @@ APP_KEY = "FILL IN APP_KEY"
 locale = "FILL IN LOCALE"
 continuous_output = False
 verification = False
+print_latencies = True  # Prints a latency summary of all Betfair calls when the sheet is done
+LEDGER_PATH = "ledger.db"  # Every back bet and lay order is recorded here, None to disable
+JOURNAL_PATH = "hedge_journal.jsonl"  # Progress of the sheet, a rerun only hedges the bets that are not hedged yet
+max_workers = 8  # Bets hedged at the same time, 1 if verification is True
 
 """
 FEED THE PATH TO YOUR EXCEL FILE, THEN RUN THE SCRIPT.
-IT WILL LOOP THROUGH ALL THE BETS IN YOUR EXCEL_FILE, 
-HEDGING THEM ONE AT A TIME.
+IT WILL HEDGE ALL THE BETS IN YOUR EXCEL_FILE, max_workers AT A TIME.
+IF THE SCRIPT IS INTERRUPTED, RUN IT AGAIN ON THE SAME FILE: THE JOURNAL
+AT JOURNAL_PATH KNOWS WHICH BETS WERE ALREADY LAID (SEE batch_hedger.py).
 """
 bet_sheet = ExcelFile("PATH_TO_EXCEL_FILE")
 df = bet_sheet.parse(bet_sheet.sheet_names[0])
 list_bet_dicts = df.to_dict(orient='records')
 
 if list_bet_dicts:
+    ledger = Ledger(LEDGER_PATH) if LEDGER_PATH else None
+
     trading = betfairlightweight.APIClient(
         username=USERNAME,
         password=PASSWORD,
@@ -39,35 +48,53 @@ if list_bet_dicts:
         print("YOU ARE NOW LOGGED IN!")
         print("---------------------------------------------------")
 
-    for bet_dict in list_bet_dicts:
+    # The workers share one scheduler, which merges their market book requests, retries throttling errors and
+    # paces their orders
+    scheduler = RequestScheduler(trading, order_rate=ORDER_RATE)
+    hedger = BatchHedger(scheduler, JOURNAL_PATH, max_workers=1 if verification else max_workers,
+                         continuous_output=continuous_output, verification=verification)
+    # Back bets of an earlier run on the same sheet are already in the ledger
+    new_bet_dicts = hedger.queue(list_bet_dicts)
+    if ledger:
+        ledger.record_back_bets(new_bet_dicts)
+
+    results = hedger.run(list_bet_dicts)
+    if ledger:
+        # Lays of an interrupted run may be missing from the ledger even though the journal has them
+        hedges = [(bet_dict, hedge) for bet_dict, hedge, status in results
+                  if status in ("Hedged", "Reconciled", "Already hedged")]
+        recorded = ledger.recorded_bet_ids([hedge.get("BetID") for _, hedge in hedges])
+        ledger.record_lay_reports([(bet_dict, hedge) for bet_dict, hedge in hedges
+                                   if hedge.get("BetID") not in recorded])
+    for bet_dict, hedge, status in results:
         print(f"GAME: {bet_dict['Home']} v {bet_dict['Away']}")
         print("---------------------------------------------------")
-        try: 
-            hedge = hedge_bet(
-                betfair_client=trading,
-                home_team=bet_dict['Home'],
-                away_team=bet_dict['Away'],
-                market=bet_dict['Market'],
-                outcome=bet_dict['Outcome'],
-                bet_type=bet_dict['Bet type'],
-                stake=bet_dict['Stake'],
-                odds=bet_dict['Odds'],
-                date=datetime.strftime(bet_dict['Date'], "%Y-%m-%d"),
-                continuous_output=continuous_output,
-                verification=verification)
-            if hedge:
-                for key, val in hedge.items():
-                    print(key + ":", val)
-                print("---------------------------------------------------")
-        except Exception as e: 
+        if status == "Failed":
             print("There was a problem hedging the bet for this game, please check manually")
-            print(f"Error description: {type(e)} - {e}")
-            continue
+            print(f"Error description: {type(hedge)} - {hedge}")
+        elif hedge:
+            print(f"{status.upper()}")
+            for key, val in hedge.items():
+                print(key + ":", val)
+            print("---------------------------------------------------")
 
+    scheduler.close()
     trading.logout()
     if trading.session_expired:
         print("YOU ARE NOW LOGGED OUT!")
         print("---------------------------------------------------")
 
+    if print_latencies:
+        print("LATENCY PER BETFAIR CALL [ms]")
+        for call, stats in json_summary().items():
+            print(f"{call}: n={stats['count']} p50={stats['p50'] * 1000:.0f} p90={stats['p90'] * 1000:.0f} "
+                  f"p99={stats['p99'] * 1000:.0f} max={stats['max'] * 1000:.0f} errors={stats['errors']}")
+        print("---------------------------------------------------")
+
+    if ledger:
+        print(f"WORST-CASE LOSS OVER ALL OPEN GAMES: {ledger.worst_case_loss():.2f}")
+        print("---------------------------------------------------")
+        ledger.close()
+
 else:
     print("No bets to hedge, the Excel sheet is empty!")
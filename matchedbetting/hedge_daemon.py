@@ -0,0 +1,290 @@
+import json
+import queue
+import threading
+import time
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import betfairlightweight
+from batch_hedger import row_keys
+from mb_functions import hedge_bet
+from request_scheduler import ORDER_RATE, RequestScheduler
+from tracing import prometheus_text, span
+
+"""
+LONG-RUNNING HEDGING SERVICE
+
+KEEPS ONE AUTHENTICATED BETFAIR SESSION ALIVE AND HEDGES BETS POSTED TO A LOCAL HTTP ENDPOINT.
+THE BODY OF A REQUEST USES THE SAME KEYS AS THE ROWS IN THE EXCEL SHEET USED BY hedge_bets.py, E.G.
+
+curl -X POST http://127.0.0.1:8765/hedge -d '{"Home": "Napoli", "Away": "Torino", "Market": "Match Odds",
+    "Outcome": "Napoli", "Bet type": "Qualifying bet", "Stake": 100, "Odds": 2.1, "Date": "2022-05-31"}'
+
+A REQUEST IS IDENTIFIED BY ITS "Customer ref" (AT MOST 32 CHARACTERS), DERIVED FROM THE BET WHEN THE BODY HAS NONE.
+A REPEATED REF (E.G. THE RETRY AFTER A 504) IS NOT HEDGED AGAIN, IT WAITS FOR AND RETURNS THE RESULT OF THE FIRST
+REQUEST. TWO IDENTICAL BETS THAT SHOULD BOTH BE HEDGED NEED DIFFERENT REFS, AS DOES A NEW ATTEMPT AFTER AN ERROR.
+THE REF IS ALSO THE customer_ref OF THE LAY ORDER, SO BETFAIR REJECTS A DUPLICATE WITHIN 60 SECONDS AS WELL.
+
+GET /health RETURNS THE SESSION STATUS AND THE NUMBER OF QUEUED BETS.
+GET /metrics RETURNS THE LATENCY HISTOGRAMS OF ALL BETFAIR CALLS IN PROMETHEUS TEXT FORMAT.
+"""
+
+"""
+INPUT DATA + PARAMETERS
+"""
+USERNAME = "FILL IN USERNAME/EMAIL LOGIN"
+PASSWORD = "FILL IN PASSWORD"
+APP_KEY = "FILL IN APP_KEY"
+locale = "FILL IN LOCALE"
+HOST = "127.0.0.1"
+PORT = 8765
+KEEP_ALIVE_INTERVAL = 15 * 60  # Betfair sessions expire after 20 minutes of inactivity (4 hours for some jurisdictions)
+REQUEST_TIMEOUT = 60  # Seconds a client waits for its hedge before receiving a timeout
+JOB_RETENTION = 24 * 60 * 60  # Seconds a finished job is kept to answer repeats of its Customer ref
+BET_KEYS = ['Home', 'Away', 'Market', 'Outcome', 'Bet type', 'Stake', 'Odds']
+continuous_output = False
+
+
+class BetfairSession:
+    """
+    Owns the betfairlightweight.APIClient used by the service. Logs in on start, sends keep-alives
+    in a background thread and logs in again whenever the session has expired or the keep-alive fails.
+    """
+
+    def __init__(self, username: str, password: str, app_key: str, locale: str, keep_alive_interval: float = KEEP_ALIVE_INTERVAL):
+        self.client = betfairlightweight.APIClient(
+            username=username,
+            password=password,
+            app_key=app_key,
+            locale=locale)
+        self.keep_alive_interval = keep_alive_interval
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._keep_alive_loop, name="betfair-keep-alive", daemon=True)
+
+    def start(self):
+        self.login()
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        with self._lock:
+            try:
+                self.client.logout()
+            except Exception:
+                pass
+
+    def login(self):
+        with self._lock, span("betfair.login"):
+            self.client.login_interactive()
+            if not self.client.session_expired:
+                print("LOGGED IN TO BETFAIR")
+
+    def ensure_logged_in(self):
+        """
+        Called before every hedge so that a bet is never sent on an expired session
+        """
+        if self.client.session_expired:
+            self.login()
+
+    def _keep_alive_loop(self):
+        while not self._stopped.wait(self.keep_alive_interval):
+            try:
+                with self._lock, span("betfair.keep_alive"):
+                    self.client.keep_alive()
+            except Exception as e:
+                print(f"Keep-alive failed ({type(e)} - {e}), logging in again")
+                try:
+                    self.login()
+                except Exception as e:
+                    print(f"Re-login failed: {type(e)} - {e}")
+
+
+class HedgeWorker:
+    """
+    Processes hedge requests from a work queue with the existing hedge_bet logic, one worker
+    thread per slot in n_workers. Callers receive the result through a HedgeJob. The workers share a
+    RequestScheduler, which merges their market book requests and paces their orders at Betfair's transaction
+    limit. Pacing below the transaction charge (request_scheduler.TRANSACTION_CHARGE_RATE) would hold hedges
+    longer than REQUEST_TIMEOUT as soon as a burst of requests arrives.
+    """
+
+    def __init__(self, session: BetfairSession, n_workers: int = 1):
+        self.session = session
+        self.scheduler = RequestScheduler(session.client, order_rate=ORDER_RATE)
+        self.jobs = queue.Queue()
+        self._jobs_by_ref = {}
+        self._jobs_lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._run, name=f"hedge-worker-{i}", daemon=True)
+                         for i in range(n_workers)]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, bet_dict: dict, customer_ref: str) -> "HedgeJob":
+        """
+        Queues a hedge, or returns the job already submitted with the same customer_ref
+        """
+        with self._jobs_lock:
+            now = time.monotonic()
+            self._jobs_by_ref = {ref: job for ref, job in self._jobs_by_ref.items()
+                                 if not job.done.is_set() or now - job.finished < JOB_RETENTION}
+            job = self._jobs_by_ref.get(customer_ref)
+            if job is not None:
+                return job
+            job = HedgeJob(bet_dict, customer_ref)
+            self._jobs_by_ref[customer_ref] = job
+        self.jobs.put(job)
+        return job
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                self.session.ensure_logged_in()
+                job.result = hedge_bet(
+                    betfair_client=self.scheduler,
+                    home_team=job.bet_dict['Home'],
+                    away_team=job.bet_dict['Away'],
+                    market=job.bet_dict['Market'],
+                    outcome=job.bet_dict['Outcome'],
+                    bet_type=job.bet_dict['Bet type'],
+                    stake=job.bet_dict['Stake'],
+                    odds=job.bet_dict['Odds'],
+                    # The default date of hedge_bet is evaluated at import, which is stale in a long-running process
+                    date=job.bet_dict.get('Date') or date.today().isoformat(),
+                    continuous_output=continuous_output,
+                    verification=False,
+                    customer_ref=job.customer_ref)
+            except Exception as e:
+                job.error = f"{type(e)} - {e}"
+            finally:
+                job.finished = time.monotonic()
+                job.done.set()
+                self.jobs.task_done()
+
+
+class HedgeJob:
+    """
+    A single hedge request travelling through the work queue
+    """
+
+    def __init__(self, bet_dict: dict, customer_ref: str):
+        self.bet_dict = bet_dict
+        self.customer_ref = customer_ref
+        self.submitted = time.monotonic()
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def to_dict(self) -> dict:
+        result = self.result
+        if result is not None:
+            result = dict(result)
+            result["Error codes"] = sorted(
+                code for code in result["Error codes"] if code is not None)
+        return {"Result": result, "Error": self.error, "Customer ref": self.customer_ref,
+                "Seconds": round((self.finished or time.monotonic()) - self.submitted, 3)}
+
+
+def customer_ref_of(bet_dict: dict) -> str:
+    """
+    Customer ref of a bet posted without one, the same bet on the same day always gets the same ref
+    """
+    return row_keys([{**bet_dict, 'Date': bet_dict.get('Date') or date.today().isoformat()}])[0]
+
+
+def make_handler(worker: HedgeWorker):
+    """
+    Builds the request handler class bound to the given worker
+    """
+
+    class HedgeRequestHandler(BaseHTTPRequestHandler):
+
+        def do_POST(self):
+            if self.path != "/hedge":
+                self._respond(404, {"Error": f"Unknown path {self.path}"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                bet_dict = json.loads(self.rfile.read(length))
+                if not isinstance(bet_dict, dict):
+                    raise ValueError("The body must be a JSON object")
+                missing = [key for key in BET_KEYS if key not in bet_dict]
+                if missing:
+                    raise ValueError(f"Missing keys {missing}")
+                customer_ref = bet_dict.get('Customer ref') or customer_ref_of(bet_dict)
+                if not isinstance(customer_ref, str) or len(customer_ref) > 32:
+                    raise ValueError("Customer ref must be a string of at most 32 characters")
+            except (ValueError, TypeError) as e:
+                self._respond(400, {"Error": str(e)})
+                return
+
+            job = worker.submit(bet_dict, customer_ref)
+            if not job.done.wait(REQUEST_TIMEOUT):
+                self._respond(504, {"Error": "The hedge is still being processed, please check manually"})
+                return
+            self._respond(200 if job.error is None else 500, job.to_dict())
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                payload = prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return
+            if self.path != "/health":
+                self._respond(404, {"Error": f"Unknown path {self.path}"})
+                return
+            self._respond(200, {"Session expired": worker.session.client.session_expired,
+                                "Queued bets": worker.jobs.qsize()})
+
+        def _respond(self, status: int, body: dict):
+            payload = json.dumps(body, default=str).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            if continuous_output:
+                super().log_message(format, *args)
+
+    return HedgeRequestHandler
+
+
+def serve(host: str = HOST, port: int = PORT, n_workers: int = 1):
+    """
+    Logs in, starts the hedge workers and serves hedge requests until interrupted
+
+    :param str host: Interface to listen on, localhost by default
+    :param int port: Port to listen on
+    :param int n_workers: Number of bets hedged in parallel on the shared session
+    """
+    session = BetfairSession(USERNAME, PASSWORD, APP_KEY, locale)
+    session.start()
+    worker = HedgeWorker(session, n_workers=n_workers)
+    worker.start()
+
+    server = ThreadingHTTPServer((host, port), make_handler(worker))
+    print(f"HEDGING SERVICE LISTENING ON http://{host}:{port}")
+    print("---------------------------------------------------")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        worker.scheduler.close()
+        session.stop()
+        print("YOU ARE NOW LOGGED OUT!")
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,73 @@
+import os
+import subprocess
+import sys
+import time
+
+"""
+IMPORT-TIME BENCHMARK
+
+IMPORTS EACH MODULE IN A FRESH INTERPRETER AND COMPARES THE BEST OF REPEATS RUNS, MINUS THE START-UP
+TIME OF AN EMPTY INTERPRETER, TO ITS BUDGET. ALSO CHECKS THAT NONE OF THE HEAVY DEPENDENCIES WERE
+PULLED IN AS A SIDE EFFECT OF THE IMPORT. EXITS WITH STATUS 1 IF ANY MODULE IS OVER BUDGET, E.G.
+
+python import_benchmark.py
+"""
+
+"""
+BUDGETS IN MILLISECONDS
+"""
+IMPORT_BUDGETS_MS = {"calculators": 20, "mb_functions": 20}
+HEAVY_MODULES = ["scipy", "pandas", "numpy", "betfairlightweight", "betfair_lists"]
+REPEATS = 5
+
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def time_interpreter(code: str) -> float:
+    """
+    Runs code in a fresh interpreter from the matchedbetting folder
+
+    :param str code: Python code passed to python -c
+
+    :return: Wall time in milliseconds
+    :rtype: float
+    """
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=MODULE_DIR, check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def loaded_heavy_modules(module: str) -> list:
+    """
+    Lists the heavy dependencies found in sys.modules after importing module
+    """
+    code = f"import sys, {module}; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    output = subprocess.run([sys.executable, "-c", code], cwd=MODULE_DIR, check=True,
+                            capture_output=True, text=True).stdout.strip()
+    return output.split(",") if output else []
+
+
+def run_benchmark(budgets: dict = IMPORT_BUDGETS_MS, repeats: int = REPEATS) -> bool:
+    """
+    Prints the import time of every module in budgets
+
+    :param dict budgets: {module name: budget in milliseconds}
+    :param int repeats: Number of fresh interpreters per module, the fastest run is reported
+
+    :return: True if every module stayed within its budget and loaded no heavy dependency
+    :rtype: bool
+    """
+    baseline = min(time_interpreter("pass") for _ in range(repeats))
+    within_budget = True
+    for module, budget in budgets.items():
+        import_time = min(time_interpreter(f"import {module}") for _ in range(repeats)) - baseline
+        heavy = loaded_heavy_modules(module)
+        ok = import_time <= budget and not heavy
+        within_budget = within_budget and ok
+        print(f"{module}: {import_time:.1f} ms (budget {budget} ms)"
+              f"{', loads ' + ', '.join(heavy) if heavy else ''} - {'OK' if ok else 'OVER BUDGET'}")
+    return within_budget
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_benchmark() else 1)
@@ -0,0 +1,358 @@
+import sqlite3
+from datetime import datetime
+
+import commission
+from calculators import FREEBET_RETENTION
+
+"""
+EXPOSURE AND P&L LEDGER
+
+STORES EVERY BACK BET FROM THE EXCEL SHEET AND EVERY LAY REPORT FROM hedge_bet IN AN EMBEDDED SQLITE DATABASE
+(WAL JOURNAL, BULK INSERTS WITH executemany). NEXT TO THE RAW BETS THE LEDGER KEEPS AGGREGATES THAT ARE UPDATED
+INCREMENTALLY WHEN BETS ARE RECORDED, INSTEAD OF RE-SUMMING THE HISTORY WHEN THEY ARE READ:
+
+exposure            PER GAME, MARKET, OUTCOME AND BOOKMAKER, THE PAYOFF IF THE OUTCOME WINS AND IF IT LOSES
+market_exposure     PER GAME AND MARKET, THE WORST AND BEST PAYOFF OVER THE OUTCOMES OF THE MARKET
+event_exposure      PER GAME, THE SUM OVER ITS MARKETS
+bookmaker_exposure  PER BOOKMAKER, THE OPEN STAKE AND LIABILITY
+totals              ONE ROW, THE SUM OVER ALL GAMES
+
+ONLY THE MARKETS TOUCHED BY NEW BETS ARE RECOMPUTED, THE OTHER TABLES FOLLOW THROUGH TRIGGERS, SO THE CURRENT
+WORST-CASE LOSS IS A SINGLE-ROW LOOKUP. MARKETS OF THE SAME GAME ARE SUMMED AS IF INDEPENDENT, WHICH MAKES THE
+WORST CASE CONSERVATIVE (use portfolio.portfolio_hedges FOR THE EXACT JOINT WORST CASE OF A GAME), E.G.
+
+ledger = Ledger("ledger.db")
+ledger.record_back_bets(list_bet_dicts)
+ledger.record_lay_report(bet_dict, hedge_bet(...))
+ledger.worst_case_loss()
+"""
+
+"""
+INPUT DATA + PARAMETERS
+"""
+LEDGER_PATH = "ledger.db"
+EXCHANGE = "Betfair"
+# Bookmaker of back bets from an Excel sheet without a Bookmaker column
+UNKNOWN_BOOKMAKER = "Unknown"
+# Number of outcomes per market, a market with outcomes nobody has bet on can settle on one of those
+MARKET_OUTCOMES = {"Match Odds": 3, "Half Time": 3, "Both teams to Score?": 2}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bets (
+    id INTEGER PRIMARY KEY,
+    recorded_at TEXT NOT NULL,
+    date TEXT,
+    event TEXT NOT NULL,
+    market TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    bookmaker TEXT NOT NULL,
+    side TEXT NOT NULL,
+    bet_type TEXT,
+    stake REAL NOT NULL,
+    odds REAL NOT NULL,
+    bet_id TEXT,
+    status TEXT,
+    if_wins REAL NOT NULL,
+    if_loses REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bets_event ON bets (event, market);
+CREATE INDEX IF NOT EXISTS bets_bet_id ON bets (bet_id);
+
+CREATE TABLE IF NOT EXISTS exposure (
+    event TEXT NOT NULL,
+    market TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    bookmaker TEXT NOT NULL,
+    n_bets INTEGER NOT NULL,
+    stake REAL NOT NULL,
+    liability REAL NOT NULL,
+    if_wins REAL NOT NULL,
+    if_loses REAL NOT NULL,
+    PRIMARY KEY (event, market, outcome, bookmaker)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS exposure_bookmaker ON exposure (bookmaker);
+
+CREATE TABLE IF NOT EXISTS market_exposure (
+    event TEXT NOT NULL,
+    market TEXT NOT NULL,
+    worst_case REAL NOT NULL,
+    best_case REAL NOT NULL,
+    PRIMARY KEY (event, market)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS event_exposure (
+    event TEXT PRIMARY KEY,
+    worst_case REAL NOT NULL,
+    best_case REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS event_exposure_worst_case ON event_exposure (worst_case);
+
+CREATE TABLE IF NOT EXISTS bookmaker_exposure (
+    bookmaker TEXT PRIMARY KEY,
+    stake REAL NOT NULL,
+    liability REAL NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS totals (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    worst_case REAL NOT NULL,
+    best_case REAL NOT NULL
+);
+INSERT OR IGNORE INTO totals VALUES (1, 0, 0);
+
+CREATE TRIGGER IF NOT EXISTS exposure_insert AFTER INSERT ON exposure BEGIN
+    INSERT INTO bookmaker_exposure VALUES (NEW.bookmaker, NEW.stake, NEW.liability)
+    ON CONFLICT (bookmaker) DO UPDATE SET stake = stake + excluded.stake, liability = liability + excluded.liability;
+END;
+CREATE TRIGGER IF NOT EXISTS exposure_update AFTER UPDATE ON exposure BEGIN
+    UPDATE bookmaker_exposure SET stake = stake + NEW.stake - OLD.stake,
+                                  liability = liability + NEW.liability - OLD.liability
+    WHERE bookmaker = NEW.bookmaker;
+END;
+CREATE TRIGGER IF NOT EXISTS exposure_delete AFTER DELETE ON exposure BEGIN
+    UPDATE bookmaker_exposure SET stake = stake - OLD.stake, liability = liability - OLD.liability
+    WHERE bookmaker = OLD.bookmaker;
+END;
+
+CREATE TRIGGER IF NOT EXISTS market_exposure_insert AFTER INSERT ON market_exposure BEGIN
+    INSERT INTO event_exposure VALUES (NEW.event, NEW.worst_case, NEW.best_case)
+    ON CONFLICT (event) DO UPDATE SET worst_case = worst_case + excluded.worst_case,
+                                      best_case = best_case + excluded.best_case;
+    UPDATE totals SET worst_case = worst_case + NEW.worst_case, best_case = best_case + NEW.best_case;
+END;
+CREATE TRIGGER IF NOT EXISTS market_exposure_update AFTER UPDATE ON market_exposure BEGIN
+    UPDATE event_exposure SET worst_case = worst_case + NEW.worst_case - OLD.worst_case,
+                              best_case = best_case + NEW.best_case - OLD.best_case
+    WHERE event = NEW.event;
+    UPDATE totals SET worst_case = worst_case + NEW.worst_case - OLD.worst_case,
+                      best_case = best_case + NEW.best_case - OLD.best_case;
+END;
+CREATE TRIGGER IF NOT EXISTS market_exposure_delete AFTER DELETE ON market_exposure BEGIN
+    UPDATE event_exposure SET worst_case = worst_case - OLD.worst_case, best_case = best_case - OLD.best_case
+    WHERE event = OLD.event;
+    DELETE FROM event_exposure WHERE event = OLD.event
+        AND NOT EXISTS (SELECT 1 FROM market_exposure WHERE event = OLD.event);
+    UPDATE totals SET worst_case = worst_case - OLD.worst_case, best_case = best_case - OLD.best_case;
+END;
+"""
+
+INSERT_BET = """
+INSERT INTO bets (recorded_at, date, event, market, outcome, bookmaker, side, bet_type, stake, odds, bet_id, status,
+                  if_wins, if_loses)
+VALUES (:recorded_at, :date, :event, :market, :outcome, :bookmaker, :side, :bet_type, :stake, :odds, :bet_id, :status,
+        :if_wins, :if_loses)
+"""
+
+UPSERT_EXPOSURE = """
+INSERT INTO exposure VALUES (:event, :market, :outcome, :bookmaker, 1, :stake, :liability, :if_wins, :if_loses)
+ON CONFLICT (event, market, outcome, bookmaker) DO UPDATE SET
+    n_bets = n_bets + 1, stake = stake + excluded.stake, liability = liability + excluded.liability,
+    if_wins = if_wins + excluded.if_wins, if_loses = if_loses + excluded.if_loses
+"""
+
+# The payoff of a market when outcome o wins is (if_wins(o) - if_loses(o)) + the sum of if_loses over all outcomes.
+# An outcome without bets pays the sum of if_loses, it is included while fewer outcomes than n_outcomes have bets
+UPSERT_MARKET_EXPOSURE = """
+INSERT INTO market_exposure
+SELECT :event, :market,
+       CASE WHEN COUNT(*) < COALESCE(:n_outcomes, COUNT(*) + 1) AND MIN(net) > 0 THEN 0 ELSE MIN(net) END + SUM(loses),
+       CASE WHEN COUNT(*) < COALESCE(:n_outcomes, COUNT(*) + 1) AND MAX(net) < 0 THEN 0 ELSE MAX(net) END + SUM(loses)
+FROM (SELECT SUM(if_wins) - SUM(if_loses) AS net, SUM(if_loses) AS loses
+      FROM exposure WHERE event = :event AND market = :market GROUP BY outcome)
+WHERE true
+ON CONFLICT (event, market) DO UPDATE SET worst_case = excluded.worst_case, best_case = excluded.best_case
+"""
+
+
+def market_outcomes(market: str):
+    """
+    Number of outcomes in a market, None if unknown
+
+    :rtype: int
+    """
+    if market.startswith("Over/Under"):
+        return 2
+    return MARKET_OUTCOMES.get(market)
+
+
+class Ledger:
+    """
+    SQLite ledger of back bets and lay orders with incrementally updated exposure aggregates
+
+    :param str path: Database file, created if it does not exist
+    :param float exchange_fee: Commission on net winnings at the exchange, looked up per market with
+                               commission.commission_rate if None. Applied to every lay payoff on its own, which
+                               overstates the commission of markets with several lays as the exchange nets them
+    :param bool rf_stake_returned_as_freebet: True if the stake of a lost risk-free bet is returned in freebet credits
+    :param float freebet_retention: Share of a returned freebet kept when it is converted
+    """
+
+    def __init__(self, path: str = LEDGER_PATH, exchange_fee: float = None, rf_stake_returned_as_freebet: bool = False,
+                 freebet_retention: float = FREEBET_RETENTION):
+        self.exchange_fee = exchange_fee
+        self.rf_stake_returned_as_freebet = rf_stake_returned_as_freebet
+        self.freebet_retention = freebet_retention
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        # WAL with synchronous NORMAL only syncs at checkpoints, a crash can lose the last transactions but never
+        # corrupt the database
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def _record(self, rows: list):
+        recorded_at = datetime.now().isoformat(timespec="seconds")
+        for row in rows:
+            row["recorded_at"] = recorded_at
+        markets = {(row["event"], row["market"]): {"event": row["event"], "market": row["market"],
+                                                   "n_outcomes": market_outcomes(row["market"])} for row in rows}
+        with self.connection:
+            self.connection.executemany(INSERT_BET, rows)
+            self.connection.executemany(UPSERT_EXPOSURE, rows)
+            self.connection.executemany(UPSERT_MARKET_EXPOSURE, list(markets.values()))
+
+    def record_back_bets(self, bet_dicts: list):
+        """
+        Records back bets placed with bookmakers, in one transaction
+
+        :param list bet_dicts: Rows of the Excel sheet used by hedge_bets.py with the keys "Home", "Away", "Market",
+                               "Outcome", "Bet type", "Stake", "Odds", "Date" and optionally "Bookmaker"
+        """
+        rows = []
+        for bet_dict in bet_dicts:
+            stake, odds, bet_type = float(bet_dict["Stake"]), float(bet_dict["Odds"]), bet_dict["Bet type"]
+            if bet_type == "Qualifying bet":
+                if_loses = -stake
+            elif bet_type == "Freebet":
+                if_loses = 0
+            elif bet_type == "Risk-free bet":
+                if_loses = -(1 - self.freebet_retention) * stake if self.rf_stake_returned_as_freebet else 0
+            else:
+                raise Exception(
+                    f'{bet_type} must be either "Qualifying bet", "Freebet" or "Risk-free bet"')
+            rows.append({"date": str(bet_dict.get("Date", ""))[:10], "event": f"{bet_dict['Home']} v {bet_dict['Away']}",
+                         "market": bet_dict["Market"], "outcome": bet_dict["Outcome"],
+                         "bookmaker": bet_dict.get("Bookmaker", UNKNOWN_BOOKMAKER), "side": "BACK",
+                         "bet_type": bet_type, "stake": stake, "odds": odds, "bet_id": None, "status": None,
+                         "liability": -if_loses, "if_wins": stake * (odds - 1), "if_loses": if_loses})
+        if rows:
+            self._record(rows)
+
+    def record_lay_reports(self, hedges: list):
+        """
+        Records the lay orders placed by hedge_bet, in one transaction. Only the matched part of an order is exposure
+
+        :param list hedges: (bet_dict, report_dict) pairs, the bet dict that was hedged and the dict returned by
+                            hedge_bet with the keys "BetID", "Size matched", "Average price matched" and "Status"
+        """
+        rows = []
+        for bet_dict, report_dict in hedges:
+            if not report_dict or not report_dict.get("Size matched"):
+                continue
+            size, price = float(report_dict["Size matched"]), float(report_dict["Average price matched"])
+            fee = self.exchange_fee
+            if fee is None:
+                fee = commission.commission_rate(commission.DEFAULT_EXCHANGE, bet_dict["Market"])
+            rows.append({"date": str(bet_dict.get("Date", ""))[:10], "event": f"{bet_dict['Home']} v {bet_dict['Away']}",
+                         "market": bet_dict["Market"], "outcome": bet_dict["Outcome"], "bookmaker": EXCHANGE,
+                         "side": "LAY", "bet_type": bet_dict.get("Bet type"), "stake": size, "odds": price,
+                         "bet_id": report_dict.get("BetID"), "status": report_dict.get("Status"),
+                         "liability": size * (price - 1), "if_wins": -size * (price - 1),
+                         "if_loses": size * (1 - fee)})
+        if rows:
+            self._record(rows)
+
+    def record_lay_report(self, bet_dict: dict, report_dict: dict):
+        """
+        Records a single lay report, see record_lay_reports
+        """
+        self.record_lay_reports([(bet_dict, report_dict)])
+
+    def recorded_bet_ids(self, bet_ids: list) -> set:
+        """
+        The Betfair bet ids among bet_ids that are already recorded, e.g. to record the lays of a resumed batch once
+
+        :param list bet_ids: Bet ids of lay orders
+        :rtype: set
+        """
+        bet_ids = [str(bet_id) for bet_id in bet_ids if bet_id]
+        recorded = set()
+        for start in range(0, len(bet_ids), 500):
+            chunk = bet_ids[start:start + 500]
+            recorded.update(bet_id for bet_id, in self.connection.execute(
+                f"SELECT bet_id FROM bets WHERE bet_id IN ({', '.join('?' * len(chunk))})", chunk))
+        return recorded
+
+    def settle_event(self, event: str):
+        """
+        Removes a finished game from the exposure aggregates, its bets stay in the bets table
+
+        :param str event: Game in the format "Home v Away"
+        """
+        with self.connection:
+            self.connection.execute("DELETE FROM market_exposure WHERE event = ?", (event,))
+            self.connection.execute("DELETE FROM exposure WHERE event = ?", (event,))
+
+    def worst_case_loss(self) -> float:
+        """
+        Worst-case loss over all open games, 0 if every game is locked in at a profit
+
+        :rtype: float
+        """
+        worst_case, = self.connection.execute("SELECT worst_case FROM totals WHERE id = 1").fetchone()
+        return max(0.0, -worst_case)
+
+    def totals(self) -> dict:
+        """
+        :return: {"Worst case", "Best case"} payoff over all open games
+        :rtype: dict
+        """
+        worst_case, best_case = self.connection.execute(
+            "SELECT worst_case, best_case FROM totals WHERE id = 1").fetchone()
+        return {"Worst case": worst_case, "Best case": best_case}
+
+    def event_exposure(self, event: str) -> dict:
+        """
+        :param str event: Game in the format "Home v Away"
+
+        :return: {"Worst case", "Best case"} payoff of the game, None if the game has no open bets
+        :rtype: dict
+        """
+        row = self.connection.execute(
+            "SELECT worst_case, best_case FROM event_exposure WHERE event = ?", (event,)).fetchone()
+        return None if row is None else {"Worst case": row[0], "Best case": row[1]}
+
+    def worst_events(self, n: int = 10) -> list:
+        """
+        :return: The n games with the lowest worst-case payoff, [(game, worst case)]
+        :rtype: list
+        """
+        return self.connection.execute(
+            "SELECT event, worst_case FROM event_exposure ORDER BY worst_case LIMIT ?", (n,)).fetchall()
+
+    def bookmaker_exposure(self) -> dict:
+        """
+        :return: {bookmaker: {"Stake", "Liability"}} over the open games
+        :rtype: dict
+        """
+        return {bookmaker: {"Stake": stake, "Liability": liability} for bookmaker, stake, liability in
+                self.connection.execute("SELECT bookmaker, stake, liability FROM bookmaker_exposure")}
+
+    def outcome_exposure(self, event: str) -> list:
+        """
+        :param str event: Game in the format "Home v Away"
+
+        :return: Rows (market, outcome, bookmaker, bets, stake, liability, if wins, if loses) of the game
+        :rtype: list
+        """
+        return self.connection.execute(
+            "SELECT market, outcome, bookmaker, n_bets, stake, liability, if_wins, if_loses FROM exposure "
+            "WHERE event = ?", (event,)).fetchall()
@@ -0,0 +1,192 @@
+import argparse
+import asyncio
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import tracing
+from async_hedge import AsyncBetfairClient, async_hedge_bet
+from betfair_lists import betfair_outcome_types, betfair_teams
+from fake_betfair import FakeAPIClient
+from mb_functions import hedge_bet
+from request_scheduler import ORDER_BURST, ORDER_RATE, RequestScheduler
+
+"""
+LOAD GENERATOR FOR hedge_bet AGAINST THE LOCAL FAKE EXCHANGE IN fake_betfair.py
+
+FIRES N BETS EITHER ONE AT A TIME, AS hedge_bets.py DOES, OR FROM A POOL OF CONCURRENT WORKERS SHARING ONE
+CLIENT, OR FROM ONE EVENT LOOP WITH async_hedge.async_hedge_bet, AND REPORTS THROUGHPUT, LATENCY PER HEDGE AND PER
+BETFAIR CALL AND THE FAILURES BY ERROR, E.G.
+
+python load_test.py --bets 500 --concurrency 100 --latency 0.05 --error-rate 0.01
+python load_test.py --bets 200 --concurrency 1
+python load_test.py --bets 500 --concurrency 100 --async
+python load_test.py --bets 500 --concurrency 100 --scheduler --order-rate 50
+"""
+
+
+def generate_bets(n_bets: int, n_games: int, seed: int = None) -> tuple:
+    """
+    Generates games in Betfair format and n_bets random bets on them, as rows of the Excel sheet used by hedge_bets.py
+
+    :return: (list of games (home, away), list of bet dicts)
+    :rtype: tuple
+    """
+    rng = random.Random(seed)
+    # hedge_bet asserts the outcome name, so only teams also listed as outcomes can be bet on in Match Odds
+    outcome_types = set(betfair_outcome_types)
+    teams = [team for team in betfair_teams if team in outcome_types]
+    games = [(teams[2 * i], teams[2 * i + 1]) for i in range(min(n_games, len(teams) // 2))]
+
+    bets = []
+    for _ in range(n_bets):
+        home, away = rng.choice(games)
+        market, outcome = rng.choice([("Match Odds", home), ("Match Odds", away), ("Match Odds", "The Draw"),
+                                      ("Over/Under 2.5 Goals", "Over 2.5 Goals"),
+                                      ("Over/Under 2.5 Goals", "Under 2.5 Goals"),
+                                      ("Both teams to Score?", "Yes"), ("Both teams to Score?", "No")])
+        bets.append({"Home": home, "Away": away, "Market": market, "Outcome": outcome,
+                     "Bet type": rng.choice(["Qualifying bet", "Freebet", "Risk-free bet"]),
+                     "Stake": rng.choice([50, 100, 200, 500]), "Odds": round(rng.uniform(1.5, 6.0), 2),
+                     "Date": date.today().isoformat()})
+    return games, bets
+
+
+def run_load_test(n_bets: int = 500, n_games: int = 50, concurrency: int = 50, latency: float = 0.05,
+                  latency_jitter: float = 0.05, error_rate: float = 0.0, drift_interval: float = None,
+                  seed: int = 1, use_async: bool = False, use_scheduler: bool = False,
+                  order_rate: float = ORDER_RATE) -> dict:
+    """
+    Hedges n_bets random bets against a FakeAPIClient and prints a report
+
+    :param int n_bets: Number of bets to hedge
+    :param int n_games: Number of games the bets are spread over
+    :param int concurrency: Number of bets hedged at the same time, 1 reproduces the sequential loop of hedge_bets.py
+    :param float latency: Seconds added to every Betfair call
+    :param float latency_jitter: Upper bound of an additional random delay per Betfair call
+    :param float error_rate: Probability that a Betfair call fails
+    :param float drift_interval: If set, all books move up to one tick every drift_interval seconds
+    :param int seed: Seed for the bets and the fake exchange
+    :param bool use_async: If True, hedges every bet at once with async_hedge_bet on an AsyncBetfairClient with
+                           concurrency threads, instead of hedge_bet in concurrency workers
+    :param bool use_scheduler: If True, the calls go through a request_scheduler.RequestScheduler that merges the
+                               market book requests of concurrent hedges and paces the orders
+    :param float order_rate: Orders per second of the scheduler's token bucket
+
+    :return: {"Hedges per second", "Latency p50", "Latency p90", "Latency p99", "Failures"}
+    :rtype: dict
+    """
+    games, bets = generate_bets(n_bets, n_games, seed)
+    client = FakeAPIClient.generate(games, seed=seed, latency=latency, latency_jitter=latency_jitter,
+                                    error_rate=error_rate)
+    client.login()
+    tracing.reset()
+    scheduler = RequestScheduler(client, order_rate=order_rate, order_burst=min(ORDER_BURST, n_bets)) \
+        if use_scheduler else None
+    betfair_client = scheduler or client
+
+    stop_drift = threading.Event()
+    if drift_interval:
+        def drift():
+            rng = random.Random(seed)
+            while not stop_drift.wait(drift_interval):
+                for market in client.markets.values():
+                    market.drift(rng)
+        threading.Thread(target=drift, daemon=True).start()
+
+    latencies = []
+    failures = {}
+    lock = threading.Lock()
+
+    def record(hedge_start: float, error: str):
+        with lock:
+            latencies.append(time.perf_counter() - hedge_start)
+            if error:
+                failures[error] = failures.get(error, 0) + 1
+
+    def hedge(bet_dict: dict):
+        hedge_start = time.perf_counter()
+        try:
+            hedge_bet(betfair_client=betfair_client, home_team=bet_dict['Home'], away_team=bet_dict['Away'],
+                      market=bet_dict['Market'], outcome=bet_dict['Outcome'], bet_type=bet_dict['Bet type'],
+                      stake=bet_dict['Stake'], odds=bet_dict['Odds'], date=bet_dict['Date'],
+                      continuous_output=False, verification=False)
+            error = None
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        record(hedge_start, error)
+
+    async def async_hedge(async_client: AsyncBetfairClient, bet_dict: dict):
+        hedge_start = time.perf_counter()
+        try:
+            await async_hedge_bet(async_client, home_team=bet_dict['Home'], away_team=bet_dict['Away'],
+                                  market=bet_dict['Market'], outcome=bet_dict['Outcome'],
+                                  bet_type=bet_dict['Bet type'], stake=bet_dict['Stake'], odds=bet_dict['Odds'],
+                                  date=bet_dict['Date'])
+            error = None
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        record(hedge_start, error)
+
+    async def hedge_all():
+        async with AsyncBetfairClient(betfair_client, max_concurrency=concurrency) as async_client:
+            await asyncio.gather(*(async_hedge(async_client, bet_dict) for bet_dict in bets))
+
+    start = time.perf_counter()
+    if use_async:
+        asyncio.run(hedge_all())
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(hedge, bets))
+    wall_time = time.perf_counter() - start
+    stop_drift.set()
+    if scheduler:
+        scheduler.close()
+
+    latencies.sort()
+    report = {"Hedges per second": n_bets / wall_time,
+              "Latency p50": statistics.median(latencies),
+              "Latency p90": latencies[int(0.9 * (len(latencies) - 1))],
+              "Latency p99": latencies[int(0.99 * (len(latencies) - 1))],
+              "Failures": failures}
+
+    print(f"{n_bets} bets on {len(games)} games, concurrency {concurrency}{' (async)' if use_async else ''}, "
+          f"latency {latency}+{latency_jitter} s, error rate {error_rate}")
+    if scheduler:
+        print(f"Scheduler: {scheduler.calls_received} market book calls merged into {scheduler.requests_sent} "
+              f"requests")
+    print("---------------------------------------------------")
+    print(f"Wall time: {wall_time:.2f} s, {report['Hedges per second']:.1f} hedges per second")
+    print(f"Latency per hedge: p50 {report['Latency p50'] * 1000:.0f} ms, p90 {report['Latency p90'] * 1000:.0f} ms, "
+          f"p99 {report['Latency p99'] * 1000:.0f} ms")
+    for call, stats in tracing.json_summary().items():
+        print(f"{call}: n={stats['count']} p50={stats['p50'] * 1000:.0f} ms p99={stats['p99'] * 1000:.0f} ms "
+              f"errors={stats['errors']}")
+    print(f"Failed hedges: {sum(failures.values())}")
+    for error, count in sorted(failures.items(), key=lambda item: -item[1]):
+        print(f"  {count} x {error}")
+    print("---------------------------------------------------")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test of hedge_bet against the fake exchange")
+    parser.add_argument("--bets", type=int, default=500)
+    parser.add_argument("--games", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--drift-interval", type=float, default=None)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--async", dest="use_async", action="store_true")
+    parser.add_argument("--scheduler", dest="use_scheduler", action="store_true")
+    parser.add_argument("--order-rate", type=float, default=ORDER_RATE)
+    args = parser.parse_args()
+    run_load_test(n_bets=args.bets, n_games=args.games, concurrency=args.concurrency, latency=args.latency,
+                  latency_jitter=args.jitter, error_rate=args.error_rate, drift_interval=args.drift_interval,
+                  seed=args.seed, use_async=args.use_async, use_scheduler=args.use_scheduler,
+                  order_rate=args.order_rate)
@@ -1,11 +1,14 @@
-import pandas as pd
-import betfairlightweight
-from betfairlightweight.filters import market_filter, price_data
 from datetime import datetime, date, timedelta
-from betfair_lists import betfair_teams, betfair_market_types, betfair_outcome_types
+import commission
+from tracing import span
 
+"""
+pandas, betfairlightweight AND THE LARGE betfair_lists MODULE ARE IMPORTED INSIDE THE FUNCTIONS USING THEM
+SO THAT CALLERS ONLY NEEDING THE CALCULATORS DO NOT PAY FOR THEM AT IMPORT
+"""
 
-def lay_bet_calculator(stake, odds, lay_odds_betting_exchange, bet_type, fee=0.02) -> int:
+
+def lay_bet_calculator(stake, odds, lay_odds_betting_exchange, bet_type, fee=None) -> int:
     """
     Computes how much to lay to make sure the back bet is fully hedged
 
@@ -13,59 +16,23 @@ def lay_bet_calculator(stake, odds, lay_odds_betting_exchange, bet_type, fee=0.0
     :param float odds: Odds on the given bet
     :param float odds: Odds offered with the betting exchange on the given outcome
     :param str bet_type: QB/FB/RFB, must be in the list ["Qualifying bet", "Freebet", "Risk-free bet"]
-    :param float fee: Fee applied by the betting exchange, 0.02 by default
+    :param float fee: Commission on net winnings applied by the betting exchange, the Betfair rate in
+                      commission.FEE_TABLE by default
 
     :return: Stake to be layed to neutralize position
     :rtype: int
     """
-    if bet_type == "Qualifying bet":
-        lay_stake = int(stake * odds / (lay_odds_betting_exchange - fee))
-        return lay_stake
-    elif bet_type == "Freebet":
-        lay_stake = int(stake * (odds - 1) / (lay_odds_betting_exchange - fee))
-        return lay_stake
-    elif bet_type == "Risk-free bet":
-        lay_stake = int(stake * (odds - 1) / (lay_odds_betting_exchange - fee))
-        return lay_stake
-    else:
-        raise Exception(
-            f'{bet_type} must be either "Qualifying bet", "Freebet" or "Risk-free bet"')
-        return None
+    if fee is None:
+        fee = commission.commission_rate(commission.DEFAULT_EXCHANGE)
+    return int(commission.lay_stake(stake, odds, lay_odds_betting_exchange, bet_type, fee))
 
 
-def hedge_bet(
-        betfair_client: betfairlightweight.apiclient.APIClient,
-        home_team: str,
-        away_team: str,
-        market: str,
-        outcome: str,
-        bet_type: str,
-        stake: int,
-        odds: float,
-        date: str = date.today().isoformat(),
-        continuous_output: bool = True,
-        verification: bool = False) -> dict:
+def validate_hedge_arguments(home_team: str, away_team: str, market: str, outcome: str, bet_type: str):
     """
-    Assumes a logged in betfairlightweight.APIClient() session with the BETFAIR API.
-    Hedges a back bet by calculating the lay stake [conditional on current market odds] and sending
-    the lay order (limit order) to the exchange.
-
-    :param betfairlightweight.apiclient.APIClient betfair_client: A logged in betfairlightweight.APIClient() session with the BETFAIR API
-    :param str home_team: The home team in the game
-    :param str away_team: The away team in the game
-    :param str market: Market in Betfair format, e.g. Over/Under 2.5 Goals
-    :param str outcome: Outcome in Betfair format, e.g. Under 2.5 Goals
-    :param str bet_type: QB/FB/RFB, must be in the list ["Qualifying bet", "Freebet", "Risk-free bet"]
-    :param int stake: Stake bet on the outcome
-    :param float odds: Odds on the given outcome
-    :param str date: The date for the game, today by default "YYYY-MM-DD"
-    :param bool continuous_output: If True -> prints all the relevant information throughout the bet process
-    :param bool verification: If True -> requires verification from the user to place order after printing the order book, False by default
-
-    :return: Returns a dictionary with information about the order. If verification was set to True and the user chose not
-             to place the bet, returns None.
-    :rtype: dict with keys "Status", "Order status", "BetID", "Average price matched", "Size matched", "Error codes"
+    Asserts that the teams, market and outcome of a bet to hedge are in Betfair format and the bet type is valid
     """
+    from betfair_lists import betfair_teams, betfair_market_types, betfair_outcome_types
+
     assert home_team in betfair_teams, f"{home_team} is not in Betfair format, please check Betfair documentation or betfair_lists.betfair_teams"
     assert away_team in betfair_teams, f"{away_team} is not in Betfair format, please check Betfair documentation or betfair_lists.betfair_teams"
     assert market in betfair_market_types, f"{market} is not in Betfair format, please check Betfair documentation or betfair_lists.betfair_markets"
@@ -73,39 +40,34 @@ def hedge_bet(
     assert bet_type in ["Qualifying bet", "Freebet",
                         "Risk-free bet"], f'{bet_type} must be either "Qualifying bet", "Freebet" or "Risk-free bet"'
 
+
+def game_search_filter(home_team: str, away_team: str, date: str) -> dict:
     """
-    DOCUMENTATION THROUGHOUT THE FUNCTION CODE
+    Market filter for list_market_catalogue finding the markets of a game on the given date "YYYY-MM-DD"
     """
+    from betfairlightweight.filters import market_filter
+
+    game = f"{home_team} v {away_team}"
+    return market_filter(text_query=game, market_start_time={"from": date, "to": datetime.strftime(
+        datetime.strptime(date, "%Y-%m-%d") + timedelta(days=1), "%Y-%m-%d")})
+
 
+def find_market_id(market_catalogues: list, market: str):
     """
-    LOCATES THE CORRECT MARKET ID
+    Market id of the first catalogue named market, None if there is none
     """
-    game = f"{home_team} v {away_team}"
-    market_catalogues = betfair_client.betting.list_market_catalogue(
-        filter=market_filter(text_query=game, market_start_time={"from": date, "to": datetime.strftime(
-            datetime.strptime(date, "%Y-%m-%d") + timedelta(days=1), "%Y-%m-%d")}),
-        max_results=1000,
-    )
-    market_id = None
     for obj in market_catalogues:
         if obj.market_name == market:
-            market_id = obj.market_id
-            break
+            return obj.market_id
+    return None
 
-    try:
-        market_book = betfair_client.betting.list_market_book(
-            market_ids=[market_id])[0]
-        market_catalogue = betfair_client.betting.list_market_catalogue(
-            filter=market_filter(market_ids=[market_id]),
-            market_projection=["RUNNER_DESCRIPTION", "RUNNER_METADATA"])[0]
-    except:
-        raise Exception('Requested market is not available at Betfair')
 
+def outcome_selection_id(market_catalogue, market_book, market: str, outcome: str,
+                         continuous_output: bool = True) -> int:
     """
-    SETS UP A DICTIONARY WITH THE DIFFERENT OUTCOMES,
-    SELECTION_IDS, LAST MATCHED PRICE
-    &
+    SETS UP A DICTIONARY WITH THE DIFFERENT OUTCOMES, SELECTION_IDS, LAST MATCHED PRICE,
     PRINTS OUTCOMES AND LAST MATCHED PRICE IF continuous_output = True
+    AND RETURNS THE SELECTION ID OF outcome
     """
     runner_catalogues = market_catalogue.runners
     runner_books = market_book.runners
@@ -124,12 +86,6 @@ def hedge_bet(
             print(result, result_dict["lastPriceTraded"])
         print("---------------------------------------------------")
 
-    """
-    PRINTS BACK AND LAY PRICES AS WELL AS AVAILABLE SIZE FOR THE GIVEN OUTCOME AND IF VERIFIED BY THE USER,
-    PLACES A MARKET ORDER TO LAY THE BET.
-    SHOULD BE OPTIMIZED BY BETTER UTILIZATION OF LIMIT ORDERS + LOOPS + TIME CONDITIONALS
-    """
-
     """
     STORES SELECTION ID FOR THE OUTCOME IN sel_id
     """
@@ -142,57 +98,35 @@ def hedge_bet(
     if sel_id is None:
         raise Exception(
             f'The parameter "outcome" must be in the list {list(outcome_dict.keys())}')
+    return sel_id
 
+
+def print_runner_book(outcome: str, back_prices: list, lay_prices: list):
     """
-    REQUESTS PRICES AND PRINTS THE [3, 3] BOOK TO THE CONSOLE IF continuous_output = True
+    PRINTS THE [3, 3] BOOK OF THE SELECTION TO THE CONSOLE
     """
-    price_filter = betfairlightweight.filters.price_projection(
-        price_data=['EX_BEST_OFFERS'])
-
-    runner_book_ex = betfair_client.betting.list_runner_book(
-        market_id=market_id,
-        selection_id=sel_id,
-        price_projection=price_filter)[0].runners[0].ex
-
-    back_prices = runner_book_ex.available_to_back
-    lay_prices = runner_book_ex.available_to_lay
-
-    if continuous_output:
-        print(f"Current book for your selection {outcome}:")
-        print("BACK PRICES")
-        for i in range(1, len(back_prices) + 1):
-            print(back_prices[-i])
-        print("")
-        print("LAY PRICES")
-        for lay_price in lay_prices:
-            print(lay_price)
-        print("---------------------------------------------------")
-
-    lay_price = lay_prices[0].price
-    # FIX
-    # FIX
-    # fix this lay stake such that it takes a weighted average depending on available volume
-    # FIX
-    # FIX
-    lay_stake = lay_bet_calculator(
-        stake=stake, odds=odds, lay_odds_betting_exchange=lay_price, bet_type=bet_type)
-    # FIX
-    # FIX
-    # fix this lay stake such that it takes a weighted average depending on available volume
-    # FIX
-    # FIX
-
-    if continuous_output:
-        print(
-            f"To neutralize your position you will have to lay {lay_stake} SEK at odds {lay_price}.")
-        print("---------------------------------------------------")
-
+    print(f"Current book for your selection {outcome}:")
+    print("BACK PRICES")
+    for i in range(1, len(back_prices) + 1):
+        print(back_prices[-i])
+    print("")
+    print("LAY PRICES")
+    for lay_price in lay_prices:
+        print(lay_price)
+    print("---------------------------------------------------")
+
+
+def lay_limit_price(lay_price: float) -> float:
     """
     ORDER PLACING
     orderbook-workflow - https://betfair-datascientists.github.io/api/apiPythontutorial/
 
     allowed_deviations DEFINED BELOW MUST BE MULTIPLES OF ENTRIES IN price_increments
     TO SATISFY BETFAIR ODDS / TICK SIZE REQUIREMENTS
+
+    :param float lay_price: Best lay price of the selection
+    :return: Limit price of the lay order, a few ticks above the best lay price
+    :rtype: float
     """
     price_increments = {"1.01-1.99": 0.01, "2.00-2.98": 0.02,
                         "3.00-3.95": 0.05, "4.00-5.90": 0.1, "6.00-9.80": 0.2, "10.00-19.50": 0.5}
@@ -206,7 +140,8 @@ def hedge_bet(
         if lay_price == 1.99:
             limit_price = 2.02
         else:
-            limit_price = lay_price + allowed_deviations["1.01-1.98"]
+            limit_price = round(
+                lay_price + allowed_deviations["1.01-1.98"], 2)
     elif lay_price >= 2 and lay_price < 3:
         if lay_price == 2.98:
             limit_price = 3.05
@@ -228,20 +163,163 @@ def hedge_bet(
     else:
         raise Exception(
             "hedge_bet function not compatible with odds >= 20.00, please hedge manually")
+    return limit_price
+
 
+def lay_order_instruction(sel_id: int, lay_stake: int, limit_price: float, customer_order_ref: str = None) -> dict:
     """
-    DEFINES ORDER FILTERS
+    DEFINES ORDER FILTERS, A LIMIT ORDER TO LAY lay_stake AT limit_price THAT LAPSES AT THE START,
+    TAGGED WITH customer_order_ref SO THAT IT CAN BE FOUND WITH list_current_orders
     """
+    import betfairlightweight
+
     limit_order_filter = betfairlightweight.filters.limit_order(
         size=lay_stake,
         price=limit_price,
         persistence_type='LAPSE')
 
-    instructions_filter = betfairlightweight.filters.place_instruction(
+    return betfairlightweight.filters.place_instruction(
         selection_id=str(sel_id),
         order_type="LIMIT",
         side="LAY",
-        limit_order=limit_order_filter)
+        limit_order=limit_order_filter,
+        customer_order_ref=customer_order_ref)
+
+
+def order_report(order) -> dict:
+    """
+    Confirmation dictionary of the first instruction of a place_orders response. A request rejected as a whole, e.g.
+    with DUPLICATE_TRANSACTION, has no instruction reports. "Status" is TIMEOUT if the request or the instruction
+    timed out, the order may then have been placed and has to be looked up with list_current_orders
+    """
+    if not order.place_instruction_reports:
+        return {"Status": order.status, "Order status": None, "BetID": None, "Average price matched": None,
+                "Size matched": None, "Error codes": {order.error_code}}
+    report = order.place_instruction_reports[0]
+
+    status = "TIMEOUT" if "TIMEOUT" in (order.status, report.status) else report.status
+    report_dict = {"Status": status, "Order status": report.order_status, "BetID": report.bet_id,
+                   "Average price matched": report.average_price_matched, "Size matched": report.size_matched,
+                   "Error codes": {order.error_code, report.error_code}}
+    return report_dict
+
+
+def hedge_bet(
+        betfair_client: "betfairlightweight.apiclient.APIClient",
+        home_team: str,
+        away_team: str,
+        market: str,
+        outcome: str,
+        bet_type: str,
+        stake: int,
+        odds: float,
+        date: str = date.today().isoformat(),
+        continuous_output: bool = True,
+        verification: bool = False,
+        exchange_fee: float = None,
+        customer_ref: str = None) -> dict:
+    """
+    Assumes a logged in betfairlightweight.APIClient() session with the BETFAIR API.
+    Hedges a back bet by calculating the lay stake [conditional on current market odds] and sending
+    the lay order (limit order) to the exchange. See async_hedge.async_hedge_bet for hedging many bets at once.
+
+    :param betfairlightweight.apiclient.APIClient betfair_client: A logged in betfairlightweight.APIClient() session with the BETFAIR API
+    :param str home_team: The home team in the game
+    :param str away_team: The away team in the game
+    :param str market: Market in Betfair format, e.g. Over/Under 2.5 Goals
+    :param str outcome: Outcome in Betfair format, e.g. Under 2.5 Goals
+    :param str bet_type: QB/FB/RFB, must be in the list ["Qualifying bet", "Freebet", "Risk-free bet"]
+    :param int stake: Stake bet on the outcome
+    :param float odds: Odds on the given outcome
+    :param str date: The date for the game, today by default "YYYY-MM-DD"
+    :param bool continuous_output: If True -> prints all the relevant information throughout the bet process
+    :param bool verification: If True -> requires verification from the user to place order after printing the order book, False by default
+    :param float exchange_fee: Commission on net winnings, the Betfair rate for the market in commission.FEE_TABLE by default
+    :param str customer_ref: Idempotency key of the order, at most 32 characters. Betfair rejects a repeat within 60 seconds
+                             with DUPLICATE_TRANSACTION, and the order carries it as customerOrderRef for list_current_orders
+
+    :return: Returns a dictionary with information about the order. If verification was set to True and the user chose not
+             to place the bet, returns None.
+    :rtype: dict with keys "Status", "Order status", "BetID", "Average price matched", "Size matched", "Error codes"
+    """
+    import betfairlightweight
+    from betfairlightweight.filters import market_filter
+
+    validate_hedge_arguments(home_team, away_team, market, outcome, bet_type)
+
+    """
+    DOCUMENTATION THROUGHOUT THE FUNCTION CODE AND THE HELPERS ABOVE, WHICH ARE SHARED WITH async_hedge.async_hedge_bet
+    """
+
+    """
+    LOCATES THE CORRECT MARKET ID
+    """
+    with span("betfair.list_market_catalogue"):
+        market_catalogues = betfair_client.betting.list_market_catalogue(
+            filter=game_search_filter(home_team, away_team, date),
+            max_results=1000,
+        )
+    market_id = find_market_id(market_catalogues, market)
+
+    try:
+        with span("betfair.list_market_book"):
+            market_book = betfair_client.betting.list_market_book(
+                market_ids=[market_id])[0]
+        with span("betfair.list_market_catalogue"):
+            market_catalogue = betfair_client.betting.list_market_catalogue(
+                filter=market_filter(market_ids=[market_id]),
+                market_projection=["RUNNER_DESCRIPTION", "RUNNER_METADATA"])[0]
+    except:
+        raise Exception('Requested market is not available at Betfair')
+
+    sel_id = outcome_selection_id(market_catalogue, market_book, market, outcome, continuous_output)
+
+    """
+    PRINTS BACK AND LAY PRICES AS WELL AS AVAILABLE SIZE FOR THE GIVEN OUTCOME AND IF VERIFIED BY THE USER,
+    PLACES A MARKET ORDER TO LAY THE BET.
+    SHOULD BE OPTIMIZED BY BETTER UTILIZATION OF LIMIT ORDERS + LOOPS + TIME CONDITIONALS
+    """
+
+    """
+    REQUESTS PRICES AND PRINTS THE [3, 3] BOOK TO THE CONSOLE IF continuous_output = True
+    """
+    price_filter = betfairlightweight.filters.price_projection(
+        price_data=['EX_BEST_OFFERS'])
+
+    with span("betfair.list_runner_book"):
+        runner_book_ex = betfair_client.betting.list_runner_book(
+            market_id=market_id,
+            selection_id=sel_id,
+            price_projection=price_filter)[0].runners[0].ex
+
+    back_prices = runner_book_ex.available_to_back
+    lay_prices = runner_book_ex.available_to_lay
+
+    if continuous_output:
+        print_runner_book(outcome, back_prices, lay_prices)
+
+    lay_price = lay_prices[0].price
+    # FIX
+    # FIX
+    # fix this lay stake such that it takes a weighted average depending on available volume
+    # FIX
+    # FIX
+    if exchange_fee is None:
+        exchange_fee = commission.commission_rate(commission.DEFAULT_EXCHANGE, market)
+    lay_stake = lay_bet_calculator(
+        stake=stake, odds=odds, lay_odds_betting_exchange=lay_price, bet_type=bet_type, fee=exchange_fee)
+    # FIX
+    # FIX
+    # fix this lay stake such that it takes a weighted average depending on available volume
+    # FIX
+    # FIX
+
+    if continuous_output:
+        print(
+            f"To neutralize your position you will have to lay {lay_stake} SEK at odds {lay_price}.")
+        print("---------------------------------------------------")
+
+    instructions_filter = lay_order_instruction(sel_id, lay_stake, lay_limit_price(lay_price), customer_ref)
 
     """
     IF verification == True, THIS SIMPLE VERIFICATION PROCESS ASSERTS
@@ -251,38 +329,21 @@ def hedge_bet(
         verification_input = input(
             "Do you want to hedge your bet by placing an order? y/n ",)
         print("---------------------------------------------------")
-        if verification_input == 'y':
-            """
-            EXECUTION, PLACES THE LIMIT ORDER AND RETURNS CONFIRMATION DICT
-            """
-            order = betfair_client.betting.place_orders(
-                market_id=market_id,
-                instructions=[instructions_filter])
-
-            report = order.place_instruction_reports[0]
-
-            report_dict = {"Status": report.status, "Order status": report.order_status, "BetID": report.bet_id,
-                           "Average price matched": report.average_price_matched, "Size matched": report.size_matched,
-                           "Error codes": {order.error_code, report.error_code}}
-            return report_dict
-        else:
+        if verification_input != 'y':
             print("No order was placed.")
             print("---------------------------------------------------")
             return None
-    else:
-        """
-        IMMEDIATE EXECUTION, SENDS THE LIMIT ORDER AND RETURNS CONFIRMATION DICTIONARY
-        """
+
+    """
+    EXECUTION, SENDS THE LIMIT ORDER AND RETURNS CONFIRMATION DICTIONARY
+    """
+    with span("betfair.place_orders"):
         order = betfair_client.betting.place_orders(
             market_id=market_id,
-            instructions=[instructions_filter])
+            instructions=[instructions_filter],
+            customer_ref=customer_ref)
 
-        report = order.place_instruction_reports[0]
-
-        report_dict = {"Status": report.status, "Order status": report.order_status, "BetID": report.bet_id,
-                       "Average price matched": report.average_price_matched, "Size matched": report.size_matched,
-                       "Error codes": {order.error_code, report.error_code}}
-        return report_dict
+    return order_report(order)
 
 
 def process_runner_books(runner_books):
@@ -291,24 +352,26 @@ def process_runner_books(runner_books):
     :param runner_books:
     :return:
     '''
+    import pandas as pd
+
     best_back_prices = [runner_book.ex.available_to_back[0].price
-                        if runner_book.ex.available_to_back.price
+                        if runner_book.ex.available_to_back
                         else 1.01
                         for runner_book
                         in runner_books]
     best_back_sizes = [runner_book.ex.available_to_back[0].size
-                       if runner_book.ex.available_to_back.size
+                       if runner_book.ex.available_to_back
                        else 1.01
                        for runner_book
                        in runner_books]
 
     best_lay_prices = [runner_book.ex.available_to_lay[0].price
-                       if runner_book.ex.available_to_lay.price
+                       if runner_book.ex.available_to_lay
                        else 1000.0
                        for runner_book
                        in runner_books]
     best_lay_sizes = [runner_book.ex.available_to_lay[0].size
-                      if runner_book.ex.available_to_lay.size
+                      if runner_book.ex.available_to_lay
                       else 1.01
                       for runner_book
                       in runner_books]
@@ -336,3 +399,43 @@ def process_runner_books(runner_books):
         'Adjustment Factor': adjustment_factors
     })
     return df
+
+
+def process_runner_ladders(runner_books):
+    '''
+    This function processes the runner books of a list_market_book request with EX_ALL_OFFERS and returns every level
+    of the back and lay ladders in long format, one row per runner, side and price. process_runner_books only keeps
+    the best level
+    :param runner_books:
+    :return: DataFrame with the columns [Selection ID, Status, Side, Level, Price, Size], Side is "Back" or "Lay" and
+             Level 0 is the best price of the side
+    '''
+    import pandas as pd
+
+    rows = [(runner_book.selection_id, runner_book.status, side, level, price_size.price, price_size.size)
+            for runner_book in runner_books
+            for side, ladder in (("Back", runner_book.ex.available_to_back), ("Lay", runner_book.ex.available_to_lay))
+            for level, price_size in enumerate(ladder)]
+    return pd.DataFrame(rows, columns=["Selection ID", "Status", "Side", "Level", "Price", "Size"])
+
+
+"""
+BETFAIR PRICE LADDER
+https://docs.developer.betfair.com/display/1smk3cen4v3lu3yomq5qye0ni/Betfair+Price+Increments
+"""
+BETFAIR_PRICE_INCREMENTS = [(1.01, 2, 0.01), (2, 3, 0.02), (3, 4, 0.05), (4, 6, 0.1), (6, 10, 0.2),
+                            (10, 20, 0.5), (20, 30, 1), (30, 50, 2), (50, 100, 5), (100, 1000, 10)]
+
+
+def betfair_price_ladder() -> list:
+    '''
+    Returns every valid Betfair price from 1.01 to 1000 in ascending order, the index of a price in the list
+    is its tick number
+    :rtype: list
+    '''
+    ladder = []
+    for lower, upper, increment in BETFAIR_PRICE_INCREMENTS:
+        steps = int(round((upper - lower) / increment))
+        ladder.extend(float(round(lower + i * increment, 2)) for i in range(steps))
+    ladder.append(1000.0)
+    return ladder
@@ -0,0 +1,346 @@
+import numbers
+
+import numpy as np
+import pandas as pd
+
+from mb_functions import betfair_price_ladder
+
+"""
+ODDS DRIFT MODEL FROM RECORDED SNAPSHOTS
+
+RECORDS REPEATED SNAPSHOTS OF A MARKET (process_runner_books DATAFRAMES FROM THE EXCHANGE, OR AN ODDSMATRIS FROM
+scrape_orchestrator.skrapa_tävlingsdag) AS COLUMNAR NUMPY HISTORY, ONE ROW PER SNAPSHOT AND ONE COLUMN PER RUNNER.
+PRICES ARE STORED AS BETFAIR TICKS (FRACTIONAL FOR BOOKMAKER ODDS BETWEEN TWO TICKS), SO A MOVE FROM 1.50 TO 1.51 AND
+FROM 10 TO 10.5 BOTH COUNT AS ONE TICK.
+
+NEXT TO THE TICKS EVERY MARKET KEEPS RUNNING SUMS OF THE ABSOLUTE AND SQUARED TICK MOVES, SO THE STATISTICS OVER A
+ROLLING TIME WINDOW ARE A np.searchsorted LOOKUP AND A DIFFERENCE OF CUMULATIVE SUMS, FOR THE LAST SNAPSHOT IN
+should_hedge_now AND FOR THE WHOLE HISTORY AT ONCE IN drift_table:
+
+tick moves per minute   SUM OF |MOVE| IN THE WINDOW / MINUTES
+drift per minute        NET MOVE OVER THE WINDOW / MINUTES, NEGATIVE WHEN THE PRICE SHORTENS
+volatility              STANDARD DEVIATION OF THE MOVES IN THE WINDOW, TICKS PER SNAPSHOT
+spread                  LAY TICK - BACK TICK
+
+A LAY IS CHEAPER AT A LOWER PRICE, SO WAITING ONLY PAYS WHILE THE LAY PRICE SHORTENS AND THE SPREAD IS WIDE, E.G.
+
+history = OddsHistory()
+history.record_runner_books("1.2345", datetime.now(timezone.utc), process_runner_books(runners),
+                            start_time=market_book.market_definition.market_time)
+history.should_hedge_now("1.2345", selection_id)
+history.profile(bins=[0, 5, 15, 30, 60, 120])      # Tick moves and spread by minutes to start over all markets
+"""
+
+"""
+INPUT DATA + PARAMETERS
+"""
+PRICE_LADDER = np.array(betfair_price_ladder())
+# Placeholder prices of process_runner_books for runners without offers
+NO_BACK_PRICE = 1.01
+NO_LAY_PRICE = 1000.0
+# Odds at or above this value mark a scratched horse
+SCRATCHED_ODDS = 999
+# Rolling window of the statistics, in seconds
+WINDOW = 300
+# should_hedge_now waits only while the lay price shortens by more than this many ticks per minute
+MIN_SHORTENING = 0.2
+# and the spread is wider than this many ticks
+MAX_SPREAD = 2
+# and there are more than this many minutes to the start
+MIN_MINUTES_TO_START = 5
+INITIAL_CAPACITY = 64
+
+STATISTICS = ["Tick moves per minute", "Drift per minute", "Volatility", "Spread", "Mean spread"]
+
+
+def price_to_tick(prices) -> np.ndarray:
+    """
+    Betfair tick number of decimal odds, interpolated between the ticks for prices not on the ladder
+
+    :param prices: Decimal odds, NaN stays NaN
+
+    :return: Tick numbers, 0 = 1.01 and len(PRICE_LADDER) - 1 = 1000
+    :rtype: np.ndarray
+    """
+    prices = np.asarray(prices, dtype=float)
+    return np.interp(prices, PRICE_LADDER, np.arange(len(PRICE_LADDER)), left=np.nan, right=np.nan)
+
+
+def tick_to_price(ticks) -> np.ndarray:
+    """
+    Decimal odds of (fractional) tick numbers, the inverse of price_to_tick
+
+    :rtype: np.ndarray
+    """
+    return np.interp(np.asarray(ticks, dtype=float), np.arange(len(PRICE_LADDER)), PRICE_LADDER)
+
+
+def _seconds(timestamp) -> float:
+    # Seconds since the epoch, also as numpy scalars from recorded arrays (pd.Timestamp would read them as
+    # nanoseconds). Naive datetimes are taken as UTC, as betfairlightweight returns them
+    if isinstance(timestamp, numbers.Real):
+        return float(timestamp)
+    return pd.Timestamp(timestamp).timestamp()
+
+
+class MarketHistory:
+    """
+    Columnar snapshot history of one market, grown by doubling the capacity of the arrays
+
+    :param list runners: Runner keys of the market, the columns of the arrays
+    :param float start_time: Kick-off or post time in seconds since the epoch, None if unknown
+    """
+
+    def __init__(self, runners: list, start_time: float = None):
+        self.runners = list(runners)
+        self.columns = {runner: i for i, runner in enumerate(self.runners)}
+        self.start_time = start_time
+        self.n = 0
+        shape = (INITIAL_CAPACITY, len(self.runners))
+        self.times = np.empty(INITIAL_CAPACITY)
+        self.back = np.empty(shape)
+        self.lay = np.empty(shape)
+        # Cumulative |move| and move² of the reference price (lay, back where there is no lay), row 0 is 0
+        self.cum_moves = np.empty(shape)
+        self.cum_squares = np.empty(shape)
+        self.cum_spread = np.empty(shape)
+        self.spread_count = np.empty(shape)
+
+    def _grow(self):
+        for name in ("times", "back", "lay", "cum_moves", "cum_squares", "cum_spread", "spread_count"):
+            array = getattr(self, name)
+            grown = np.empty((2 * len(array),) + array.shape[1:])
+            grown[:self.n] = array[:self.n]
+            setattr(self, name, grown)
+
+    def reference(self, rows=slice(None)) -> np.ndarray:
+        """
+        Ticks the moves are measured on, the lay price where there is one and the back price otherwise
+        """
+        lay = self.lay[:self.n][rows]
+        return np.where(np.isnan(lay), self.back[:self.n][rows], lay)
+
+    def append(self, timestamp: float, back_ticks: np.ndarray, lay_ticks: np.ndarray):
+        if self.n and timestamp < self.times[self.n - 1]:
+            raise Exception(f"Snapshots must be recorded in time order, {timestamp} is before "
+                            f"{self.times[self.n - 1]}")
+        if self.n == len(self.times):
+            self._grow()
+        i = self.n
+        self.times[i], self.back[i], self.lay[i] = timestamp, back_ticks, lay_ticks
+        spread = lay_ticks - back_ticks
+        has_spread = ~np.isnan(spread)
+        if i == 0:
+            self.cum_moves[0] = self.cum_squares[0] = 0
+            self.cum_spread[0] = np.where(has_spread, spread, 0)
+            self.spread_count[0] = has_spread
+        else:
+            previous = np.where(np.isnan(self.lay[i - 1]), self.back[i - 1], self.lay[i - 1])
+            current = np.where(np.isnan(lay_ticks), back_ticks, lay_ticks)
+            # A runner without a price in either snapshot does not move
+            move = np.nan_to_num(current - previous)
+            self.cum_moves[i] = self.cum_moves[i - 1] + np.abs(move)
+            self.cum_squares[i] = self.cum_squares[i - 1] + move ** 2
+            self.cum_spread[i] = self.cum_spread[i - 1] + np.where(has_spread, spread, 0)
+            self.spread_count[i] = self.spread_count[i - 1] + has_spread
+        self.n += 1
+
+    def window_statistics(self, rows: np.ndarray, window: float) -> dict:
+        """
+        Rolling statistics ending at the given snapshot rows, vectorized over the rows and runners
+
+        :param np.ndarray rows: Snapshot indices
+        :param float window: Window length in seconds
+
+        :return: Statistic name -> array of shape (len(rows), runners)
+        :rtype: dict
+        """
+        times = self.times[:self.n]
+        first = np.searchsorted(times, times[rows] - window, side="left")
+        # Moves are between consecutive snapshots, the first snapshot of the window has no move of its own
+        n_moves = (rows - first)[:, None]
+        minutes = ((times[rows] - times[first]) / 60)[:, None]
+        moves = self.cum_moves[rows] - self.cum_moves[first]
+        squares = self.cum_squares[rows] - self.cum_squares[first]
+        net = self.reference(rows) - self.reference(first)
+        spread_sum = self.cum_spread[rows] - self.cum_spread[np.maximum(first - 1, 0)] * (first > 0)[:, None]
+        spread_count = self.spread_count[rows] - self.spread_count[np.maximum(first - 1, 0)] * (first > 0)[:, None]
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_move = np.where(n_moves > 0, net / n_moves, np.nan)
+            variance = np.where(n_moves > 0, squares / n_moves - mean_move ** 2, np.nan)
+            return {"Tick moves per minute": np.where(minutes > 0, moves / minutes, np.nan),
+                    "Drift per minute": np.where(minutes > 0, net / minutes, np.nan),
+                    "Volatility": np.sqrt(np.maximum(variance, 0)),
+                    "Spread": self.lay[rows] - self.back[rows],
+                    "Mean spread": np.where(spread_count > 0, spread_sum / spread_count, np.nan)}
+
+
+class OddsHistory:
+    """
+    Snapshot history of many markets with rolling drift and volatility statistics
+    """
+
+    def __init__(self):
+        self.markets = {}
+
+    def record(self, market, timestamp, runners: list, back_prices, lay_prices=None, start_time=None):
+        """
+        Appends one snapshot of a market. The runners of the first snapshot are the columns of the market, later
+        runners not among them are ignored and missing runners get NaN
+
+        :param market: Market key, e.g. a Betfair market id or "Solvalla Lopp 3"
+        :param timestamp: Time of the snapshot, datetime (UTC if naive) or seconds since the epoch
+        :param list runners: Runner keys
+        :param back_prices: Best back price per runner, NaN or SCRATCHED_ODDS if there is none
+        :param lay_prices: Best lay price per runner, None for bookmaker snapshots
+        :param start_time: Kick-off or post time, datetime or seconds since the epoch, kept from earlier snapshots if
+                           None
+        """
+        history = self.markets.get(market)
+        if history is None:
+            history = self.markets[market] = MarketHistory(runners)
+        if start_time is not None:
+            history.start_time = _seconds(start_time)
+
+        back = np.asarray(back_prices, dtype=float)
+        back = np.where(back >= SCRATCHED_ODDS, np.nan, back)
+        lay = np.full(len(back), np.nan) if lay_prices is None else np.asarray(lay_prices, dtype=float)
+        back_ticks, lay_ticks = np.full(len(history.runners), np.nan), np.full(len(history.runners), np.nan)
+        columns = np.array([history.columns.get(runner, -1) for runner in runners], dtype=int)
+        known = columns >= 0
+        back_ticks[columns[known]] = price_to_tick(back[known])
+        lay_ticks[columns[known]] = price_to_tick(lay[known])
+        history.append(_seconds(timestamp), back_ticks, lay_ticks)
+
+    def record_runner_books(self, market, timestamp, runner_books_df: pd.DataFrame, start_time=None):
+        """
+        Appends a snapshot from the dataframe of mb_functions.process_runner_books, keyed by Selection ID. The
+        placeholder prices of runners without offers and runners that are not active are recorded as NaN
+        """
+        active = (runner_books_df["Status"] == "ACTIVE").to_numpy()
+        back = runner_books_df["Best Back Price"].to_numpy(dtype=float)
+        lay = runner_books_df["Best Lay Price"].to_numpy(dtype=float)
+        back = np.where(active & (back > NO_BACK_PRICE), back, np.nan)
+        lay = np.where(active & (lay < NO_LAY_PRICE), lay, np.nan)
+        self.record(market, timestamp, runner_books_df["Selection ID"].tolist(), back, lay, start_time)
+
+    def record_odds_matrix(self, matris: pd.DataFrame, timestamp, källa: str, bana: str = "", field: str = "VOdds",
+                           start_times: dict = None):
+        """
+        Appends a snapshot of one bookmaker from an oddsmatris of scrape_orchestrator.skrapa_tävlingsdag, one
+        market per race keyed "{bana} Lopp {lopp} {källa}"
+
+        :param pd.DataFrame matris: Index [Lopp, Häst], columns "{källa} VOdds" and "{källa} POdds"
+        :param timestamp: Time of the scrape
+        :param str källa: Bookmaker column prefix
+        :param str bana: Prefix of the market keys
+        :param str field: "VOdds" or "POdds"
+        :param dict start_times: Lopp -> post time, optional
+        """
+        column = f"{källa} {field}"
+        for lopp, lopp_df in matris.groupby(level="Lopp"):
+            market = f"{bana} Lopp {lopp} {källa}".strip()
+            self.record(market, timestamp, list(lopp_df.index.get_level_values("Häst")),
+                        lopp_df[column].to_numpy(dtype=float), None, (start_times or {}).get(lopp))
+
+    def drift_table(self, market, window: float = WINDOW) -> pd.DataFrame:
+        """
+        Rolling statistics of every snapshot and runner of a market
+
+        :param market: Recorded market key
+        :param float window: Window length in seconds
+
+        :return: Dataframe with the columns [Time (UTC), Minutes to start, Runner, Back odds, Lay odds, Tick moves per
+                 minute, Drift per minute, Volatility, Spread, Mean spread], one row per snapshot and runner
+        :rtype: pd.DataFrame
+        """
+        history = self.markets[market]
+        rows = np.arange(history.n)
+        statistics = history.window_statistics(rows, window)
+        n_runners = len(history.runners)
+        times = history.times[:history.n]
+        minutes_to_start = (history.start_time - times) / 60 if history.start_time is not None \
+            else np.full(history.n, np.nan)
+        table = pd.DataFrame({
+            "Time": np.repeat(pd.to_datetime(times, unit="s").to_numpy(), n_runners),
+            "Minutes to start": np.repeat(minutes_to_start, n_runners),
+            "Runner": np.tile(np.array(history.runners, dtype=object), history.n),
+            "Back odds": tick_to_price(history.back[:history.n]).ravel(),
+            "Lay odds": tick_to_price(history.lay[:history.n]).ravel()})
+        for name in STATISTICS:
+            table[name] = statistics[name].ravel()
+        return table
+
+    def latest(self, market, runner, window: float = WINDOW) -> dict:
+        """
+        Rolling statistics of a runner at the last snapshot, O(log n) in the number of snapshots
+
+        :return: Dict with the keys Time, Minutes to start, Back odds, Lay odds and the STATISTICS
+        :rtype: dict
+        """
+        history = self.markets[market]
+        if history.n == 0:
+            raise Exception(f"No snapshots recorded for {market}")
+        column = history.columns[runner]
+        last = history.n - 1
+        statistics = history.window_statistics(np.array([last]), window)
+        latest = {"Time": pd.Timestamp(history.times[last], unit="s"),
+                  "Minutes to start": float(history.start_time - history.times[last]) / 60
+                  if history.start_time is not None else None,
+                  "Back odds": float(tick_to_price(history.back[last, column])),
+                  "Lay odds": float(tick_to_price(history.lay[last, column]))}
+        latest.update({name: float(values[0, column]) for name, values in statistics.items()})
+        return latest
+
+    def should_hedge_now(self, market, runner, window: float = WINDOW, min_shortening: float = MIN_SHORTENING,
+                         max_spread: float = MAX_SPREAD, min_minutes_to_start: float = MIN_MINUTES_TO_START) -> dict:
+        """
+        Decides whether to lay a runner now or wait for a better price. Waiting only pays while the lay price
+        shortens, so the lay is placed now unless the price is shortening faster than min_shortening ticks per
+        minute, the spread is wider than max_spread ticks and the start is more than min_minutes_to_start away
+
+        :param market: Recorded market key
+        :param runner: Runner key
+        :param float window: Window of the drift statistics in seconds
+        :param float min_shortening: Ticks per minute the lay price must shorten by to wait
+        :param float max_spread: Spread in ticks at or below which the price is taken
+        :param float min_minutes_to_start: Minutes to the start below which the price is taken
+
+        :return: latest() with the keys "Hedge now" (bool) and "Reason" added
+        :rtype: dict
+        """
+        latest = self.latest(market, runner, window)
+        minutes_to_start, drift, spread = latest["Minutes to start"], latest["Drift per minute"], latest["Spread"]
+        if np.isnan(latest["Lay odds"]):
+            hedge_now, reason = False, "No lay price"
+        elif minutes_to_start is not None and minutes_to_start <= min_minutes_to_start:
+            hedge_now, reason = True, "Close to the start"
+        elif np.isnan(drift) or drift > -min_shortening:
+            hedge_now, reason = True, "Lay price is not shortening"
+        elif spread <= max_spread:
+            hedge_now, reason = True, "Spread is tight"
+        else:
+            hedge_now, reason = False, "Lay price is shortening"
+        return latest | {"Hedge now": hedge_now, "Reason": reason}
+
+    def profile(self, bins: list, window: float = WINDOW, markets: list = None) -> pd.DataFrame:
+        """
+        Average statistics by minutes to start over the recorded markets with a start time, for choosing when to
+        hedge in general
+
+        :param list bins: Edges of the minutes to start buckets, e.g. [0, 5, 15, 30, 60]
+        :param float window: Window of the statistics in seconds
+        :param list markets: Markets to include, all by default
+
+        :return: Dataframe indexed by the minutes to start bucket with the mean of the STATISTICS and the number of
+                 snapshots
+        :rtype: pd.DataFrame
+        """
+        tables = [self.drift_table(market, window) for market in (markets or self.markets)
+                  if self.markets[market].start_time is not None]
+        if not tables:
+            return pd.DataFrame(columns=STATISTICS + ["Snapshots"])
+        table = pd.concat(tables, ignore_index=True)
+        grouped = table.groupby(pd.cut(table["Minutes to start"], bins), observed=False)
+        return grouped[STATISTICS].mean().assign(Snapshots=grouped.size())
@@ -0,0 +1,293 @@
+import re
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import scipy.optimize
+import scipy.sparse
+
+import commission
+from calculators import FREEBET_RETENTION
+from tracing import span
+
+"""
+PORTFOLIO HEDGING OF ALL OPEN BETS ON THE SAME GAMES
+
+hedge_bet AND THE MASTER CALCULATORS HEDGE ONE BET OR ONE MARKET AT A TIME. HERE EVERY OPEN POSITION OF A GAME
+(QUALIFYING BETS, FREEBETS AND RISK-FREE BETS ON MATCH ODDS, OVER/UNDER AND BOTH TEAMS TO SCORE) IS SETTLED ON A GRID
+OF FINAL SCORES, WHICH GIVES A SCENARIO PAYOFF MATRIX WHERE THE CORRELATION BETWEEN THE MARKETS IS EXACT (E.G. 0-0 IS
+A DRAW, UNDER 2.5 GOALS AND NO IN BOTH TEAMS TO SCORE). A LINEAR PROGRAM THEN FINDS THE LAY STAKES ON THE EXCHANGE
+MAXIMIZING THE WORST-CASE PROFIT OF EVERY GAME, AND A SECOND ONE THE SMALLEST TOTAL LIABILITY REACHING IT, WHICH
+LEAVES OUT REDUNDANT LAY ORDERS. ALL GAMES ARE SOLVED IN ONE SPARSE BLOCK-DIAGONAL PROGRAM, E.G.
+
+positions = ExcelFile("PATH_TO_EXCEL_FILE").parse(0).to_dict(orient="records")
+lay_odds = exchange_lay_odds(trading, {(bet["Home"], bet["Away"]) for bet in positions}, "2022-05-31")
+result = portfolio_hedges(positions, lay_odds)
+result["Orders"], result["Games"]
+"""
+
+"""
+INPUT DATA + PARAMETERS
+"""
+# Scores 0-MAX_GOALS for each team, enough to separate every outcome of the Over/Under markets up to 6.5 goals
+MAX_GOALS = 10
+# Upper bound on the total lay stake of a game relative to its total back stake, keeps the program bounded
+# if the lay prices contain an arbitrage
+MAX_LAY_FACTOR = 10
+# list_market_book is limited to a weight of 200 per request, EX_BEST_OFFERS weighs 5 per market
+MARKETS_PER_BOOK_REQUEST = 40
+
+OVER_UNDER = re.compile(r"Over/Under (\d+\.5) Goals( Unmanaged)?")
+
+
+def outcome_wins(market: str, outcome: str, home_team: str, away_team: str, home_goals, away_goals) -> np.ndarray:
+    """
+    Settles an outcome on a grid of final scores
+
+    :param str market: Market in Betfair format, e.g. Over/Under 2.5 Goals
+    :param str outcome: Outcome in Betfair format, e.g. Under 2.5 Goals
+    :param str home_team: The home team in the game
+    :param str away_team: The away team in the game
+    :param np.ndarray home_goals: Goals scored by the home team per scenario
+    :param np.ndarray away_goals: Goals scored by the away team per scenario
+
+    :return: Boolean array, True in the scenarios where the outcome wins
+    :rtype: np.ndarray
+    """
+    if market == "Match Odds":
+        if outcome == home_team:
+            return home_goals > away_goals
+        if outcome == away_team:
+            return away_goals > home_goals
+        if outcome == "The Draw":
+            return home_goals == away_goals
+    elif market == "Both teams to Score?":
+        if outcome in ("Yes", "No"):
+            return ((home_goals > 0) & (away_goals > 0)) == (outcome == "Yes")
+    elif OVER_UNDER.fullmatch(market):
+        line = OVER_UNDER.fullmatch(market).group(1)
+        if outcome == f"Over {line} Goals":
+            return home_goals + away_goals > float(line)
+        if outcome == f"Under {line} Goals":
+            return home_goals + away_goals < float(line)
+    else:
+        raise Exception(f"{market} is not supported by the portfolio optimizer, please hedge it with hedge_bet")
+    raise Exception(f"{outcome} is not an outcome of {market} in {home_team} v {away_team}")
+
+
+def back_bet_payoffs(bet_type: str, stake: float, odds: float, wins: np.ndarray,
+                     rf_stake_returned_as_freebet: bool = False,
+                     freebet_retention: float = FREEBET_RETENTION) -> np.ndarray:
+    """
+    Payoff of a back bet per scenario, with the conventions of the master calculators
+
+    :param str bet_type: QB/FB/RFB, must be in the list ["Qualifying bet", "Freebet", "Risk-free bet"]
+    :param float stake: Bet size
+    :param float odds: Odds on the bet
+    :param np.ndarray wins: Boolean array from outcome_wins
+    :param bool rf_stake_returned_as_freebet: True if the stake of a lost risk-free bet is returned in freebet credits
+    :param float freebet_retention: Share of a returned freebet kept when it is converted
+
+    :rtype: np.ndarray
+    """
+    if bet_type == "Qualifying bet":
+        lost = -stake
+    elif bet_type == "Freebet":
+        lost = 0
+    elif bet_type == "Risk-free bet":
+        lost = -(1 - freebet_retention) * stake if rf_stake_returned_as_freebet else 0
+    else:
+        raise Exception(
+            f'{bet_type} must be either "Qualifying bet", "Freebet" or "Risk-free bet"')
+    return np.where(wins, stake * (odds - 1), lost)
+
+
+def portfolio_hedges(positions: list, lay_odds: dict, exchange_fee: float = None,
+                     rf_stake_returned_as_freebet: bool = False, freebet_retention: float = FREEBET_RETENTION,
+                     profit_tolerance: float = 0.01, max_lay_factor: float = MAX_LAY_FACTOR) -> dict:
+    """
+    Computes the lay orders hedging every open position of every game at once
+
+    :param list positions: Bets as rows of the Excel sheet used by hedge_bets.py, dicts with the keys
+                           "Home", "Away", "Market", "Outcome", "Bet type", "Stake" and "Odds"
+    :param dict lay_odds: (game "Home v Away", market, outcome) -> best lay price, or a dict with the keys "Price" and
+                          optionally "Size" (available volume, bounds the lay stake), "Market ID" and "Selection ID",
+                          as returned by exchange_lay_odds. Every outcome with a lay price may be laid
+    :param float exchange_fee: Commission on net market winnings at the exchange, looked up per market with
+                               commission.commission_rate if None. The lay bets of a market are netted before the
+                               commission is taken
+    :param bool rf_stake_returned_as_freebet: True if the stake of a lost risk-free bet is returned in freebet credits
+    :param float freebet_retention: Share of a returned freebet kept when it is converted
+    :param float profit_tolerance: Worst-case profit per game that may be given up for a smaller total liability
+    :param float max_lay_factor: Upper bound on the total lay stake of a game relative to its total back stake
+
+    :return: {"Orders": dataframe with the columns [Game, Market, Outcome, Lay odds, Lay stake, Liability] and
+              Market ID/Selection ID when given in lay_odds,
+              "Games": dataframe indexed by Game with the columns [Positions, Unhedged worst case, Worst-case profit,
+              Best-case profit], profits after rounding the lay stakes}
+    :rtype: dict
+    """
+    home_goals, away_goals = (grid.ravel() for grid in np.meshgrid(np.arange(MAX_GOALS + 1),
+                                                                    np.arange(MAX_GOALS + 1), indexing="ij"))
+    games = {}
+    for bet in positions:
+        games.setdefault((bet["Home"], bet["Away"]), []).append(bet)
+
+    lay_columns_per_game = {}
+    for key, price in lay_odds.items():
+        lay_columns_per_game.setdefault(key[0], []).append((key, price if isinstance(price, dict) else
+                                                            {"Price": price}))
+
+    """
+    SCENARIO PAYOFF MATRIX PER GAME, DUPLICATE SCENARIOS (SCORES SETTLING EVERY OUTCOME THE SAME WAY) ARE DROPPED
+    """
+    blocks, rhs, upper_bounds, liabilities, game_data = [], [], [], [], []
+    for (home, away), bets in games.items():
+        game = f"{home} v {away}"
+        back_payoff = sum(back_bet_payoffs(bet["Bet type"], bet["Stake"], bet["Odds"],
+                                           outcome_wins(bet["Market"], bet["Outcome"], home, away, home_goals,
+                                                        away_goals),
+                                           rf_stake_returned_as_freebet, freebet_retention) for bet in bets)
+        columns = lay_columns_per_game.get(game, [])
+        # Gross lay payoffs before commission, the commission is taken on the net result of each market
+        lay_payoff = np.empty((len(home_goals), len(columns)))
+        for j, ((_, market, outcome), price) in enumerate(columns):
+            wins = outcome_wins(market, outcome, home, away, home_goals, away_goals)
+            lay_payoff[:, j] = np.where(wins, -(price["Price"] - 1), 1)
+        scenarios = np.unique(np.column_stack([back_payoff, lay_payoff]), axis=0)
+        back_payoff, lay_payoff = scenarios[:, 0], scenarios[:, 1:]
+        n_scenarios, n_columns = scenarios.shape[0], len(columns)
+        markets = list(dict.fromkeys(market for (_, market, _), _ in columns))
+        rates = np.array([commission.commission_rate(commission.DEFAULT_EXCHANGE, market) if exchange_fee is None
+                          else exchange_fee for market in markets])
+
+        """
+        VARIABLES [lay stakes, u, t] PER GAME, ONE u >= max(net lay result of the market, 0) PER MARKET AND DISTINCT
+        SETTLEMENT OF ITS LAYS (E.G. 3 FOR MATCH ODDS), NOT PER SCENARIO:
+        t <= back_payoff + lay_payoff @ lay stakes - sum over the markets of rate * u IN EVERY SCENARIO,
+        sum(lay stakes) <= max_lay_factor * total back stake
+        """
+        market_rows, commission_u = [], []
+        for market, rate in zip(markets, rates):
+            in_market = np.array([column_market == market for (_, column_market, _), _ in columns])
+            settlements, scenario_settlement = np.unique(lay_payoff[:, in_market], axis=0, return_inverse=True)
+            rows = np.zeros((len(settlements), n_columns))
+            rows[:, in_market] = settlements
+            market_rows.append(rows)
+            commission_u.append(rate * np.eye(len(settlements))[scenario_settlement.ravel()])
+        market_payoff = np.vstack(market_rows) if markets else np.zeros((0, n_columns))
+        n_u = market_payoff.shape[0]
+        blocks.append(np.vstack([
+            np.hstack([-lay_payoff, *commission_u, np.ones((n_scenarios, 1))]),
+            np.hstack([market_payoff, -np.eye(n_u), np.zeros((n_u, 1))]),
+            np.concatenate([np.ones(n_columns), np.zeros(n_u + 1)])]))
+        rhs.append(np.concatenate([back_payoff, np.zeros(n_u), [max_lay_factor * sum(bet["Stake"] for bet in bets)]]))
+        upper_bounds.extend([price.get("Size") for _, price in columns] + [None] * (n_u + 1))
+        liabilities.extend([price["Price"] - 1 for _, price in columns] + [0] * (n_u + 1))
+        game_data.append((game, len(bets), columns, n_u, back_payoff, lay_payoff, markets, rates))
+
+    A_ub = scipy.sparse.block_diag(blocks, format="csr")
+    b_ub = np.concatenate(rhs)
+    # The worst-case profit t is the last variable of every game
+    is_profit = np.zeros(len(liabilities), dtype=bool)
+    is_profit[np.cumsum([block.shape[1] for block in blocks]) - 1] = True
+
+    """
+    STAGE 1 MAXIMIZES THE SUM OF THE WORST-CASE PROFITS, WHICH MAXIMIZES EACH OF THEM AS THE GAMES ARE INDEPENDENT.
+    STAGE 2 KEEPS EVERY WORST-CASE PROFIT WITHIN profit_tolerance AND MINIMIZES THE TOTAL LIABILITY
+    """
+    bounds = [(None, None) if profit else (0, upper) for profit, upper in zip(is_profit, upper_bounds)]
+    with span("portfolio.linprog"):
+        result = scipy.optimize.linprog(c=-is_profit.astype(float), A_ub=A_ub, b_ub=b_ub, bounds=bounds,
+                                        method="highs")
+    if result.status != 0:
+        raise Exception(f"The portfolio could not be optimized: {result.message}")
+    bounds = [(value - profit_tolerance, None) if profit else bound
+              for profit, value, bound in zip(is_profit, result.x, bounds)]
+    with span("portfolio.linprog"):
+        result = scipy.optimize.linprog(c=np.array(liabilities, dtype=float), A_ub=A_ub, b_ub=b_ub, bounds=bounds,
+                                        method="highs")
+    if result.status != 0:
+        raise Exception(f"The portfolio could not be optimized: {result.message}")
+
+    """
+    ROUNDS THE LAY STAKES DOWN TO WHOLE UNITS AS lay_bet_calculator DOES AND EVALUATES THE ROUNDED PORTFOLIO
+    """
+    orders, game_rows = [], []
+    start = 0
+    for game, n_positions, columns, n_u, back_payoff, lay_payoff, markets, rates in game_data:
+        stakes = np.floor(result.x[start:start + len(columns)] + 1e-9)
+        start += len(columns) + n_u + 1
+        in_market = np.array([[column_market == market for (_, column_market, _), _ in columns]
+                              for market in markets]).reshape(len(markets), len(columns))
+        market_result = lay_payoff @ (in_market * stakes).T
+        payoff = back_payoff + (market_result - rates * np.maximum(market_result, 0)).sum(axis=1)
+        game_rows.append({"Game": game, "Positions": n_positions, "Unhedged worst case": back_payoff.min(),
+                          "Worst-case profit": payoff.min(), "Best-case profit": payoff.max()})
+        for ((_, market, outcome), price), stake in zip(columns, stakes):
+            if stake > 0:
+                order = {"Game": game, "Market": market, "Outcome": outcome, "Lay odds": price["Price"],
+                         "Lay stake": int(stake), "Liability": stake * (price["Price"] - 1)}
+                for key in ("Market ID", "Selection ID"):
+                    if key in price:
+                        order[key] = price[key]
+                orders.append(order)
+
+    return {"Orders": pd.DataFrame(orders, columns=None if orders else ["Game", "Market", "Outcome", "Lay odds",
+                                                                       "Lay stake", "Liability"]),
+            "Games": pd.DataFrame(game_rows).set_index("Game")}
+
+
+def exchange_lay_odds(betfair_client: "betfairlightweight.apiclient.APIClient", games, date: str,
+                      markets: list = None) -> dict:
+    """
+    Fetches the best lay price and size of every outcome in the supported markets of the given games, in the
+    format of the lay_odds parameter of portfolio_hedges
+
+    :param betfairlightweight.apiclient.APIClient betfair_client: A logged in betfairlightweight.APIClient() session
+    :param games: (home team, away team) pairs in Betfair format
+    :param str date: The date of the games "YYYY-MM-DD"
+    :param list markets: Markets to fetch, all markets supported by outcome_wins by default
+
+    :return: (game "Home v Away", market, outcome) -> {"Price", "Size", "Market ID", "Selection ID"}
+    :rtype: dict
+    """
+    import betfairlightweight
+    from betfairlightweight.filters import market_filter
+
+    date_to = datetime.strftime(datetime.strptime(date, "%Y-%m-%d") + timedelta(days=1), "%Y-%m-%d")
+    runners = {}
+    for home, away in games:
+        game = f"{home} v {away}"
+        with span("betfair.list_market_catalogue"):
+            market_catalogues = betfair_client.betting.list_market_catalogue(
+                filter=market_filter(text_query=game, market_start_time={"from": date, "to": date_to}),
+                market_projection=["RUNNER_DESCRIPTION"],
+                max_results=1000,
+            )
+        for catalogue in market_catalogues:
+            if markets is not None and catalogue.market_name not in markets:
+                continue
+            if markets is None and not (catalogue.market_name in ("Match Odds", "Both teams to Score?") or
+                                        OVER_UNDER.fullmatch(catalogue.market_name)):
+                continue
+            for runner in catalogue.runners:
+                runners[(catalogue.market_id, runner.selection_id)] = (game, catalogue.market_name,
+                                                                       runner.runner_name)
+
+    market_ids = list(dict.fromkeys(market_id for market_id, _ in runners))
+    price_filter = betfairlightweight.filters.price_projection(price_data=["EX_BEST_OFFERS"])
+    lay_odds = {}
+    for i in range(0, len(market_ids), MARKETS_PER_BOOK_REQUEST):
+        with span("betfair.list_market_book"):
+            market_books = betfair_client.betting.list_market_book(
+                market_ids=market_ids[i:i + MARKETS_PER_BOOK_REQUEST], price_projection=price_filter)
+        for market_book in market_books:
+            for runner_book in market_book.runners:
+                key = runners.get((market_book.market_id, runner_book.selection_id))
+                lay_prices = runner_book.ex.available_to_lay
+                if key is None or not lay_prices or runner_book.status != "ACTIVE":
+                    continue
+                lay_odds[key] = {"Price": lay_prices[0].price, "Size": lay_prices[0].size,
+                                 "Market ID": market_book.market_id, "Selection ID": runner_book.selection_id}
+    return lay_odds
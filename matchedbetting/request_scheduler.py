@@ -0,0 +1,352 @@
+import copy
+import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from tracing import span
+
+"""
+REQUEST SCHEDULER FOR THE BETFAIR API
+
+BETFAIR LIMITS THE DATA REQUESTS BY WEIGHT, THE NUMBER OF MARKETS TIMES THE WEIGHT OF THE PRICE PROJECTION, AND A
+REQUEST ABOVE MAX_REQUEST_WEIGHT FAILS WITH TOO_MUCH_DATA. RequestScheduler WRAPS A LOGGED IN CLIENT AND CAN BE PASSED
+ANYWHERE A betfairlightweight.APIClient IS EXPECTED (hedge_bet, AsyncBetfairClient, exchange_lay_odds):
+
+list_market_book    CALLS FROM CONCURRENT THREADS ARRIVING WITHIN batch_window SECONDS ARE MERGED, GROUPED BY THEIR
+                    PROJECTIONS, INTO AS FEW REQUESTS AS THE WEIGHT LIMIT ALLOWS. A MARKET REQUESTED BY SEVERAL CALLERS
+                    IS FETCHED ONCE. A REQUEST STILL FAILING WITH TOO_MUCH_DATA IS SPLIT IN HALVES, THROTTLING ERRORS
+                    ARE RETRIED WITH EXPONENTIAL BACKOFF
+list_runner_book    COALESCED THE SAME WAY AS A list_market_book OF THE MARKET, FILTERED TO THE SELECTION
+list_market_catalogue, list_current_orders
+                    SENT AS THEY ARE, THROTTLING ERRORS ARE RETRIED WITH EXPONENTIAL BACKOFF
+place_orders        WAITS FOR A TOKEN PER INSTRUCTION FROM A TOKEN BUCKET, SO BURSTS ARE SPREAD OUT TO THE ORDER RATE.
+                    THE DEFAULT RATE IS BETFAIR'S TRANSACTION LIMIT, order_rate=TRANSACTION_CHARGE_RATE PACES THE
+                    ORDERS BELOW THE HOURLY TRANSACTION CHARGE INSTEAD (ABOUT 1.4 ORDERS A SECOND AFTER THE BURST,
+                    TOO SLOW FOR CALLERS WAITING ON THEIR HEDGE). ORDERS ARE NEVER RETRIED HERE, A RETRY COULD LAY
+                    THE SAME BET TWICE
+
+EVERYTHING ELSE IS PASSED THROUGH TO THE WRAPPED CLIENT, E.G.
+
+scheduler = RequestScheduler(trading)
+hedge_bet(betfair_client=scheduler, ...)       # From many threads at once
+scheduler.close()
+"""
+
+"""
+INPUT DATA + PARAMETERS
+"""
+# Request weights per market from the Betfair documentation, the sum of the projections counts towards the limit
+PRICE_DATA_WEIGHTS = {"SP_AVAILABLE": 3, "SP_TRADED": 7, "EX_BEST_OFFERS": 5, "EX_ALL_OFFERS": 17, "EX_TRADED": 17}
+# The EX_BEST_OFFERS weight is for this depth, exBestOffersOverrides.bestPricesDepth scales it by depth / 3
+DEFAULT_BEST_PRICES_DEPTH = 3
+# Weight of a market without price data
+MIN_MARKET_WEIGHT = 2
+MAX_REQUEST_WEIGHT = 200
+# Seconds the scheduler waits for more calls to merge into the same request
+BATCH_WINDOW = 0.005
+# Merged requests sent at the same time
+MAX_CONCURRENT_REQUESTS = 8
+# Orders per second and burst size of the order token bucket, Betfair's limit of 1000 transactions per second
+ORDER_RATE = 1000
+ORDER_BURST = 1000
+# Betfair charges for more than 5000 transactions an hour, an opt-in order_rate that stays below the charge
+TRANSACTION_CHARGE_RATE = 5000 / 3600
+THROTTLE_ERROR_CODES = ["TOO_MANY_REQUESTS", "SERVICE_BUSY", "TIMEOUT_ERROR"]
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.1
+
+
+def market_weight(price_projection: dict = None) -> float:
+    """
+    Request weight of one market in list_market_book with the given price projection, the EX_BEST_OFFERS weight
+    multiplied by bestPricesDepth / 3
+    """
+    price_projection = price_projection or {}
+    price_data = price_projection.get("priceData") or []
+    depth = (price_projection.get("exBestOffersOverrides") or {}).get("bestPricesDepth") or DEFAULT_BEST_PRICES_DEPTH
+    weights = {**PRICE_DATA_WEIGHTS,
+               "EX_BEST_OFFERS": PRICE_DATA_WEIGHTS["EX_BEST_OFFERS"] * depth / DEFAULT_BEST_PRICES_DEPTH}
+    return max(sum(weights.get(price, 0) for price in price_data), MIN_MARKET_WEIGHT)
+
+
+def api_error_code(error: Exception) -> str:
+    """
+    Betfair error code of an exception raised by the client, None if there is none
+    """
+    code = getattr(error, "error_code", None)
+    if code:
+        return code
+    message = str(error)
+    for known_code in ["TOO_MUCH_DATA"] + THROTTLE_ERROR_CODES:
+        if known_code in message:
+            return known_code
+    return None
+
+
+def retry_throttled(method, attempts: int = MAX_RETRIES, **kwargs):
+    """
+    Calls method(**kwargs), retrying with exponential backoff while it fails with a throttling error. Only for
+    requests that are safe to repeat
+    """
+    for attempt in range(attempts + 1):
+        try:
+            return method(**kwargs)
+        except Exception as e:
+            if api_error_code(e) not in THROTTLE_ERROR_CODES or attempt == attempts:
+                raise
+            time.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at rate tokens per second up to capacity, acquire blocks until enough tokens are available
+
+    :param float rate: Tokens added per second
+    :param float capacity: Largest number of tokens held, the longest burst allowed without waiting
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1) -> float:
+        """
+        Takes tokens from the bucket, waiting for the refill if needed. More tokens than the capacity are taken as
+        the capacity, so a large order batch waits for a full bucket instead of forever
+
+        :return: Seconds waited
+        :rtype: float
+        """
+        tokens = min(tokens, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class _BookRequest:
+    """
+    A list_market_book call waiting to be merged
+    """
+
+    def __init__(self, market_ids: list, price_projection: dict, kwargs: dict):
+        self.market_ids = [market_id for market_id in market_ids if market_id is not None]
+        self.price_projection = price_projection
+        self.kwargs = kwargs
+        self.key = json.dumps([price_projection, kwargs], sort_keys=True, default=str)
+        self.future = Future()
+
+
+class _Batch:
+    """
+    The merged requests of one projection, resolves the calls once every chunk has returned
+    """
+
+    def __init__(self, requests: list, n_chunks: int):
+        self.requests = requests
+        self.remaining = n_chunks
+        self.books = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def done(self, market_ids: list, books: list = None, error: Exception = None):
+        with self._lock:
+            for book in books or []:
+                self.books[book.market_id] = book
+            if error is not None:
+                self.errors.update(dict.fromkeys(market_ids, error))
+            self.remaining -= 1
+            if self.remaining:
+                return
+        for request in self.requests:
+            error = next((self.errors[market_id] for market_id in request.market_ids if market_id in self.errors),
+                         None)
+            if error is not None:
+                request.future.set_exception(error)
+            else:
+                request.future.set_result([self.books[market_id] for market_id in request.market_ids
+                                           if market_id in self.books])
+
+
+class ScheduledBetting:
+    """
+    The betting endpoints of RequestScheduler, anything not scheduled is passed through to the wrapped client
+    """
+
+    def __init__(self, scheduler: "RequestScheduler"):
+        self.scheduler = scheduler
+
+    def __getattr__(self, name):
+        return getattr(self.scheduler.client.betting, name)
+
+    def list_market_book(self, market_ids: list, price_projection: dict = None, **kwargs) -> list:
+        return self.scheduler.submit(market_ids, price_projection, kwargs).result()
+
+    def list_runner_book(self, market_id: str, selection_id: int, price_projection: dict = None, **kwargs) -> list:
+        books = []
+        for market_book in self.scheduler.submit([market_id], price_projection, kwargs).result():
+            runner_book = copy.copy(market_book)
+            runner_book.runners = [runner for runner in market_book.runners
+                                   if runner.selection_id == int(selection_id)]
+            books.append(runner_book)
+        return books
+
+    def list_market_catalogue(self, **kwargs) -> list:
+        return retry_throttled(self.scheduler.client.betting.list_market_catalogue, **kwargs)
+
+    def list_current_orders(self, **kwargs):
+        return retry_throttled(self.scheduler.client.betting.list_current_orders, **kwargs)
+
+    def place_orders(self, market_id: str, instructions: list, **kwargs):
+        self.scheduler.order_bucket.acquire(max(len(instructions), 1))
+        return self.scheduler.client.betting.place_orders(market_id=market_id, instructions=instructions, **kwargs)
+
+
+class RequestScheduler:
+    """
+    Wraps a logged in client, merging concurrent market book requests within the weight limit and pacing the orders
+
+    :param betfair_client: A logged in betfairlightweight.APIClient() session, or fake_betfair.FakeAPIClient
+    :param int max_weight: Weight limit of one request
+    :param float batch_window: Seconds calls are collected before they are sent
+    :param int max_concurrent_requests: Merged requests in flight at the same time
+    :param float order_rate: Orders per second allowed by the token bucket, TRANSACTION_CHARGE_RATE to avoid the
+                             transaction charge
+    :param float order_burst: Orders that can be sent at once before the rate applies
+    """
+
+    def __init__(self, betfair_client, max_weight: int = MAX_REQUEST_WEIGHT, batch_window: float = BATCH_WINDOW,
+                 max_concurrent_requests: int = MAX_CONCURRENT_REQUESTS, order_rate: float = ORDER_RATE,
+                 order_burst: float = ORDER_BURST):
+        self.client = betfair_client
+        self.betting = ScheduledBetting(self)
+        self.max_weight = max_weight
+        self.batch_window = batch_window
+        self.order_bucket = TokenBucket(order_rate, order_burst)
+        self.requests_sent = 0
+        self._requests_sent_lock = threading.Lock()
+        self.calls_received = 0
+        self._pending = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_requests, thread_name_prefix="betfair-batch")
+        self._thread = threading.Thread(target=self._dispatch_loop, name="betfair-scheduler", daemon=True)
+        self._thread.start()
+
+    def __getattr__(self, name):
+        if name == "client":
+            raise AttributeError(name)
+        return getattr(self.client, name)
+
+    @property
+    def session(self):
+        return self.client.session
+
+    @session.setter
+    def session(self, session):
+        # AsyncBetfairClient replaces the transport of the wrapped client
+        self.client.session = session
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Sends the calls still waiting and stops the dispatcher
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    def submit(self, market_ids: list, price_projection: dict = None, kwargs: dict = None) -> Future:
+        """
+        Queues a list_market_book call to be merged with the other calls of the batch window
+
+        :return: Future of the market books of market_ids, in the order of market_ids
+        :rtype: Future
+        """
+        request = _BookRequest(market_ids, price_projection, kwargs or {})
+        if not request.market_ids:
+            request.future.set_result([])
+            return request.future
+        with self._condition:
+            if self._closed:
+                raise Exception("The request scheduler is closed")
+            self._pending.append(request)
+            self.calls_received += 1
+            self._condition.notify()
+        return request.future
+
+    def _dispatch_loop(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                # Collects calls until the window ends or a full request is waiting
+                deadline = time.monotonic() + self.batch_window
+                while not self._closed and sum(len(request.market_ids) * market_weight(request.price_projection)
+                                               for request in self._pending) < self.max_weight:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                pending, self._pending = self._pending, []
+            self._dispatch(pending)
+
+    def _dispatch(self, requests: list):
+        groups = {}
+        for request in requests:
+            groups.setdefault(request.key, []).append(request)
+        for group in groups.values():
+            price_projection, kwargs = group[0].price_projection, group[0].kwargs
+            market_ids = list(dict.fromkeys(market_id for request in group for market_id in request.market_ids))
+            markets_per_request = max(int(self.max_weight // market_weight(price_projection)), 1)
+            chunks = [market_ids[i:i + markets_per_request] for i in range(0, len(market_ids), markets_per_request)]
+            batch = _Batch(group, len(chunks))
+            for chunk in chunks:
+                self._executor.submit(self._fetch_chunk, batch, chunk, price_projection, kwargs)
+
+    def _fetch_chunk(self, batch: _Batch, market_ids: list, price_projection: dict, kwargs: dict):
+        try:
+            books = self._list_market_book(market_ids, price_projection, kwargs)
+        except Exception as e:
+            batch.done(market_ids, error=e)
+        else:
+            batch.done(market_ids, books=books)
+
+    def _send_market_book(self, market_ids: list, price_projection: dict, kwargs: dict) -> list:
+        with self._requests_sent_lock:
+            self.requests_sent += 1
+        with span("scheduler.list_market_book"):
+            return self.client.betting.list_market_book(market_ids=market_ids, price_projection=price_projection,
+                                                        **kwargs)
+
+    def _list_market_book(self, market_ids: list, price_projection: dict, kwargs: dict) -> list:
+        try:
+            return retry_throttled(self._send_market_book, market_ids=market_ids, price_projection=price_projection,
+                                   kwargs=kwargs)
+        except Exception as e:
+            if api_error_code(e) == "TOO_MUCH_DATA" and len(market_ids) > 1:
+                half = len(market_ids) // 2
+                return (self._list_market_book(market_ids[:half], price_projection, kwargs) +
+                        self._list_market_book(market_ids[half:], price_projection, kwargs))
+            raise
@@ -0,0 +1,168 @@
+import numpy as np
+import pandas as pd
+
+from finishing_probabilities import win_probabilities
+
+"""
+VALUE OF STRECKSPEL (V75, V86, GS75, V64, V65, V5, V4) SYSTEMS
+
+COMBINES THE WIN PROBABILITIES FROM THE WIN ODDS WITH THE STRECK PERCENTAGES (betDistribution) OF EVERY LEG, AS
+SCRAPED BY scraping.atg_api_scraper. THE SHARE OF THE POOL BET ON A ROW IS APPROXIMATED BY THE PRODUCT OF THE STRECK
+SHARES OF ITS HORSES, SO THE EXPECTED RETURN PER KRONA ON A ROW IS
+
+    payout_rate * PRODUCT OVER THE LEGS OF (win probability / streck share)
+
+AND EVERYTHING FACTORISES OVER THE LEGS: A SYSTEM IS VALUED FROM THE SUMS PER LEG, AND THE BEST ROWS ARE FOUND BY
+ENUMERATING THE ROWS IN NUMPY CHUNKS WITHOUT CREATING A PYTHON OBJECT PER ROW, E.G.
+
+avdelningar = atg_api_scraper("2022-05-28", "5", "V75", 1, 7, 5)
+horse_values(avdelningar, "V75")
+top_rows(avdelningar, "V75", k=50)
+system_value(avdelningar, "V75", [["Bird Parker"], ["Power", "Hail Mary"], ...])
+"""
+
+# Share of the pool paid back to the players. Only part of it goes to the top tier (e.g. 7 rätt),
+# pass that share as payout_rate to value the top tier only
+PAYOUT_RATE = 0.65
+# Streck shares below this value are raised to it, so that an unbacked horse does not get an infinite value
+MIN_STRECK_SHARE = 0.0001
+# Number of rows scored per numpy operation in top_rows
+CHUNK_SIZE = 2 ** 20
+
+
+def leg_arrays(lopp_df: pd.DataFrame, spelform: str) -> tuple:
+    """
+    Win probabilities and streck shares of one leg
+
+    :param pd.DataFrame lopp_df: One leg from atg_api_scraper, columns [Häst, {spelform}-procent, VOdds, POdds]
+    :param str spelform: E.g. "V75"
+
+    :return: (win probabilities, streck shares), both summing to 1 over the running horses
+    :rtype: tuple
+    """
+    probabilities = win_probabilities(lopp_df["VOdds"])
+    streck = lopp_df[f"{spelform}-procent"].to_numpy(dtype=float) / 100
+    streck = np.where(probabilities > 0, np.maximum(np.nan_to_num(streck), MIN_STRECK_SHARE), 0)
+    return probabilities, streck
+
+
+def horse_values(avdelningar: list, spelform: str, payout_rate: float = PAYOUT_RATE) -> pd.DataFrame:
+    """
+    Value per horse, payout_rate * win probability / streck share. A value above payout_rate means the horse is
+    understrecked relative to its odds
+
+    :param list avdelningar: Dataframes per leg from atg_api_scraper
+    :param str spelform: E.g. "V75"
+    :param float payout_rate: Share of the pool paid back
+
+    :return: Dataframe with columns [Avd, Häst, Sannolikhet, Streck, Värde] sorted by Värde
+    :rtype: pd.DataFrame
+    """
+    frames = []
+    for avd, lopp_df in enumerate(avdelningar, start=1):
+        probabilities, streck = leg_arrays(lopp_df, spelform)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            value = np.where(streck > 0, payout_rate * probabilities / streck, 0)
+        frames.append(pd.DataFrame({"Avd": avd, "Häst": lopp_df["Häst"].to_numpy(), "Sannolikhet": probabilities,
+                                    "Streck": streck, "Värde": value}))
+    return pd.concat(frames, ignore_index=True).sort_values("Värde", ascending=False, ignore_index=True)
+
+
+def system_value(avdelningar: list, spelform: str, system: list, payout_rate: float = PAYOUT_RATE,
+                 row_price: float = 0.5) -> dict:
+    """
+    Values a system, i.e. a selection of horses per leg, from the sums per leg without enumerating its rows
+
+    :param list avdelningar: Dataframes per leg from atg_api_scraper
+    :param str spelform: E.g. "V75"
+    :param list system: One list of horse names (or row positions in the leg's dataframe) per leg
+    :param float payout_rate: Share of the pool paid back
+    :param float row_price: Price per row in kronor, 0.5 for V75
+
+    :return: {"Rader", "Kostnad", "Sannolikhet" (probability that the system contains the winning row),
+              "Förväntad avkastning" (expected return per staked krona)}
+    :rtype: dict
+    """
+    assert len(system) == len(avdelningar), "The system must have one selection per leg"
+    rows = 1
+    hit_probability = 1.0
+    value_sum_product = 1.0
+    for lopp_df, selection in zip(avdelningar, system):
+        probabilities, streck = leg_arrays(lopp_df, spelform)
+        names = list(lopp_df["Häst"])
+        index = [names.index(horse) if isinstance(horse, str) else horse for horse in selection]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            values = np.where(streck > 0, probabilities / streck, 0)
+        rows *= len(index)
+        hit_probability *= probabilities[index].sum()
+        value_sum_product *= values[index].sum()
+    return {"Rader": rows, "Kostnad": rows * row_price, "Sannolikhet": hit_probability,
+            "Förväntad avkastning": payout_rate * value_sum_product / rows}
+
+
+def top_rows(avdelningar: list, spelform: str, k: int = 100, payout_rate: float = PAYOUT_RATE,
+             chunk_size: int = CHUNK_SIZE) -> pd.DataFrame:
+    """
+    Finds the k rows with the highest expected return. The rows are scored in chunks of at most chunk_size with
+    numpy, keeping only the best k of every chunk (np.argpartition), so a V75 with millions of rows never holds
+    more than one chunk in memory
+
+    :param list avdelningar: Dataframes per leg from atg_api_scraper
+    :param str spelform: E.g. "V75"
+    :param int k: Number of rows to return
+    :param float payout_rate: Share of the pool paid back
+    :param int chunk_size: Maximum number of rows scored at once
+
+    :return: Dataframe with one column per leg (Avd 1, Avd 2, ...) holding the horse names, and the columns
+             [Förväntad avkastning, Sannolikhet, Streck] (the row's expected return per krona, probability and
+             share of the pool), sorted by Förväntad avkastning
+    :rtype: pd.DataFrame
+    """
+    legs = [leg_arrays(lopp_df, spelform) for lopp_df in avdelningar]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_values = [np.where(streck > 0, np.log(probabilities) - np.log(streck), -np.inf)
+                      for probabilities, streck in legs]
+    shape = tuple(len(values) for values in log_values)
+
+    # The last legs, as many as fit in a chunk, form the inner block scored with broadcasting. The rows of the
+    # first legs are enumerated in batches. Row indices are flat C-order indices over shape.
+    n_inner = len(shape) - 1
+    while n_inner > 0 and np.prod(shape[n_inner - 1:]) <= chunk_size:
+        n_inner -= 1
+
+    def block_scores(legs_values: list) -> np.ndarray:
+        scores = np.zeros(1)
+        for values in legs_values:
+            scores = (scores[:, None] + values[None, :]).ravel()
+        return scores
+
+    outer = block_scores(log_values[:n_inner])
+    inner = block_scores(log_values[n_inner:])
+    batch = max(1, chunk_size // len(inner))
+
+    best_index = np.empty(0, dtype=np.int64)
+    best_score = np.empty(0)
+    for start in range(0, len(outer), batch):
+        scores = (outer[start:start + batch, None] + inner[None, :]).ravel()
+        if len(scores) > k:
+            keep = np.argpartition(-scores, k)[:k]
+        else:
+            keep = np.arange(len(scores))
+        candidate_index = np.concatenate([best_index, start * len(inner) + keep.astype(np.int64)])
+        candidate_score = np.concatenate([best_score, scores[keep]])
+        if len(candidate_score) > k:
+            keep = np.argpartition(-candidate_score, k)[:k]
+            candidate_index, candidate_score = candidate_index[keep], candidate_score[keep]
+        best_index, best_score = candidate_index, candidate_score
+
+    order = np.argsort(-best_score)
+    best_index, best_score = best_index[order], best_score[order]
+    horse_index = np.unravel_index(best_index, shape)
+
+    result = pd.DataFrame({f"Avd {avd}": lopp_df["Häst"].to_numpy()[horse_index[avd - 1]]
+                           for avd, lopp_df in enumerate(avdelningar, start=1)})
+    result["Förväntad avkastning"] = payout_rate * np.exp(best_score)
+    result["Sannolikhet"] = np.prod([probabilities[index] for (probabilities, _), index in zip(legs, horse_index)],
+                                    axis=0)
+    result["Streck"] = np.prod([streck[index] for (_, streck), index in zip(legs, horse_index)], axis=0)
+    return result
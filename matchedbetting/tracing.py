@@ -0,0 +1,161 @@
+import functools
+import json
+import math
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+"""
+LIGHTWEIGHT LATENCY TRACING FOR EXTERNAL CALLS
+
+WRAP ANY CALL IN A SPAN AND ITS DURATION (time.perf_counter, MONOTONIC) IS RECORDED IN A PER-NAME HISTOGRAM
+
+    with span("betfair.list_market_book"):
+        betfair_client.betting.list_market_book(market_ids=[market_id])
+
+    @traced("atg.get")
+    def fetch(url): ...
+
+THE COLLECTED TIMINGS ARE EXPORTED WITH prometheus_text() OR json_summary()
+"""
+
+# Upper bounds in seconds, chosen to resolve both sub 100 ms API calls and multi-second page loads
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Number of recent samples per name kept for the quantiles in json_summary
+RESERVOIR_SIZE = 10000
+
+
+class Histogram:
+    """
+    Latency histogram for one call name. Keeps cumulative bucket counts for the Prometheus export and
+    the most recent RESERVOIR_SIZE samples for quantiles.
+    """
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)  # The last bucket is +Inf
+        self.count = 0
+        self.errors = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=RESERVOIR_SIZE)
+
+    def observe(self, seconds: float, error: bool = False):
+        self.bucket_counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.errors += error
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+
+    def quantile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        # Nearest-rank quantile
+        return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+_histograms = {}
+_lock = threading.Lock()
+
+
+def record(name: str, seconds: float, error: bool = False):
+    """
+    Adds a measurement for name, creating its histogram on first use
+    """
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(seconds, error)
+
+
+@contextmanager
+def span(name: str):
+    """
+    Times the enclosed block and records it under name. Exceptions are counted as errors and re-raised.
+
+    :param str name: Call name, e.g. "betfair.place_orders" or "selenium.get"
+    """
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        record(name, time.perf_counter() - start, error)
+
+
+def traced(name: str = None):
+    """
+    Decorator version of span, uses module.function as name if none is given
+    """
+
+    def decorator(func):
+        span_name = name or f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+def json_summary() -> dict:
+    """
+    Summarises every traced call
+
+    :return: {name: {"count", "errors", "mean", "p50", "p90", "p99", "max"}} with times in seconds
+    :rtype: dict
+    """
+    with _lock:
+        return {name: {"count": h.count, "errors": h.errors,
+                       "mean": h.sum / h.count if h.count else 0.0,
+                       "p50": h.quantile(0.5), "p90": h.quantile(0.9), "p99": h.quantile(0.99), "max": h.max}
+                for name, h in sorted(_histograms.items())}
+
+
+def prometheus_text(metric: str = "external_call_duration_seconds") -> str:
+    """
+    Exports the histograms in the Prometheus text exposition format
+
+    :param str metric: Metric name, the call name is exported as the label "call"
+
+    :rtype: str
+    """
+    lines = [f"# HELP {metric} Duration of external calls in seconds",
+             f"# TYPE {metric} histogram"]
+    error_lines = [f"# HELP {metric}_errors_total External calls raising an exception",
+                   f"# TYPE {metric}_errors_total counter"]
+    with _lock:
+        for name, h in sorted(_histograms.items()):
+            label = name.replace("\\", "\\\\").replace('"', '\\"')
+            cumulative = 0
+            for bound, count in zip(h.buckets + ("+Inf",), h.bucket_counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{call="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{call="{label}"}} {h.sum}')
+            lines.append(f'{metric}_count{{call="{label}"}} {h.count}')
+            error_lines.append(f'{metric}_errors_total{{call="{label}"}} {h.errors}')
+    return "\n".join(lines + error_lines) + "\n"
+
+
+def write_summary(path: str):
+    """
+    Writes json_summary() to path
+    """
+    with open(path, "w") as f:
+        json.dump(json_summary(), f, indent=2)
@@ -0,0 +1,234 @@
+"""
+KÖR SAMTLIGA SKRAPARE FÖR EN TÄVLINGSDAG PARALLELLT OCH SLÅR IHOP RESULTATEN TILL EN ODDSMATRIS
+
+SELENIUM-SKRAPARNA KÖRS I EGNA PROCESSER (EN CHROME-INSTANS PER KÄLLA), API- OCH WEBSOCKET-SKRAPARNA KÖRS I TRÅDAR
+UNDER ASYNCIO. VARJE KÄLLA HAR EN EGEN TIDSGRÄNS, EN KÄLLA SOM INTE HINNER KLART STOPPAS OCH SAKNAS I MATRISEN.
+KÄLLORNA ANGES MED SAMMA PARAMETRAR SOM RESPEKTIVE SKRAPFUNKTION I scraping.py, E.G.
+
+matris, status = skrapa_tävlingsdag({
+    "atg": {"datum": "2022-05-31", "bankod": "5", "spelform": "V&P", "start_avd": 1, "slut_avd": 8},
+    "bet365": {"bana": "Solvalla", "från_lopp": 1, "till_lopp": 8, "veckodag": "Tisdag"},
+    "unibet": {"bana": "Solvalla", "från_lopp": 1, "till_lopp": 8},
+    "svenskaspel_ws": {"uri": SS_URI, "id_list": ss_getids(SS_URI, "Solvalla", 1, 8), "marknader": ["Vinnare", "Topp 3"],
+                       "första_lopp": 1},
+})
+
+SKRAPAS H2H-ODDS (H2H=True FÖR svenskaspel) HÄMTAS MATCHUPERNA MED matchuper=True, SOM EN TABELL MED EN RAD PER
+MATCHUP OCH KÄLLA, E.G.
+
+matris, status, matchuper = skrapa_tävlingsdag({"svenskaspel": {..., "H2H": True}}, matchuper=True)
+
+SELENIUM-KÄLLORNA STARTAS I NYA PROCESSER, ANROPA DÄRFÖR FRÅN ETT SKRIPT UNDER if __name__ == "__main__":
+"""
+
+import asyncio
+import multiprocessing
+import re
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+import scraping
+
+"""
+INPUT DATA + PARAMETERS
+"""
+# Källa -> skrapfunktion i scraping.py
+SELENIUM_SKRAPARE = {
+    "atg_selenium": "atg_selenium_scraper_VP",
+    "bet365": "bet365_scraper",
+    "svenskaspel": "svenskaspel_scraper",
+    "betsson": "betsson_scraper",
+    "unibet": "unibet_scraper",
+}
+API_SKRAPARE = {
+    "atg": "atg_api_scraper",
+    "svenskaspel_ws": "ss_ws_scraper",
+}
+# Sekunder varje källa får ta innan den avbryts
+TIDSGRÄNSER = {
+    "atg": 15,
+    "svenskaspel_ws": 30,
+    "atg_selenium": 120,
+    "bet365": 120,
+    "svenskaspel": 120,
+    "betsson": 90,
+    "unibet": 90,
+}
+STANDARD_TIDSGRÄNS = 60
+
+
+def normalisera_hästnamn(namn: str) -> str:
+    """
+    Gör hästnamn från olika källor jämförbara: startnummer i början, landskod inom parentes, accenter,
+    skiljetecken och skiftläge tas bort, t.ex. "3 Don Fanucci Zet (SE)" -> "don fanucci zet"
+    """
+    namn = unicodedata.normalize("NFKD", str(namn))
+    namn = "".join(tecken for tecken in namn if not unicodedata.combining(tecken))
+    namn = re.sub(r"^\s*\d+\s*[.:-]?\s+", "", namn)
+    namn = re.sub(r"\([A-Za-z]{2,3}\)", "", namn)
+    namn = re.sub(r"[^\w\s]", "", namn)
+    return " ".join(namn.lower().split())
+
+
+def _första_lopp(kwargs: dict) -> int:
+    # Skrapfunktionerna returnerar en dataframe per lopp i ordning från första loppet
+    return kwargs.get("första_lopp", kwargs.get("från_lopp", kwargs.get("start_avd", 1)))
+
+
+def _skrapar_argument(kwargs: dict) -> dict:
+    return {nyckel: värde for nyckel, värde in kwargs.items() if nyckel != "första_lopp"}
+
+
+def _kör_selenium_skrapare(funktionsnamn: str, kwargs: dict, anslutning):
+    # Körs i en egen process, resultatet skickas tillbaka som ("ok", lista av dataframes) eller ("fel", meddelande)
+    try:
+        anslutning.send(("ok", getattr(scraping, funktionsnamn)(**kwargs)))
+    except Exception as e:
+        anslutning.send(("fel", f"{type(e)} - {e}"))
+    finally:
+        anslutning.close()
+
+
+def _vänta_på_process(process, anslutning, tidsgräns: float):
+    # Blockerande, körs i en tråd. Processen avslutas om den inte svarat inom tidsgränsen
+    try:
+        if anslutning.poll(tidsgräns):
+            return anslutning.recv()
+        return ("timeout", f"Ingen data inom {tidsgräns} s")
+    except EOFError:
+        return ("fel", f"Processen avslutades med kod {process.exitcode}")
+    finally:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+
+
+async def _skrapa_källa(källa: str, kwargs: dict, tidsgräns: float, trådpool: ThreadPoolExecutor) -> dict:
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    tidpunkt = datetime.now()
+
+    if källa in SELENIUM_SKRAPARE:
+        läs, skriv = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=_kör_selenium_skrapare, name=f"skrapare-{källa}",
+                                          args=(SELENIUM_SKRAPARE[källa], _skrapar_argument(kwargs), skriv))
+        process.start()
+        skriv.close()
+        status, resultat = await loop.run_in_executor(trådpool, _vänta_på_process, process, läs, tidsgräns)
+    else:
+        funktion = getattr(scraping, API_SKRAPARE[källa])
+        try:
+            # ss_ws_scraper startar en egen event loop med asyncio.run, därför körs även API-skraparna i trådar
+            resultat = await asyncio.wait_for(
+                loop.run_in_executor(trådpool, lambda: funktion(**_skrapar_argument(kwargs))), tidsgräns)
+            status = "ok"
+        except asyncio.TimeoutError:
+            status, resultat = "timeout", f"Ingen data inom {tidsgräns} s"
+        except Exception as e:
+            status, resultat = "fel", f"{type(e)} - {e}"
+
+    matchuper = None
+    if status == "ok" and isinstance(resultat, tuple):
+        # Med H2H returnerar skraparna (lista av dataframes, matchup_tabell)
+        resultat, matchuper = resultat
+    if status == "ok" and not resultat:
+        # Skraparna skriver ut sina fel och returnerar None
+        status, resultat = "fel", "Skraparen returnerade ingen data"
+    return {"Källa": källa, "Status": status, "Tidpunkt": tidpunkt,
+            "Sekunder": round(time.perf_counter() - start, 2),
+            "Resultat": resultat if status == "ok" else None,
+            "Matchuper": matchuper if status == "ok" else None,
+            "Meddelande": None if status == "ok" else resultat}
+
+
+def _sammanfoga(resultat: list, källor: dict) -> pd.DataFrame:
+    rader = []
+    for källresultat in resultat:
+        if källresultat["Status"] != "ok":
+            continue
+        första_lopp = _första_lopp(källor[källresultat["Källa"]])
+        for i, lopp_df in enumerate(källresultat["Resultat"]):
+            if lopp_df is None or lopp_df.empty:
+                continue
+            lopp_df = lopp_df[["Häst", "VOdds", "POdds"]]
+            rader.append(pd.DataFrame({"Lopp": första_lopp + i,
+                                       "Häst": lopp_df["Häst"].map(normalisera_hästnamn),
+                                       "Källa": källresultat["Källa"],
+                                       "VOdds": pd.to_numeric(lopp_df["VOdds"], errors="coerce"),
+                                       "POdds": pd.to_numeric(lopp_df["POdds"], errors="coerce")}))
+    if not rader:
+        return pd.DataFrame()
+
+    lång = pd.concat(rader, ignore_index=True)
+    matris = lång.pivot_table(index=["Lopp", "Häst"], columns="Källa", values=["VOdds", "POdds"], aggfunc="first")
+    matris.columns = [f"{källa} {fält}" for fält, källa in matris.columns]
+    # Kolumnerna ordnas som källorna angavs: "atg VOdds", "atg POdds", "bet365 VOdds", ...
+    return matris[[f"{källa} {fält}" for källa in dict.fromkeys(lång["Källa"]) for fält in ["VOdds", "POdds"]]]
+
+
+def _sammanfoga_matchuper(resultat: list) -> pd.DataFrame:
+    tabeller = []
+    for källresultat in resultat:
+        matchuper = källresultat.get("Matchuper")
+        if matchuper is None or matchuper.empty:
+            continue
+        matchuper = matchuper.copy()
+        # Hästnamnen normaliseras som i oddsmatrisen så att matchuperna kan kopplas till den
+        for kolumn in ["Häst A", "Häst B", "Häst C"]:
+            matchuper[kolumn] = matchuper[kolumn].map(normalisera_hästnamn, na_action="ignore")
+        matchuper.insert(0, "Källa", källresultat["Källa"])
+        tabeller.append(matchuper)
+    if not tabeller:
+        return pd.DataFrame(columns=["Källa"] + scraping.MATCHUP_KOLUMNER)
+    return pd.concat(tabeller, ignore_index=True)
+
+
+async def skrapa_tävlingsdag_async(källor: dict, tidsgränser: dict = None, matchuper: bool = False) -> tuple:
+    """
+    Asynkron version av skrapa_tävlingsdag
+    """
+    okända = set(källor) - set(SELENIUM_SKRAPARE) - set(API_SKRAPARE)
+    assert not okända, f"Okända källor {okända}, välj bland {list(SELENIUM_SKRAPARE) + list(API_SKRAPARE)}"
+    tidsgränser = {**TIDSGRÄNSER, **(tidsgränser or {})}
+
+    trådpool = ThreadPoolExecutor(max_workers=len(källor), thread_name_prefix="skrapare")
+    try:
+        resultat = await asyncio.gather(
+            *(_skrapa_källa(källa, kwargs, tidsgränser.get(källa, STANDARD_TIDSGRÄNS), trådpool)
+              for källa, kwargs in källor.items()))
+    finally:
+        # Trådar för API-källor som överskridit tidsgränsen väntas inte in
+        trådpool.shutdown(wait=False, cancel_futures=True)
+
+    status = pd.DataFrame([{nyckel: värde for nyckel, värde in källresultat.items()
+                            if nyckel not in ("Resultat", "Matchuper")}
+                           for källresultat in resultat]).set_index("Källa")
+    if matchuper:
+        return _sammanfoga(resultat, källor), status, _sammanfoga_matchuper(resultat)
+    return _sammanfoga(resultat, källor), status
+
+
+def skrapa_tävlingsdag(källor: dict, tidsgränser: dict = None, matchuper: bool = False) -> tuple:
+    """
+    Kör skraparna för samtliga källor samtidigt och slår ihop vinnar- och platsoddsen per lopp och häst.
+
+    Observera att en Selenium-källa som avbryts kan lämna en Chrome-instans öppen.
+
+    :param: dict källor: Källa -> parametrar till skrapfunktionen, källorna är nycklarna i SELENIUM_SKRAPARE och
+            API_SKRAPARE. Loppnumret för första dataframen tas från från_lopp/start_avd, alternativt anges det
+            med nyckeln första_lopp (krävs för svenskaspel_ws)
+    :param: dict tidsgränser: Källa -> sekunder, ersätter värdena i TIDSGRÄNSER
+    :param: bool matchuper: Returnerar även H2H-oddsen från källor som skrapats med H2H=True
+
+    :return: (oddsmatris med index [Lopp, Häst] och kolumnerna "{källa} VOdds", "{källa} POdds",
+             status per källa med kolumnerna [Status, Tidpunkt, Sekunder, Meddelande] där Tidpunkt är när
+             skrapningen av källan startade)
+             Med matchuper=True även en tredje dataframe med kolumnerna ["Källa"] + scraping.MATCHUP_KOLUMNER,
+             en rad per matchup och källa med normaliserade hästnamn
+    :rtype: tuple
+    """
+    return asyncio.run(skrapa_tävlingsdag_async(källor, tidsgränser, matchuper))
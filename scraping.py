@@ -5,11 +5,237 @@ THIS FILE CONSISTS OF SCRAPERS RELEVANT FOR SWEDISH HORSE RACING
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 import time
+import json
+import threading
+from collections import namedtuple
+from datetime import date, timedelta
+from urllib.parse import urlsplit
+import numpy as np
 import pandas as pd
 import requests
 import asyncio
+import os
+import sys
 import websockets
 
+# Modulerna i matchedbetting importerar varandra som toppnivåmoduler (from tracing import ...). Samma sökväg används
+# här, annars blir matchedbetting.tracing och tracing två olika moduler med var sitt register av latenser
+MATCHEDBETTING_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "matchedbetting")
+if MATCHEDBETTING_DIR not in sys.path:
+    sys.path.insert(0, MATCHEDBETTING_DIR)
+from tracing import span  # noqa: E402
+
+# Delad HTTP-session så att anslutningar till API:erna återanvänds mellan anropen
+http_session = requests.Session()
+
+ATG_API = "https://www.atg.se/services/racinginfo/v1/api"
+# Hur länge (sekunder) ett svar från ATG återanvänds utan att fråga servern. Speldata (/games/) innehåller
+# odds och streckprocent som rör sig hela tiden, kalender och lopp (startlistor) ändras sällan under dagen.
+ATG_TTL_ODDS = 10
+ATG_TTL_STARTLISTOR = 6 * 60 * 60
+ATG_CACHE_MAX = 2000
+# Högsta antal anrop per sekund och värd i atg_card_fetcher, värdar som saknas begränsas till ATG_STANDARD_PER_SEKUND
+ATG_MAX_PER_SEKUND = {"www.atg.se": 10}
+ATG_STANDARD_PER_SEKUND = 5
+
+# Rubriken på marknadsfliken för H2H i Svenska Spels lopp-vy
+SVENSKASPEL_H2H_FLIK = "H2H"
+
+# url -> {"json", "etag", "last_modified", "hämtad"}
+_atg_cache = {}
+_atg_cache_lock = threading.Lock()
+
+
+def atg_get_json(url: str, ttl: float = None) -> dict:
+    """
+    Hämtar JSON från ATG's racinginfo-API genom en cache nycklad på url. Inom ttl sekunder returneras det sparade
+    svaret direkt, därefter görs en villkorad GET (If-None-Match/If-Modified-Since) så att ett 304-svar utan
+    innehåll räcker om inget ändrats sedan förra hämtningen.
+
+    Observera att samma dict returneras till alla anropare, den får alltså inte modifieras.
+
+    :param: str url: Url under ATG_API
+    :param: float ttl: Antal sekunder svaret får återanvändas, som standard ATG_TTL_ODDS för speldata och
+            ATG_TTL_STARTLISTOR för övriga endpoints
+
+    :rtype: dict
+    """
+    if ttl is None:
+        ttl = ATG_TTL_ODDS if "/games/" in url else ATG_TTL_STARTLISTOR
+
+    with _atg_cache_lock:
+        post = _atg_cache.get(url)
+    nu = time.monotonic()
+    if post is not None and nu - post["hämtad"] < ttl:
+        return post["json"]
+
+    headers = {}
+    if post is not None:
+        if post["etag"]:
+            headers["If-None-Match"] = post["etag"]
+        if post["last_modified"]:
+            headers["If-Modified-Since"] = post["last_modified"]
+
+    with span("atg.get"):
+        response = http_session.get(url, headers=headers, timeout=10)
+
+    if response.status_code == 304 and post is not None:
+        post["hämtad"] = nu
+        return post["json"]
+
+    response.raise_for_status()
+    data = response.json()
+    with _atg_cache_lock:
+        _atg_cache.pop(url, None)
+        _atg_cache[url] = {"json": data, "etag": response.headers.get("ETag"),
+                           "last_modified": response.headers.get("Last-Modified"), "hämtad": nu}
+        # Dicten håller insättningsordning, den äldsta posten kastas först
+        while len(_atg_cache) > ATG_CACHE_MAX:
+            _atg_cache.pop(next(iter(_atg_cache)))
+    return data
+
+
+def atg_cache_clear():
+    with _atg_cache_lock:
+        _atg_cache.clear()
+
+
+def selenium_get(driver, url: str, källa: str):
+    """
+    Laddar en sida i Selenium och tidsmäter sidladdningen under namnet selenium.{källa}.get
+
+    :param: webdriver.Chrome driver: Aktiv Selenium-session
+    :param: str url: Sidan som ska laddas
+    :param: str källa: Spelbolag/sida, t.ex. "atg" eller "bet365"
+    """
+    with span(f"selenium.{källa}.get"):
+        driver.get(url)
+
+
+# Körs i webbläsaren av dom_extrahera, argumenten är rad-selektorn, kolumnerna och rubrik-selektorn
+_DOM_EXTRAKTION_JS = """
+const [radSelektor, kolumner, rubrikSelektor] = arguments;
+const text = (element) => (element.innerText || element.textContent || "").trim();
+return JSON.stringify(Array.from(document.querySelectorAll(radSelektor), (rad) => {
+    const resultat = {};
+    for (const [namn, selektor] of Object.entries(kolumner)) {
+        resultat[namn] = Array.from(rad.querySelectorAll(selektor), text);
+    }
+    if (rubrikSelektor) {
+        const sektion = rad.closest(rubrikSelektor);
+        resultat["Rubrik"] = sektion ? text(sektion).split("\\n")[0] : "";
+    }
+    return resultat;
+}));
+"""
+
+
+def dom_extrahera(driver, rad_selektor: str, kolumner: dict, rubrik_selektor: str = None) -> list:
+    """
+    Hämtar texten i alla rader på sidan med ett enda execute_script istället för ett WebDriver-anrop per element.
+    Anropet tidsmäts under namnet selenium.execute_script.
+
+    Exempel: dom_extrahera(driver, ".runner", {"Häst": ".name", "VOdds": ".odds.fixed.win"})
+             -> [{"Häst": ["Bird Parker"], "VOdds": ["5.40"]}, ...]
+
+    :param: webdriver.Chrome driver: Aktiv Selenium-session, i den frame som ska läsas
+    :param: str rad_selektor: CSS-selektor för raderna, t.ex. ett element per häst. ":root" ger hela sidan som en rad
+    :param: dict kolumner: Kolumnnamn -> CSS-selektor som söks inom varje rad
+    :param: str rubrik_selektor: Om angiven får varje rad även nyckeln "Rubrik", första textraden i närmaste
+            omslutande element som matchar selektorn, t.ex. marknadens rubrik
+
+    :return: En dict per rad med en lista av texter (i dokumentordning) per kolumn
+    :rtype: list of dicts
+    """
+    with span("selenium.execute_script"):
+        return json.loads(driver.execute_script(_DOM_EXTRAKTION_JS, rad_selektor, kolumner, rubrik_selektor))
+
+
+def klicka_flik(driver, klass: str, text: str) -> bool:
+    """
+    Klickar på det första elementet med klassen klass vars text är text, t.ex. en marknadsflik
+
+    :return: True om fliken hittades
+    :rtype: bool
+    """
+    for flik in driver.find_elements(By.CLASS_NAME, klass):
+        if flik.text == text:
+            flik.click()
+            return True
+    return False
+
+
+# Gemensam modell för H2H- och H3H-odds från alla spelbolag, Häst C och Odds C är tomma för H2H
+MATCHUP_KOLUMNER = ["Lopp", "Häst A", "Häst B", "Häst C", "Odds A", "Odds B", "Odds C"]
+
+
+def matchup_rad(loppnr: int, par: list, antal: int) -> list:
+    """
+    Skapar en rad till matchup_tabell
+
+    :param: int loppnr: Lopp
+    :param: list par: (hästnamn, odds) för hästarna i matchupen, oddsen som text eller tal
+    :param: int antal: 2 för H2H, 3 för H3H
+
+    :rtype: list
+    """
+    par = list(par)[:antal] + [(None, float("nan"))] * (3 - antal)
+    hästar = [häst for häst, _ in par]
+    odds = [float(str(o).replace(",", ".")) for _, o in par]
+    return [loppnr] + hästar + odds
+
+
+def matchup_tabell(rader: list) -> pd.DataFrame:
+    """
+    Samlar H2H- och H3H-odds i en dataframe med kolumnerna MATCHUP_KOLUMNER, en rad per matchup.
+    Oddsen kan utvärderas för alla matchups på en gång med calculators.matchup_hedges.
+
+    :param: list rader: Rader från matchup_rad
+
+    :rtype: pd.DataFrame
+    """
+    return pd.DataFrame(rader, columns=MATCHUP_KOLUMNER)
+
+
+def _api_med_reserv(källa: str, api_skrapare, *args) -> list:
+    # Returnerar API-skraparens resultat, eller None om API:et inte gav några odds så att Selenium får ta över
+    try:
+        pd_lista = api_skrapare(*args)
+        if any(not lopp_df.empty for lopp_df in pd_lista):
+            return pd_lista
+        print(f"{källa}s API returnerade inga odds, skrapar istället sidan med Selenium")
+    except Exception as e:
+        print(f"{källa}s API kunde inte användas ({type(e)} - {e}), skrapar istället sidan med Selenium")
+    return None
+
+
+def atg_parse_race(lopp_json: dict, spelform: str = None) -> pd.DataFrame:
+    """
+    Tolkar ett lopp ur ett svar från ATG's racinginfo-API.
+
+    :param: dict lopp_json: Ett element ur response_json['races']
+    :param: str spelform: Streckspelsform vars betDistribution ska tas med, None för V&P
+
+    :return: Dataframe med kolumner [Häst, VOdds, POdds] alternativt [Häst, {spelform}-procent, VOdds, POdds]
+    :rtype: pd.DataFrame
+    """
+    rader = []
+    for häst in lopp_json['starts']:
+        hästnamn = häst['horse']['name']
+        vodds = häst['pools']['vinnare']['odds'] / 100
+        podds = häst['pools']['plats']['minOdds'] / 100
+        if spelform is None:
+            rader.append([hästnamn, vodds, podds])
+        else:
+            spelform_procent = häst['pools'][spelform]['betDistribution'] / 100
+            rader.append([hästnamn, spelform_procent, vodds, podds])
+
+    if spelform is None:
+        kolumner = ["Häst", "VOdds", "POdds"]
+    else:
+        kolumner = ["Häst", f"{spelform}-procent", "VOdds", "POdds"]
+    return pd.DataFrame(rader, columns=kolumner)
+
 
 def atg_api_scraper(
     datum: str,
@@ -43,25 +269,13 @@ def atg_api_scraper(
         pd_lista = []
 
         for loppnr in range(start_avd, slut_avd + 1):
+            # Skapar en tom dataframe för loppet
+            lopp_df = pd.DataFrame(columns=["Häst", "VOdds", "POdds"])
             try:
-                # Skapar en tom dataframe för loppet
-                lopp_df = pd.DataFrame(columns=["Häst", "VOdds", "POdds"])
-
-                # Requestar all data från ATG's API, loopar igenom och extraherar relevant information
-                url = f"https://www.atg.se/services/racinginfo/v1/api/games/vinnare_{datum}_{bankod}_{loppnr}"
-                response = requests.get(url)
-                response_json = response.json()
-                startande_hästar = response_json['races'][0]['starts']
-                for häst in startande_hästar:
-                    hästnamn = häst['horse']['name']
-                    vodds = häst['pools']['vinnare']['odds'] / 100
-                    podds = häst['pools']['plats']['minOdds'] / 100
-
-                    # Lägger denna data till dataframen för loppet
-                    dummy_df = lopp_df
-                    ny_rad = pd.DataFrame(
-                        [[hästnamn, vodds, podds]], columns=lopp_df.columns)
-                    lopp_df = pd.concat([dummy_df, ny_rad], ignore_index=True)
+                # Requestar all data från ATG's API (via cachen) och extraherar relevant information
+                response_json = atg_get_json(
+                    f"{ATG_API}/games/vinnare_{datum}_{bankod}_{loppnr}")
+                lopp_df = atg_parse_race(response_json['races'][0])
             except:
                 print(
                     f"Det uppstod ett problem i samband med inhämtningen av data för lopp {loppnr}")
@@ -77,28 +291,17 @@ def atg_api_scraper(
         # Initierar en lista som ska innehålla dataframes för samtliga lopp
         pd_lista = []
 
-        # Requestar all data från ATG's API, loopar igenom och extraherar relevant information
-        url = f"https://www.atg.se/services/racinginfo/v1/api/games/{spelform}_{datum}_{bankod}_{spelform_start_lopp}"
-        response = requests.get(url)
-        response_json = response.json()
+        # Requestar hela spelet en gång från ATG's API (via cachen), loopar igenom och extraherar relevant information
+        response_json = atg_get_json(
+            f"{ATG_API}/games/{spelform}_{datum}_{bankod}_{spelform_start_lopp}")
 
         for avd_nr in range(start_avd, slut_avd + 1):
+            # Skapar en tom dataframe för loppet
+            lopp_df = pd.DataFrame(
+                columns=["Häst", f"{spelform}-procent", "VOdds", "POdds"])
             try:
-                # Skapar en tom dataframe för loppet
-                lopp_df = pd.DataFrame(
-                    columns=["Häst", f"{spelform}-procent", "VOdds", "POdds"])
-                startande_hästar = response_json['races'][avd_nr - 1]['starts']
-                for häst in startande_hästar:
-                    hästnamn = häst['horse']['name']
-                    spelform_procent = häst['pools'][spelform]['betDistribution'] / 100
-                    vodds = häst['pools']['vinnare']['odds'] / 100
-                    podds = häst['pools']['plats']['minOdds'] / 100
-
-                    # Lägger denna data till dataframen för loppet
-                    dummy_df = lopp_df
-                    ny_rad = pd.DataFrame(
-                        [[hästnamn, spelform_procent, vodds, podds]], columns=lopp_df.columns)
-                    lopp_df = pd.concat([dummy_df, ny_rad], ignore_index=True)
+                lopp_df = atg_parse_race(
+                    response_json['races'][avd_nr - 1], spelform)
             except:
                 print(
                     f"Det uppstod ett problem i samband med inhämtningen av data för avdelning {avd_nr}")
@@ -109,6 +312,223 @@ def atg_api_scraper(
         return pd_lista
 
 
+# En förändring i pollern: lopp/avdelning, startnummer, hästnamn, fält (VOdds, POdds eller {spelform}-procent),
+# tidigare värde (NaN vid första pollningen) och nytt värde
+AtgOddsÄndring = namedtuple(
+    "AtgOddsÄndring", ["lopp", "startnr", "häst", "fält", "före", "efter"])
+
+
+def atg_race_array(lopp_json: dict, spelform: str = None) -> tuple:
+    """
+    Extraherar ett lopp ur ATG-svaret till en kompakt array utan att gå via en dataframe.
+    Odds som saknas (t.ex. för strukna hästar) blir NaN.
+
+    :param: dict lopp_json: Ett element ur response_json['races']
+    :param: str spelform: Streckspelsform vars betDistribution ska tas med, None för V&P
+
+    :return: (lista av (startnummer, hästnamn), float-array med en rad per häst och kolumnerna
+             [VOdds, POdds] alternativt [VOdds, POdds, {spelform}-procent])
+    :rtype: tuple
+    """
+    startande = lopp_json['starts']
+    hästar = [(häst.get('number', i + 1), häst['horse']['name'])
+              for i, häst in enumerate(startande)]
+    värden = np.full((len(startande), 2 if spelform is None else 3), np.nan)
+    for i, häst in enumerate(startande):
+        pools = häst.get('pools', {})
+        värden[i, 0] = pools.get('vinnare', {}).get('odds', np.nan)
+        värden[i, 1] = pools.get('plats', {}).get('minOdds', np.nan)
+        if spelform is not None:
+            värden[i, 2] = pools.get(spelform, {}).get('betDistribution', np.nan)
+    return hästar, värden / 100
+
+
+def atg_odds_poller(
+    datum: str,
+    bankod: str,
+    spelform: str,
+    start_avd: int,
+    slut_avd: int,
+    spelform_start_lopp: int = None,
+    intervall: float = 10,
+    antal_pollningar: int = None,
+):
+    """
+    Pollar ATG's API med samma parametrar som atg_api_scraper och genererar endast de odds och streckprocent som
+    ändrats sedan föregående pollning. Föregående ögonblicksbild sparas per lopp som en array, vid första
+    pollningen genereras samtliga värden (med före = NaN).
+
+    Exempel: for ändring in atg_odds_poller("2022-05-28", "5", "V75", 1, 7, 5): print(ändring)
+
+    :param: str datum: Tävlingsdatum, t.ex. "2022-05-31"
+    :param: str bankod: Bankod, observera att detta ska vara en *string*
+    :param: str spelform: Valfri spelform ur listan ['V75', 'V86', 'GS75', 'V64', 'V65', 'V5', 'V4', 'V&P']
+    :param: int start_avd: Vilken avdelning/vilket lopp ska pollern inleda med
+    :param: int slut_avd: Vilken avdelning/vilket lopp ska pollern avsluta med
+    :param: int spelform_start_lopp: Givet att streckspelsinformation efterfrågas, vilket lopp börjar spelformen i?
+    :param: float intervall: Antal sekunder mellan pollningarna
+    :param: int antal_pollningar: Antal pollningar innan generatorn avslutas, None för att polla tills den stängs
+
+    :rtype: generator av AtgOddsÄndring
+    """
+    assert spelform in ['V75', 'V86', 'GS75', 'V64', 'V65', 'V5', 'V4',
+                        'V&P'], f"{spelform} är ej en giltig spelform, alternativt är inte scrapern kompatibel med denna spelform"
+
+    streckspel = None if spelform == 'V&P' else spelform
+    fält = ["VOdds", "POdds"] if streckspel is None else [
+        "VOdds", "POdds", f"{spelform}-procent"]
+
+    # lopp -> (hästar, array) från föregående pollning
+    ögonblicksbilder = {}
+    pollning = 0
+
+    while antal_pollningar is None or pollning < antal_pollningar:
+        if pollning > 0:
+            time.sleep(intervall)
+        pollning += 1
+
+        # Hämtar loppen, TTL:en sätts under intervallet så att varje pollning frågar ATG (villkorad GET)
+        lopp_json = {}
+        try:
+            if streckspel is None:
+                for loppnr in range(start_avd, slut_avd + 1):
+                    lopp_json[loppnr] = atg_get_json(
+                        f"{ATG_API}/games/vinnare_{datum}_{bankod}_{loppnr}", ttl=intervall / 2)['races'][0]
+            else:
+                response_json = atg_get_json(
+                    f"{ATG_API}/games/{spelform}_{datum}_{bankod}_{spelform_start_lopp}", ttl=intervall / 2)
+                for avd_nr in range(start_avd, slut_avd + 1):
+                    lopp_json[avd_nr] = response_json['races'][avd_nr - 1]
+        except Exception as e:
+            print(f"Det uppstod ett problem i samband med pollningen av ATG: {e}")
+
+        for lopp, data in lopp_json.items():
+            hästar, värden = atg_race_array(data, streckspel)
+            föregående = ögonblicksbilder.get(lopp)
+            ögonblicksbilder[lopp] = (hästar, värden)
+
+            if föregående is None or föregående[0] != hästar:
+                # Första pollningen, eller ändrad startlista: allt rapporteras
+                före = np.full_like(värden, np.nan)
+                ändrade = ~np.isnan(värden)
+            else:
+                före = föregående[1]
+                ändrade = (före != värden) & ~(np.isnan(före) & np.isnan(värden))
+
+            for rad, kolumn in zip(*np.nonzero(ändrade)):
+                startnr, hästnamn = hästar[rad]
+                yield AtgOddsÄndring(lopp, startnr, hästnamn, fält[kolumn],
+                                     float(före[rad, kolumn]), float(värden[rad, kolumn]))
+
+
+class _Hastighetsbegränsare:
+    """
+    Sprider ut anropen mot en värd så att högst max_per_sekund startas per sekund
+    """
+
+    def __init__(self, max_per_sekund: float):
+        self.intervall = 1 / max_per_sekund
+        self.nästa = 0.0
+
+    async def vänta(self):
+        # Ingen await mellan läsning och uppdatering, så inget lås behövs inom en event loop
+        nu = time.monotonic()
+        väntetid = self.nästa - nu
+        self.nästa = max(nu, self.nästa) + self.intervall
+        if väntetid > 0:
+            await asyncio.sleep(väntetid)
+
+
+async def atg_card_fetcher_async(
+    datum_lista: list,
+    länder: tuple = ("SE",),
+    max_samtidiga: int = 8,
+) -> pd.DataFrame:
+    """
+    Asynkron version av atg_card_fetcher. Kalendrarna för alla datum hämtas först, därefter hämtas samtliga lopp
+    med högst max_samtidiga anrop åt gången och högst ATG_MAX_PER_SEKUND anrop per sekund och värd. Loppen köas i
+    starttidsordning, så att de lopp som startar först hämtas först.
+
+    :param: list datum_lista: Tävlingsdatum, t.ex. ["2022-05-28", "2022-05-29"]
+    :param: tuple länder: Landskoder för banorna som ska tas med, None för alla banor
+    :param: int max_samtidiga: Högsta antal anrop som pågår samtidigt
+
+    :rtype: pd.DataFrame
+    """
+    semafor = asyncio.Semaphore(max_samtidiga)
+    begränsare = {}
+
+    async def hämta(url: str) -> dict:
+        värd = urlsplit(url).netloc
+        if värd not in begränsare:
+            begränsare[värd] = _Hastighetsbegränsare(
+                ATG_MAX_PER_SEKUND.get(värd, ATG_STANDARD_PER_SEKUND))
+        # asyncio.Semaphore släpper in väntande i kööordning, anropen görs alltså i den ordning de skapas
+        async with semafor:
+            await begränsare[värd].vänta()
+            return await asyncio.to_thread(atg_get_json, url)
+
+    kalendrar = await asyncio.gather(
+        *(hämta(f"{ATG_API}/calendar/day/{datum}") for datum in datum_lista), return_exceptions=True)
+
+    # (starttid, datum, bankod, bana, loppnr) för samtliga lopp på de valda banorna
+    lopp_lista = []
+    for datum, kalender in zip(datum_lista, kalendrar):
+        if isinstance(kalender, Exception):
+            print(f"Det uppstod ett problem i samband med inhämtningen av kalendern för {datum}: {kalender}")
+            continue
+        for bana in kalender.get('tracks', []):
+            if länder is not None and bana.get('countryCode') not in länder:
+                continue
+            for lopp in bana.get('races', []):
+                lopp_lista.append((lopp.get('startTime', ''), datum, str(bana['id']), bana.get('name'),
+                                   lopp['number']))
+    lopp_lista.sort()
+
+    svar = await asyncio.gather(
+        *(hämta(f"{ATG_API}/games/vinnare_{datum}_{bankod}_{loppnr}")
+          for _, datum, bankod, _, loppnr in lopp_lista), return_exceptions=True)
+
+    rader = []
+    for (starttid, datum, bankod, bana, loppnr), response_json in zip(lopp_lista, svar):
+        if isinstance(response_json, Exception):
+            print(f"Det uppstod ett problem i samband med inhämtningen av data för {bana} lopp {loppnr} "
+                  f"{datum}: {response_json}")
+            continue
+        hästar, värden = atg_race_array(response_json['races'][0])
+        for (startnr, hästnamn), (vodds, podds) in zip(hästar, värden):
+            rader.append([datum, bankod, bana, loppnr, starttid, startnr, hästnamn, vodds, podds])
+
+    return pd.DataFrame(rader, columns=["Datum", "Bankod", "Bana", "Lopp", "Starttid", "Startnr", "Häst",
+                                        "VOdds", "POdds"])
+
+
+def atg_card_fetcher(
+    startdatum: str = None,
+    antal_dagar: int = 3,
+    länder: tuple = ("SE",),
+    max_samtidiga: int = 8,
+) -> pd.DataFrame:
+    """
+    Hämtar vinnar- och platsodds för samtliga lopp på samtliga banor under ett antal dagar. Banorna och loppen
+    hittas via ATG's kalender, så varken bankod eller antal lopp behöver anges.
+
+    Exempel: atg_card_fetcher("2022-05-28", 3)
+
+    :param: str startdatum: Första tävlingsdatum, t.ex. "2022-05-31", som standard dagens datum
+    :param: int antal_dagar: Antal dagar från och med startdatum
+    :param: tuple länder: Landskoder för banorna som ska tas med, None för alla banor
+    :param: int max_samtidiga: Högsta antal anrop mot ATG som pågår samtidigt
+
+    :return: Dataframe i långt format med en rad per häst och lopp, kolumner
+            [Datum, Bankod, Bana, Lopp, Starttid, Startnr, Häst, VOdds, POdds], sorterad efter starttid
+    :rtype: pd.DataFrame
+    """
+    start = date.fromisoformat(startdatum) if startdatum else date.today()
+    datum_lista = [(start + timedelta(days=i)).isoformat() for i in range(antal_dagar)]
+    return asyncio.run(atg_card_fetcher_async(datum_lista, länder, max_samtidiga))
+
+
 def atg_selenium_scraper_VP(
     datum: str,
     bana: str,
@@ -138,49 +558,46 @@ def atg_selenium_scraper_VP(
 
     for loppnr in range(från_lopp, till_lopp + 1):
         # Använder platslänken då denna innehåller både plats och vinnarodds som standard
-        driver.get(
-            f"https://www.atg.se/spel/{datum}/plats/{bana}/lopp{loppnr}")
+        selenium_get(
+            driver, f"https://www.atg.se/spel/{datum}/plats/{bana}/lopp{loppnr}", "atg")
 
         # Väntar {wait_time} sekunder mellan loppen för att datan ska hinna laddas in ordentligt
         time.sleep(wait_time)
 
-        hastnamn_element = driver.find_elements(By.CLASS_NAME, "horse-col")
-        vinnarodds_element = driver.find_elements(By.CLASS_NAME, "vOdds-col")
-        platsodds_element = driver.find_elements(By.CLASS_NAME, "pOdds-col")
-
-        # Skapar en tom dataframe för loppet
-        lopp_df = pd.DataFrame(columns=["Häst", "VOdds", "POdds"])
+        # Hämtar samtliga kolumner på sidan i ett anrop
+        sida = dom_extrahera(driver, ":root", {"Häst": ".horse-col", "VOdds": ".vOdds-col",
+                                               "POdds": ".pOdds-col"})[0]
+        hastnamn_element = sida["Häst"]
+        vinnarodds_element = sida["VOdds"]
+        platsodds_element = sida["POdds"]
 
+        rader = []
         for hästnr in range(1, len(hastnamn_element)):
             # Notera att listorna innehåller rubriker, därav börjar loopen på 1
             # samtidigt som len(hastnamn_element) = antal hästar + 1.
 
             # Skalar bort startnummer då det kommer med i början av varje string
             if hästnr < 10:
-                hästnamn = hastnamn_element[hästnr].text[1:]
+                hästnamn = hastnamn_element[hästnr][1:]
             else:
-                hästnamn = hastnamn_element[hästnr].text[2:]
+                hästnamn = hastnamn_element[hästnr][2:]
 
             # Kontrollerar om häst är STRUKEN.
-            if not vinnarodds_element[hästnr].text == "EJ":
+            if not vinnarodds_element[hästnr] == "EJ":
                 vodds = float(
-                    vinnarodds_element[hästnr].text.replace(",", "."))
+                    vinnarodds_element[hästnr].replace(",", "."))
                 podds = float(
-                    platsodds_element[hästnr].text.replace(",", "."))
+                    platsodds_element[hästnr].replace(",", "."))
 
             # Om häst är STRUKEN sätts vinnarodds och platsodds till 999.
             else:
                 vodds = 999
                 podds = 999
 
-            # Lägger denna data till dataframen för loppet
-            dummy_df = lopp_df
-            ny_rad = pd.DataFrame(
-                [[hästnamn, vodds, podds]], columns=lopp_df.columns)
-            lopp_df = pd.concat([dummy_df, ny_rad], ignore_index=True)
+            rader.append([hästnamn, vodds, podds])
 
         # Slutligen läggs dataframen för det nu färdiga loppet till pd_lista
-        pd_lista.append(lopp_df)
+        pd_lista.append(pd.DataFrame(rader, columns=["Häst", "VOdds", "POdds"]))
 
     driver.quit()
 
@@ -199,35 +616,33 @@ def bet365_scraper(
     initial_wait: float = 2,
 ) -> list:
     """
-    Skrapar som standard hästnamn, vinnarodds och platsodds till en valfri uppsättning lopp från en tävlingsdag.
-    Kan också skrapa H2H samt H3H odds.
+    Skrapar hästnamn, vinnarodds och platsodds till en valfri uppsättning lopp från en tävlingsdag.
 
     :param: str bana: Bana, t.ex. "Jägersro"
     :param: int från_lopp: Första lopp som ska skrapas
     :param: int till_lopp: Sista lopp som ska skrapas
     :param: str veckodag: Vilken veckodag är det tävlingarna körs på? T.ex. "Torsdag"
     :param: str land: Land, "Sverige" som standard
-    :param: bool H2H: Om H2H sätts till True skrapas aktuella H2H-odds från Bet365
-    :param: bool H3H: Om H3H sätts till True skrapas aktuella H3H-odds från Bet365
+    :param: bool H2H: Stöds inte ännu, Bet365:s H2H-marknad är inte kartlagd. Ett meddelande skrivs ut och endast
+            vinnar- och platsodds skrapas
+    :param: bool H3H: Stöds inte ännu, som H2H
     :param: float wait_time: Antal sekunder programmet ska vänta efter varje klick/sidinladdning etc, 1 sekund som standard
     :param: float initial_wait_site: Antal sekunder programmet ska vänta efter att get(bet365) callats för att sidan ska hinna laddas in ordentligt
             2 sekunder som standard
 
     :rtype: list of pd.DataFrames: Returnerar en lista av (antal hästar x 3) dataframes (en för varje lopp) med kolumner
             [Hästnamn, Vinnarodds, Platsodds]
-
-            Om H2H == True består dataframen istället av fyra kolumner,
-            [Hästnamn A, Häst A odds, Hästnamn B, Häst B odds]
-
-            På samma sätt skapas sex kolumner i H3H-fallet.
     """
+    if H2H or H3H:
+        print("För närvarande ej kompatibel med skrapning av H2H- och H3H-odds hos Bet365, skrapar endast vinnar- "
+              "och platsodds")
+
     # Initierar sessionen, se till att ha chromedriver i "Program"
     path = "/Applications/chromedriver"
     driver = webdriver.Chrome(path)
 
     # Går till bet365's hemsida
-    driver.get(
-        "https://www.bet365.com/")
+    selenium_get(driver, "https://www.bet365.com/", "bet365")
 
     # Väntar {initial_wait} sekunder för sidan ska laddas in och att HTML-koden ska laddas in ordentligt
     time.sleep(initial_wait)
@@ -265,140 +680,99 @@ def bet365_scraper(
             return
     time.sleep(wait_time)
 
-    if H2H == False and H3H == False:
-        # Detta scenario innebär att vinnarodds och platsodds ska scrapeas
-        # för dem olika loppen
-
-        # Sätter upp listan som kommer innehålla dataframes för samtliga lopp
-        pd_lista = []
-
-        # Identifierar aktuella travtävlingar och sparar rubrikerna för dessa
-        tävlingar = driver.find_elements(
-            By.CLASS_NAME, "rsm-AusMeetingHeader_MeetingName")
+    # Sätter upp listan som kommer innehålla dataframes för samtliga lopp
+    pd_lista = []
 
-        # Loopar igenom listan "tävlingar" tills land och bana matchar, avslutar med att klicka på
-        # dessa tävlingar
-        for tävling in tävlingar:
-            if tävling.text == f"{land} - {bana}":
-                tävling.click()
-                break
+    # Identifierar aktuella travtävlingar och sparar rubrikerna för dessa
+    tävlingar = driver.find_elements(
+        By.CLASS_NAME, "rsm-AusMeetingHeader_MeetingName")
 
-        # Kontrollerar vilka lopp som ska scrapeas, och börjar gå igenom dessa
-        # ett lopp i taget
-        for loppnr in range(från_lopp, till_lopp + 1):
-            lopp_df = pd.DataFrame(
-                columns=["Häst", "VOdds", "POdds"])
-            time.sleep(wait_time)
+    # Loopar igenom listan "tävlingar" tills land och bana matchar, avslutar med att klicka på
+    # dessa tävlingar
+    for tävling in tävlingar:
+        if tävling.text == f"{land} - {bana}":
+            tävling.click()
+            break
 
-            # Lista innehållande samtliga lopp för den aktuella tävlingsdagen
-            alla_lopp = driver.find_elements(
-                By.CLASS_NAME, "srl-ParticipantRacingRaceTab-number")
+    # Kontrollerar vilka lopp som ska scrapeas, och börjar gå igenom dessa
+    # ett lopp i taget
+    for loppnr in range(från_lopp, till_lopp + 1):
+        lopp_df = pd.DataFrame(
+            columns=["Häst", "VOdds", "POdds"])
+        time.sleep(wait_time)
 
-            try:
-                # Hittar loppets position på sidan och klickar in, påbörjar därefter skrapningen
-                for lopp in alla_lopp:
-                    if float(lopp.text) == loppnr:
-                        lopp.click()
-                        time.sleep(wait_time)
-
-                        # Samlar in elementen innehållande all information för varje startande ekipage
-                        samtliga_startande = driver.find_elements(
-                            By.CLASS_NAME, "srt-ParticipantTrottingINT")
-
-                        for ekipage in samtliga_startande:
-                            # Sparar för varje ekipage hästnamn, vinnarodds och platsodds
-                            hästnamn = ekipage.find_element(
-                                By.CLASS_NAME, "srt-ParticipantDetailsRacingINT_RunnerName").text
-                            odds = ekipage.find_elements(
-                                By.CLASS_NAME, "srt-ParticipantTrottingOddsINT")
-                            vodds = float(odds[0].text)
-                            podds = float(odds[1].text)
-
-                            # Lägger denna data till dataframen för loppet
-                            dummy_df = lopp_df
-                            ny_rad = pd.DataFrame(
-                                [[hästnamn, vodds, podds]], columns=lopp_df.columns)
-                            lopp_df = pd.concat(
-                                [dummy_df, ny_rad], ignore_index=True)
-                        break
-            except:
-                print(
-                    f"Ett problem uppstod i inhämtningen av hästnamn och odds för lopp {loppnr}, kontrollera så att odds faktiskt ligger uppe för loppet")
-                pass
+        # Lista innehållande samtliga lopp för den aktuella tävlingsdagen
+        alla_lopp = driver.find_elements(
+            By.CLASS_NAME, "srl-ParticipantRacingRaceTab-number")
 
-            # När loppet är färdigt läggs dataframen för loppet till pd_lista
-            pd_lista.append(lopp_df)
+        try:
+            # Hittar loppets position på sidan och klickar in, påbörjar därefter skrapningen
+            for lopp in alla_lopp:
+                if float(lopp.text) == loppnr:
+                    lopp.click()
+                    time.sleep(wait_time)
 
-        driver.quit()
+                    # Hämtar hästnamn och odds för samtliga startande ekipage i ett anrop
+                    samtliga_startande = dom_extrahera(
+                        driver, ".srt-ParticipantTrottingINT",
+                        {"Häst": ".srt-ParticipantDetailsRacingINT_RunnerName",
+                         "Odds": ".srt-ParticipantTrottingOddsINT"})
 
-        return pd_lista
+                    # Sparar för varje ekipage hästnamn, vinnarodds och platsodds
+                    lopp_df = pd.DataFrame(
+                        [[ekipage["Häst"][0], float(ekipage["Odds"][0]), float(ekipage["Odds"][1])]
+                         for ekipage in samtliga_startande], columns=lopp_df.columns)
+                    break
+        except:
+            print(
+                f"Ett problem uppstod i inhämtningen av hästnamn och odds för lopp {loppnr}, kontrollera så att odds faktiskt ligger uppe för loppet")
+            pass
 
-    # GÖR KLART H2H OCH H3H
-    # GÖR KLART H2H OCH H3H
-    # GÖR KLART H2H OCH H3H
-    # GÖR KLART H2H OCH H3H
-    # GÖR KLART H2H OCH H3H
-    # GÖR KLART H2H OCH H3H
-    # GÖR KLART H2H OCH H3H
-
-    elif H2H == True and H3H == False:
-        # Detta scenario innebär att H2H-odds ska skrapas
-        print("För närvarande ej kompatibel med skrapning av H2H-odds")
-        driver.quit()
+        # När loppet är färdigt läggs dataframen för loppet till pd_lista
+        pd_lista.append(lopp_df)
 
-    elif H2H == False and H3H == True:
-        # Detta scenario innebär att H3H-odds ska skrapas
-        print("För närvarande ej kompatibel med skrapning av H3H-odds")
-        driver.quit()
+    driver.quit()
 
-    # GÖR KLART H2H OCH H3H
-    # GÖR KLART H2H OCH H3H
-    # GÖR KLART H2H OCH H3H
-    # GÖR KLART H2H OCH H3H
-    # GÖR KLART H2H OCH H3H
-    # GÖR KLART H2H OCH H3H
-    # GÖR KLART H2H OCH H3H
+    return pd_lista
 
-    else:
-        print("Om du vill skrapa både H2H odds och H3H odds, gör detta genom att calla funktionen två gånger.")
-        driver.quit()
 
-        
 async def getidsdata(uri, sportid=36):
-    ws = await websockets.connect(uri)
-    try:
-        await ws.send(
-            json.dumps(
-                {"jsonrpc": "2.0", "params": {"ids": [f"{sportid}"]}, "method": "GetLeaguesBySportId", "meta": {
-                    "blockId": "html-container-Center_LeagueListResponsiveBlock_16322"}, "id": "383b30bc-ed3e-423f-b172-1e8abf2737fb"}
+    with span("svenskaspel.ws.GetLeaguesBySportId"):
+        ws = await websockets.connect(uri)
+        try:
+            await ws.send(
+                json.dumps(
+                    {"jsonrpc": "2.0", "params": {"ids": [f"{sportid}"]}, "method": "GetLeaguesBySportId", "meta": {
+                        "blockId": "html-container-Center_LeagueListResponsiveBlock_16322"}, "id": "383b30bc-ed3e-423f-b172-1e8abf2737fb"}
+                )
             )
-        )
-        result = await ws.recv()
-        close_ws = await ws.close()
-        result_dict = json.loads(result)
-        return result_dict
+            result = await ws.recv()
+            close_ws = await ws.close()
+            result_dict = json.loads(result)
+            return result_dict
 
-    except:
-        raise Exception("async getidsdata-funktionen kunde inte hämta id-data")
+        except:
+            raise Exception("async getidsdata-funktionen kunde inte hämta id-data")
 
 
 async def getoddsdata(uri, id_):
-    ws = await websockets.connect(uri)
-    try:
-        await ws.send(
-            json.dumps(
-                {"jsonrpc": "2.0", "params": {"eventState": "Mixed", "eventTypes": ["Outright"], "pagination": {"top": 100, "skip": 0}, "ids": [f"{id_}"]}, "method": "GetEventsByLeagueId", "meta": {
-                    "blockId": "outRights-html-container-Center_LeagueViewResponsiveBlock_15984Center_LeagueViewResponsiveBlock_15984"}, "id": "734712ee-314b-4351-ba6f-3026aa1e24f2"}
+    with span("svenskaspel.ws.GetEventsByLeagueId"):
+        ws = await websockets.connect(uri)
+        try:
+            await ws.send(
+                json.dumps(
+                    {"jsonrpc": "2.0", "params": {"eventState": "Mixed", "eventTypes": ["Outright"], "pagination": {"top": 100, "skip": 0}, "ids": [f"{id_}"]}, "method": "GetEventsByLeagueId", "meta": {
+                        "blockId": "outRights-html-container-Center_LeagueViewResponsiveBlock_15984Center_LeagueViewResponsiveBlock_15984"}, "id": "734712ee-314b-4351-ba6f-3026aa1e24f2"}
+                )
             )
-        )
-        result = await ws.recv()
-        close_ws = await ws.close()
-        result_dict = json.loads(result)
-        return result_dict
+            result = await ws.recv()
+            close_ws = await ws.close()
+            result_dict = json.loads(result)
+            return result_dict
 
-    except:
-        raise Exception(
-            f"async getodds-funktionen kunde inte hämta datan för id {id_}")
+        except:
+            raise Exception(
+                f"async getodds-funktionen kunde inte hämta datan för id {id_}")
 
 
 def ss_getids(
@@ -441,6 +815,42 @@ def ss_getids(
         print("MER INFO:", e.args, type(e))
 
 
+def ss_parse_markets(data: dict) -> pd.DataFrame:
+    """
+    Tolkar vinnar- och platsodds ur ett GetEventsByLeagueId-svar från Svenska Spels websocket.
+
+    :param: dict data: Svaret från getoddsdata
+
+    :return: Dataframe sorterad efter startnummer med kolumner [Startnr, Häst, VOdds, POdds]
+    :rtype: pd.DataFrame
+    """
+    for market in data['result']['markets']:
+        if "Vinnare" in market['name']:
+            v_selections = market['selections']
+
+        if "Topp 3" in market['name']:
+            p_selections = market['selections']
+
+    # Platsoddsen slås upp på hästnamn, namnen i Topp 3-marknaden har ett prefix på tre tecken
+    podds_per_häst = {p_data['name'][3:]: round(p_data['trueOdds'], 2)
+                      for p_data in p_selections}
+
+    rader = []
+    for v_data in v_selections:
+        # Ifall startnummer inte finns (t.ex. Elitloppet) sätts alla till 0
+        try:
+            startnummer = int(v_data['name'].split(" ")[0])
+        except:
+            startnummer = 0
+        hästnamn = v_data['name']
+        vodds = round(v_data['trueOdds'], 2)
+        podds = podds_per_häst.get(hästnamn)
+        rader.append([startnummer, hästnamn, vodds, podds])
+
+    lopp_df = pd.DataFrame(rader, columns=["Startnr", "Häst", "VOdds", "POdds"])
+    return lopp_df.sort_values(by="Startnr")
+
+
 def ss_ws_scraper(
     uri: str,
     id_list: list,
@@ -470,42 +880,15 @@ def ss_ws_scraper(
                 # Raden nedan tar 0.4-0.5 sek, skulle kunna optimeras genom att hämta all data för
                 # alla id'n på en gång, men resterande del av koden blir krångligare
                 data = asyncio.run(getoddsdata(uri, int(objid)))
-
-                for market in data['result']['markets']:
-                    if "Vinnare" in market['name']:
-                        v_selections = market['selections']
-
-                    if "Topp 3" in market['name']:
-                        p_selections = market['selections']
-
-                for v_data in v_selections:
-                    # Ifall startnummer inte finns (t.ex. Elitloppet) sätts alla till 0
-                    try:
-                        startnummer = int(v_data['name'].split(" ")[0])
-                    except:
-                        startnummer = 0
-                    hästnamn = v_data['name']
-                    vodds = round(v_data['trueOdds'], 2)
-                    for p_data in p_selections:
-                        if hästnamn == p_data['name'][3:]:
-                            podds = round(p_data['trueOdds'], 2)
-                            break
-
-                    dummy_df = lopp_df
-                    ny_rad = pd.DataFrame(
-                        [[startnummer, hästnamn, vodds, podds]], columns=lopp_df.columns)
-                    lopp_df = pd.concat(
-                        [dummy_df, ny_rad], ignore_index=True)
+                lopp_df = ss_parse_markets(data)
 
             except Exception as e:
                 print(
-                    "Fel uppstod i samband med hämtning av odds för ID {objid} i ss_ws_scraper")
+                    f"Fel uppstod i samband med hämtning av odds för ID {objid} i ss_ws_scraper")
                 print("MER INFO:", e.args, type(e))
 
-            # När allt är färdigt sorteras dataframen efter startnummer,
-            # sedan läggs dataframen för loppet till pd_lista
-            sorted_df = lopp_df.sort_values(by="Startnr")
-            pd_lista.append(sorted_df)
+            # När allt är färdigt läggs dataframen för loppet, sorterad efter startnummer, till pd_lista
+            pd_lista.append(lopp_df)
 
         return pd_lista
 
@@ -514,6 +897,46 @@ def ss_ws_scraper(
             "För närvarande är SS-scrapern [websockets] endast kompatibel med ['Vinnare', 'Topp 3']")
 
 
+async def _getoddsdata_alla(uri: str, id_list: list) -> list:
+    return await asyncio.gather(*(getoddsdata(uri, int(objid)) for objid in id_list), return_exceptions=True)
+
+
+def svenskaspel_api_scraper(
+    uri: str,
+    bana: str,
+    från_lopp: int,
+    till_lopp: int,
+) -> list:
+    """
+    API-läget för svenskaspel_scraper. Hämtar samtliga lopp samtidigt över Svenska Spels websocket istället för
+    att rendera sidorna. Svaren tolkas av ss_parse_markets, som kontrolleras mot ett inspelat svar
+    (benchmarks/fixtures/ss_ws_odds.json). Används endast om svenskaspel_scraper får ws_uri.
+
+    :param: str uri: WebSocket url
+    :param: str bana: Bana som den heter hos Svenska Spel, t.ex. "Solvalla"
+    :param: int från_lopp: Första lopp som ska hämtas
+    :param: int till_lopp: Sista lopp som ska hämtas
+
+    :return: Lista av dataframes (en för varje lopp) med kolumner [Häst, VOdds, POdds]
+    :rtype: list of pd.DataFrames
+    """
+    id_list = ss_getids(uri, bana, från_lopp, till_lopp)
+    assert id_list, f"Inga lopp hittades för {bana} hos Svenska Spel"
+
+    pd_lista = []
+    for objid, data in zip(id_list, asyncio.run(_getoddsdata_alla(uri, id_list))):
+        lopp_df = pd.DataFrame(columns=["Häst", "VOdds", "POdds"])
+        try:
+            if isinstance(data, Exception):
+                raise data
+            lopp_df = ss_parse_markets(data)[["Häst", "VOdds", "POdds"]].reset_index(drop=True)
+        except Exception as e:
+            print(f"Fel uppstod i samband med hämtning av odds för ID {objid} i svenskaspel_api_scraper")
+            print("MER INFO:", e.args, type(e))
+        pd_lista.append(lopp_df)
+    return pd_lista
+
+
 def svenskaspel_scraper(
     bana: str,
     från_lopp: int,
@@ -521,6 +944,8 @@ def svenskaspel_scraper(
     H2H: bool = False,
     wait_time: float = 1,
     initial_wait: float = 2,
+    ws_uri: str = None,
+    ws_bana: str = None,
 ) -> list:
     """
     Skrapar som standard hästnamn, vinnarodds och platsodds till en valfri uppsättning lopp från en tävlingsdag.
@@ -530,21 +955,30 @@ def svenskaspel_scraper(
     :param: int från_lopp: Första lopp som ska skrapas
     :param: int till_lopp: Sista lopp som ska skrapas
     :param: bool H2H: Om H2H sätts till True skrapas aktuella H2H-odds från Svenska Spel för varje angivet lopp
+    :param: str ws_uri: Om angiven hämtas vinnar- och platsoddsen över Svenska Spels websocket (svenskaspel_api_scraper)
+            och sidan skrapas med Selenium endast om det misslyckas
+    :param: str ws_bana: Banans namn hos websocketen, som standard bana med stor bokstav, t.ex. "Solvalla"
     :param: float wait_time: Antal sekunder programmet ska vänta efter varje klick/sidinladdning etc, 1 sekund som standard
     :param: float initial_wait_site: Antal sekunder programmet ska vänta efter att get(bet365) callats för att sidan ska hinna laddas in ordentligt
             2 sekunder som standard
 
     :rtype: list of pd.DataFrames: Returnerar en lista av (antal hästar x 3) dataframes (en för varje lopp) med kolumner
             [Hästnamn, Vinnarodds, Platsodds]
-            Om H2H == True består dataframen istället av fyra kolumner,
-            [Hästnamn A, Häst A odds, Hästnamn B, Häst B odds]
+            Om H2H == True skrapas H2H-oddsen i samma session och returneras som (lista, matchup_tabell) där
+            matchup_tabell har en rad per matchup med kolumnerna MATCHUP_KOLUMNER
     """
+    if ws_uri and H2H == False:
+        pd_lista = _api_med_reserv("Svenska Spel", svenskaspel_api_scraper, ws_uri,
+                                   ws_bana or bana.capitalize(), från_lopp, till_lopp)
+        if pd_lista is not None:
+            return pd_lista
+
     # Initierar sessionen, se till att ha chromedriver i "Program"
     path = "/Applications/chromedriver"
     driver = webdriver.Chrome(path)
 
     # Går in på startsidan för Svenska Spel och accepterar cookies
-    driver.get("https://spela.svenskaspel.se/odds")
+    selenium_get(driver, "https://spela.svenskaspel.se/odds", "svenskaspel")
     time.sleep(initial_wait)
 
     # Beroende på storlek på skärm kan man behöva scrolla ner för att godkänna cookies
@@ -566,138 +1000,116 @@ def svenskaspel_scraper(
             By.CLASS_NAME, "dialog-button-primary").click()
         time.sleep(wait_time)
 
-    if H2H == False:
-        # Detta scenario innebär att vinnarodds och platsodds ska scrapeas
-        # för dem olika loppen
-
-        # Sätter upp listan som kommer innehålla dataframes för samtliga lopp
-        pd_lista = []
+    # Sätter upp listan som kommer innehålla dataframes för samtliga lopp
+    pd_lista = []
 
-        # Håller koll på hur många lopp oddsen ej lagts ut till
-        antal_lopp_odds_ej_kunnat_hämtas = 0
+    # Rader för matchup_tabell, H2H skrapas på samma sida som vinnar- och platsoddsen
+    matchup_rader = []
 
-        # Loopar igenom varje lopp och hämtar ner vinnarodds och platsodds för varje häst
-        for loppnr in range(från_lopp, till_lopp + 1):
-            # Sätter upp en dataframe för loppet
-            lopp_df = pd.DataFrame(columns=["Häst", "VOdds", "POdds"])
+    # Håller koll på hur många lopp oddsen ej lagts ut till
+    antal_lopp_odds_ej_kunnat_hämtas = 0
 
-            try:
-                driver.get(
-                    f"https://spela.svenskaspel.se/odds/sports/travsport/{bana}-lopp-{loppnr}")
-                time.sleep(wait_time)
-
-                # Sätter upp tre lokala listor som kommer innehålla hästnamn, vinnarodds
-                # och platsodds
-                hästnamn_lista = []
-                vodds_lista = []
-                podds_lista = []
-
-                # Allt innehåll på sidan ligger i en SB_TECH iframe, byter frame till denna
-                SB_tech_frame = driver.find_element(
-                    By.CSS_SELECTOR, "#main-content > iframe")
-                driver.switch_to.frame(SB_tech_frame)
-
-                rubriker = driver.find_elements(
-                    By.CLASS_NAME, "rj-carousel-item-market")
-
-                # HÄSTNAMN OCH VINNARODDS
-                # Klickar in på "Vinnare" bland rubrikerna
-                for obj in rubriker:
-                    if obj.text == "Vinnare":
-                        obj.click()
-                        time.sleep(wait_time)
-                        break
+    # Loopar igenom varje lopp och hämtar ner vinnarodds och platsodds för varje häst
+    for loppnr in range(från_lopp, till_lopp + 1):
+        # Sätter upp en dataframe för loppet
+        lopp_df = pd.DataFrame(columns=["Häst", "VOdds", "POdds"])
 
-                spelformer = driver.find_elements(
-                    By.CLASS_NAME, "rj-ev-list__content")
-
-                # Fokuserar på den del av sidan som innehåller vinnaroddsen samt går in och
-                # hämtar alla relevanta element (ett per startande häst)
-                for spelform in spelformer:
-                    if spelform.text[0:7] == "Vinnare":
-                        ekipage_lista = spelform.find_elements(
-                            By.CLASS_NAME, "rj-ev-list__prelive-outright__button-holder")
-
-                        # Loopar igenom elementen för samtliga ekipage, extraherar hästarnas namn samt vinnarodds och
-                        # appendar informationen i korrekt format till namn- och vinnaroddslistorna
-                        for ekipage in ekipage_lista:
-                            hästnamn_lista.append(ekipage.find_elements(
-                                By.CLASS_NAME, "rj-ev-list__bet-btn__content")[0].text)
-                            vodds_lista.append(float(ekipage.find_elements(
-                                By.CLASS_NAME, "rj-ev-list__bet-btn__content")[1].text.replace(",", ".")))
-
-                rubriker = driver.find_elements(
-                    By.CLASS_NAME, "rj-carousel-item-market")
-
-                # PLATSODDS
-                # Klickar in på "Placering" bland rubrikerna
-                for obj in rubriker:
-                    if obj.text == "Placering":
-                        obj.click()
-                        time.sleep(wait_time)
-                        break
+        try:
+            selenium_get(
+                driver, f"https://spela.svenskaspel.se/odds/sports/travsport/{bana}-lopp-{loppnr}", "svenskaspel")
+            time.sleep(wait_time)
 
-                spelformer = driver.find_elements(
-                    By.CLASS_NAME, "rj-ev-list__content")
+            # Sätter upp tre lokala listor som kommer innehålla hästnamn, vinnarodds
+            # och platsodds
+            hästnamn_lista = []
+            vodds_lista = []
+            podds_lista = []
+
+            # Allt innehåll på sidan ligger i en SB_TECH iframe, byter frame till denna
+            SB_tech_frame = driver.find_element(
+                By.CSS_SELECTOR, "#main-content > iframe")
+            driver.switch_to.frame(SB_tech_frame)
+
+            rubriker = driver.find_elements(
+                By.CLASS_NAME, "rj-carousel-item-market")
+
+            # HÄSTNAMN OCH VINNARODDS
+            # Klickar in på "Vinnare" bland rubrikerna
+            for obj in rubriker:
+                if obj.text == "Vinnare":
+                    obj.click()
+                    time.sleep(wait_time)
+                    break
 
-                # Fokuserar på den del av sidan som innehåller platsoddsen samt går in och
-                # hämtar alla relevanta element (ett per startande häst)
-                for spelform in spelformer:
-                    if spelform.text[0:6] == "Topp 3":
-                        ekipage_lista = spelform.find_elements(
-                            By.CLASS_NAME, "rj-ev-list__prelive-outright__button-holder")
+            # Hämtar samtliga ekipage på sidan i ett anrop, tillsammans med rubriken för den del av
+            # sidan (spelform) de ligger i
+            ekipage_lista = dom_extrahera(
+                driver, ".rj-ev-list__prelive-outright__button-holder",
+                {"Knappar": ".rj-ev-list__bet-btn__content"}, rubrik_selektor=".rj-ev-list__content")
+
+            # Extraherar hästarnas namn samt vinnarodds från den del av sidan som innehåller vinnaroddsen
+            for ekipage in ekipage_lista:
+                if ekipage["Rubrik"][0:7] == "Vinnare":
+                    hästnamn_lista.append(ekipage["Knappar"][0])
+                    vodds_lista.append(float(ekipage["Knappar"][1].replace(",", ".")))
+
+            rubriker = driver.find_elements(
+                By.CLASS_NAME, "rj-carousel-item-market")
+
+            # PLATSODDS
+            # Klickar in på "Placering" bland rubrikerna
+            for obj in rubriker:
+                if obj.text == "Placering":
+                    obj.click()
+                    time.sleep(wait_time)
+                    break
 
-                        # Loopar igenom elementen för samtliga ekipage, extraherar hästarnas platsodds och
-                        # appendar informationen i korrekt format till platsoddslistan
-                        for ekipage in ekipage_lista:
-                            podds_lista.append(float(ekipage.find_elements(
-                                By.CLASS_NAME, "rj-ev-list__bet-btn__content")[1].text.replace(",", ".")))
+            ekipage_lista = dom_extrahera(
+                driver, ".rj-ev-list__prelive-outright__button-holder",
+                {"Knappar": ".rj-ev-list__bet-btn__content"}, rubrik_selektor=".rj-ev-list__content")
 
-                # Kollar så att datan till loppet faktiskt hämtades, annars exekveras except-blocket
-                if len(hästnamn_lista) == 0:
-                    raise Exception
+            # Extraherar hästarnas platsodds från den del av sidan som innehåller platsoddsen
+            for ekipage in ekipage_lista:
+                if ekipage["Rubrik"][0:6] == "Topp 3":
+                    podds_lista.append(float(ekipage["Knappar"][1].replace(",", ".")))
 
-                else:
-                    # Lägger in all inhämtad information i dataframen
-                    for i in range(len(hästnamn_lista)):
-                        dummy_df = lopp_df
-                        hästnamn = hästnamn_lista[i]
-                        vodds = vodds_lista[i]
-                        podds = podds_lista[i]
-                        ny_rad = pd.DataFrame(
-                            [[hästnamn, vodds, podds]], columns=lopp_df.columns)
-                        lopp_df = pd.concat(
-                            [dummy_df, ny_rad], ignore_index=True)
-            except:
-                antal_lopp_odds_ej_kunnat_hämtas += 1
+            # Kollar så att datan till loppet faktiskt hämtades, annars exekveras except-blocket
+            if len(hästnamn_lista) == 0:
+                raise Exception
 
-            # När allt är färdigt läggs dataframen för loppet till pd_lista
-            pd_lista.append(lopp_df)
+            else:
+                # Lägger in all inhämtad information i dataframen
+                lopp_df = pd.DataFrame(list(zip(hästnamn_lista, vodds_lista, podds_lista)),
+                                       columns=lopp_df.columns)
+
+            # H2H
+            # Klickar in på H2H bland rubrikerna, varje matchup ligger i en egen del av sidan
+            # med knapparna [Häst A, Odds A, Häst B, Odds B]
+            if H2H and klicka_flik(driver, "rj-carousel-item-market", SVENSKASPEL_H2H_FLIK):
+                time.sleep(wait_time)
+                for matchup in dom_extrahera(driver, ".rj-ev-list__content",
+                                             {"Knappar": ".rj-ev-list__bet-btn__content"}):
+                    knappar = matchup["Knappar"]
+                    if len(knappar) == 4:
+                        matchup_rader.append(matchup_rad(loppnr, zip(knappar[0::2], knappar[1::2]), 2))
+        except:
+            antal_lopp_odds_ej_kunnat_hämtas += 1
 
-        driver.quit()
+        # När allt är färdigt läggs dataframen för loppet till pd_lista
+        pd_lista.append(lopp_df)
 
-        if antal_lopp_odds_ej_kunnat_hämtas == till_lopp - från_lopp + 1:
-            print(
-                "Det uppstod ett fel i inhämtningen av oddsen, kontrollera så att de faktiskt ligger uppe")
-            return None
+    driver.quit()
 
-        else:
-            return pd_lista
+    if antal_lopp_odds_ej_kunnat_hämtas == till_lopp - från_lopp + 1:
+        print(
+            "Det uppstod ett fel i inhämtningen av oddsen, kontrollera så att de faktiskt ligger uppe")
+        return None
 
-        # GÖR KLART H2H
-        # GÖR KLART H2H
-        # GÖR KLART H2H
-        # GÖR KLART H2H
+    elif H2H:
+        return pd_lista, matchup_tabell(matchup_rader)
 
     else:
-        # Detta scenario innebär att H2H odds ska scrapeas
-        # för dem olika loppen
-        print("För närvarande ej kompatibel med H2H, endast V&P fungerar")
-
-        # GÖR KLART H2H
-        # GÖR KLART H2H
-        # GÖR KLART H2H
-        # GÖR KLART H2H
+        return pd_lista
 
 
 def betsson_scraper(
@@ -727,7 +1139,7 @@ def betsson_scraper(
     driver = webdriver.Chrome(path)
 
     # Går in på tävlingsdagen och väntar {initial_wait} sekunder på att allt ska laddas in
-    driver.get(länk)
+    selenium_get(driver, länk, "betsson")
     time.sleep(initial_wait)
 
     # Accepterar cookies
@@ -758,15 +1170,15 @@ def betsson_scraper(
                     time.sleep(wait_time)
                     break
 
-            # Samlar in samtliga startande ekipage
-            samtliga_startande = driver.find_elements(By.CLASS_NAME, "runner")
+            # Samlar in samtliga startande ekipage i ett anrop
+            samtliga_startande = dom_extrahera(
+                driver, ".runner", {"Häst": ".name", "VOdds": ".odds.fixed.win", "POdds": ".odds.fixed.place"})
 
+            rader = []
             for ekipage in samtliga_startande:
-                hästnamn = ekipage.find_element(By.CLASS_NAME, "name").text
-                vodds_str = ekipage.find_element(
-                    By.CLASS_NAME, "odds.fixed.win").text
-                podds_str = ekipage.find_element(
-                    By.CLASS_NAME, "odds.fixed.place").text
+                hästnamn = ekipage["Häst"][0]
+                vodds_str = ekipage["VOdds"][0]
+                podds_str = ekipage["POdds"][0]
 
                 # Om häst är STRUKEN sätts vinnarodds och platsodds till 999
                 if vodds_str == "STR":
@@ -776,11 +1188,8 @@ def betsson_scraper(
                     vodds = float(vodds_str)
                     podds = float(podds_str)
 
-                # Lägger denna data till dataframen för loppet
-                dummy_df = lopp_df
-                ny_rad = pd.DataFrame(
-                    [[hästnamn, vodds, podds]], columns=lopp_df.columns)
-                lopp_df = pd.concat([dummy_df, ny_rad], ignore_index=True)
+                rader.append([hästnamn, vodds, podds])
+            lopp_df = pd.DataFrame(rader, columns=lopp_df.columns)
 
         except:
             print(
@@ -814,7 +1223,6 @@ def unibet_scraper(
     :rtype: list of pd.DataFrames: Returnerar en lista av (antal hästar x 3) dataframes (en för varje lopp) med kolumner
             [Hästnamn, Vinnarodds, Platsodds]
     """
-
     # Initierar sessionen, se till att ha chromedriver i "Program"
     path = "/Applications/chromedriver"
     driver = webdriver.Chrome(path)
@@ -823,8 +1231,8 @@ def unibet_scraper(
     pd_lista = []
 
     # Går in på Unibets travavdelning
-    driver.get(
-        "https://www.unibet.se/betting/sports/filter/trotting/all/allGroups")
+    selenium_get(
+        driver, "https://www.unibet.se/betting/sports/filter/trotting/all/allGroups", "unibet")
 
     time.sleep(wait_time)
 
@@ -897,26 +1305,25 @@ def unibet_scraper(
         done = False
         while not done:
             try:
-                # Hämtar in tre kolumner från Unibet, en för hästnamn, en för vinnarodds
+                # Hämtar in tre kolumner från Unibet i ett anrop, en för hästnamn, en för vinnarodds
                 # samt en för platsodds
-                objekt = driver.find_elements(
-                    By.CLASS_NAME, "KambiBC-outcomes-list__column")
+                objekt = dom_extrahera(
+                    driver, ".KambiBC-outcomes-list__column",
+                    {"Etiketter": ".KambiBC-outcomes-list__label",
+                     "Strukna": ".KambiBC-outcomes-list__label.KambiBC-outcomes-list__label--scratched",
+                     "Odds": ".Button__StyledButton-sc-lvu29a-0"})
                 hästnamn_obj = objekt[0]
                 vodds_obj = objekt[1]
                 podds_obj = objekt[2]
 
                 # Sparar ner alla startande hästar i en lista, rensar bort strukna hästar
-                hästnamn_lista = [element.text for element in hästnamn_obj.find_elements(
-                    By.CLASS_NAME, "KambiBC-outcomes-list__label")[1:]]
-                strukna = [element.text for element in hästnamn_obj.find_elements(
-                    By.CLASS_NAME, "KambiBC-outcomes-list__label.KambiBC-outcomes-list__label--scratched")]
+                hästnamn_lista = hästnamn_obj["Etiketter"][1:]
+                strukna = hästnamn_obj["Strukna"]
 
                 # Gör samma sak för vinnarodds samt platsodds. Då raderna är tomma ifall ekipage är struket
                 # behövs ingen information rensas i detta fall
-                vodds_lista = [float(element.text) for element in vodds_obj.find_elements(
-                    By.CLASS_NAME, "Button__StyledButton-sc-lvu29a-0")]
-                podds_lista = [float(element.text) for element in podds_obj.find_elements(
-                    By.CLASS_NAME, "Button__StyledButton-sc-lvu29a-0")]
+                vodds_lista = [float(text) for text in vodds_obj["Odds"]]
+                podds_lista = [float(text) for text in podds_obj["Odds"]]
                 done = True
 
             except:
@@ -931,14 +1338,7 @@ def unibet_scraper(
                     hästnamn_lista.remove(häst)
 
         # Lägger in all inhämtad information i dataframen
-        for i in range(len(hästnamn_lista)):
-            dummy_df = lopp_df
-            hästnamn = hästnamn_lista[i]
-            vodds = vodds_lista[i]
-            podds = podds_lista[i]
-            ny_rad = pd.DataFrame(
-                [[hästnamn, vodds, podds]], columns=lopp_df.columns)
-            lopp_df = pd.concat([dummy_df, ny_rad], ignore_index=True)
+        lopp_df = pd.DataFrame(list(zip(hästnamn_lista, vodds_lista, podds_lista)), columns=lopp_df.columns)
 
         # När allt är färdigt läggs dataframen för loppet till pd_lista
         pd_lista.append(lopp_df)